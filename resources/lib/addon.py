@@ -10,7 +10,8 @@ try:  # Python 3
 except ImportError:  # Python 2
     from urllib import unquote_plus
 
-from kodiutils import end_of_directory, execute_builtin, get_global_setting, localize, log_access, notification, ok_dialog, refresh_caches
+from kodiutils import (Lazy, end_of_directory, execute_builtin, get_connection_pool_stats, get_global_setting, localize, log,
+                       log_access, log_error, notification, ok_dialog, refresh_caches)
 from utils import from_unicode, to_unicode
 
 plugin = Plugin()  # pylint: disable=invalid-name
@@ -33,7 +34,8 @@ def noop():
 @plugin.route('/cache/delete/<cache_file>')
 def delete_cache(cache_file='*.json'):
     """The API interface to delete caches"""
-    refresh_caches(cache_file=cache_file)
+    program = plugin.args.get('program', [None])[0]
+    refresh_caches(cache_file=cache_file, program=program)
 
 
 @plugin.route('/tokens/delete')
@@ -65,6 +67,19 @@ def watchlater(asset_id, title, url):
     ResumePoints().watchlater(asset_id=asset_id, title=to_unicode(unquote_plus(from_unicode(title))), url=url)
 
 
+@plugin.route('/scrape/watchlater/<path:url>/<title>')
+def scrape_watchlater(title, url):
+    """The API interface to watch an episode used by the context menu, looking up its asset_id by web scraping"""
+    from resumepoints import ResumePoints
+    from utils import reformat_url
+    from webscraper import get_asset_id
+    asset_id = get_asset_id(reformat_url(url, 'long'))
+    if asset_id is None:
+        log_error('Watch later failed, no asset_id found for {url}', url=url)
+        return
+    ResumePoints().watchlater(asset_id=asset_id, title=to_unicode(unquote_plus(from_unicode(title))), url=url)
+
+
 @plugin.route('/unwatchlater/<path:url>/<asset_id>/<title>')
 def unwatchlater(asset_id, title, url):
     """The API interface to unwatch an episode used by the context menu"""
@@ -337,6 +352,17 @@ def iptv_epg():
     IPTVManager(port).send_epg()
 
 
+@plugin.route('/xmltv')
+def xmltv():
+    """Export the TV guide as an XMLTV file"""
+    from xmltv import XMLTV
+    try:
+        XMLTV().write()
+    except (IOError, OSError) as exc:  # e.g. an unwritable XMLTV folder
+        log_error('XMLTV export failed: {error}', error=exc)
+        notification(message=localize(30989, error=exc))
+
+
 @plugin.route('/update/repos')
 def update_repos():
     """Force an update of the repositories"""
@@ -358,3 +384,4 @@ def run(argv):
     """Addon entry point from wrapper"""
     log_access(argv)
     plugin.run(argv)
+    log(3, 'Connection pool: {stats}', stats=Lazy(get_connection_pool_stats))
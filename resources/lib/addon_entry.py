@@ -7,6 +7,7 @@ import xbmcaddon
 import kodiutils
 
 kodiutils.ADDON = xbmcaddon.Addon()
+kodiutils.invalidate_settings()
 
 if __name__ == '__main__':
     from sys import argv
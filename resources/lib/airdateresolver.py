@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""This module resolves air dates (e.g. from the PVR guide) into VRT NU EPG broadcasts."""
+
+from __future__ import absolute_import, division, unicode_literals
+from datetime import timedelta
+
+from helperobjects import ScheduleIndex
+from kodiutils import log, parallel_map, ttl
+
+
+class AirDateResolver:
+    """Find the broadcast of a channel airing at a given date and time"""
+
+    _BOUNDARY_MARGIN = timedelta(hours=2)  # Also index the adjacent schedule for air dates near the 06:00 boundary
+    _RESOLVED_SIZE = 256
+    _windows = dict()  # Per channel and schedule dates a ScheduleIndex and its creation time, shared between instances
+    _resolved = dict()  # Per channel and air date the resolved broadcast and its resolution time, shared between instances
+
+    def __init__(self):
+        """Initialize Air Date Resolver class"""
+
+    @staticmethod
+    def schedule_date(date):
+        """Return the date of the schedule listing a given datetime, schedules run from 06:00 until 06:00"""
+        import dateutil.tz
+        return (date.astimezone(dateutil.tz.gettz('Europe/Brussels')) - timedelta(hours=6)).date()
+
+    def schedule_dates(self, start_date, end_date):
+        """Return the sorted schedule dates covering a period, including adjacent schedules near the day boundary"""
+        return sorted(set(self.schedule_date(date) for date in (start_date - self._BOUNDARY_MARGIN, start_date,
+                                                                end_date, end_date + self._BOUNDARY_MARGIN)))
+
+    def get_schedule_index(self, channel_id, dates):
+        """Return a ScheduleIndex of a channel over multiple schedule dates"""
+        from time import time
+        from tvguide import TVGuide
+        key = (channel_id,) + tuple(dates)
+        cached = self._windows.get(key)
+        if cached and time() - cached[1] < ttl('indirect'):
+            return cached[0]
+
+        # Adjacent schedules may both list a broadcast crossing the day boundary
+        episodes = dict()
+        for schedule in parallel_map(TVGuide.get_schedule, dates):
+            for episode in (schedule or {}).get(channel_id, []):
+                episodes[(episode.get('startTime'), episode.get('vrt.whatson-id'))] = episode
+        schedule_index = ScheduleIndex(list(episodes.values()))
+        if not schedule_index.episodes:
+            return schedule_index
+
+        for window, (_, created) in list(self._windows.items()):
+            if time() - created >= ttl('indirect'):
+                del self._windows[window]
+        self._windows[key] = (schedule_index, time())
+        return schedule_index
+
+    def resolve(self, channel_id, start_date, end_date=None):
+        """Return the EPG entry of the broadcast overlapping most with, or airing closest to, a given air date"""
+        from time import time
+        key = (channel_id, start_date, end_date)
+        resolved = self._resolved.get(key)
+        if resolved and time() - resolved[1] < ttl('indirect'):
+            return resolved[0]
+
+        schedule_index = self.get_schedule_index(channel_id, self.schedule_dates(start_date, end_date or start_date))
+        if end_date:
+            position = schedule_index.overlapping(start_date, end_date)
+            if position is None:
+                position = schedule_index.nearest_midpoint(start_date + (end_date - start_date) // 2)
+        else:
+            position = schedule_index.nearest_start(start_date)
+        if position is None:
+            return None
+
+        episode = schedule_index.episodes[position]
+        log(3, 'Resolved air date {start} on {channel} to {whatson_id}', start=start_date, channel=channel_id,
+            whatson_id=episode.get('vrt.whatson-id'))
+        if len(self._resolved) >= self._RESOLVED_SIZE:
+            self._resolved.clear()
+        self._resolved[key] = (episode, time())
+        return episode
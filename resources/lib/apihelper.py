@@ -11,12 +11,12 @@ except ImportError:  # Python 2
     from urllib2 import unquote
 
 from data import CHANNELS
-from helperobjects import TitleItem
-from kodiutils import (delete_cached_thumbnail, get_cache, get_cached_url_json, get_global_setting,
+from helperobjects import EpisodeIndex, TitleItem
+from kodiutils import (cache_tags, delete_cached_thumbnail, get_cache, get_cached_url_json, get_global_setting,
                        get_setting_bool, get_setting_int, get_url_json, has_addon, localize,
-                       localize_from_data, log, ttl, update_cache, url_for)
+                       localize_from_data, log, parallel_map, ttl, update_cache, url_for)
 from metadata import Metadata
-from utils import (add_https_proto, html_to_kodi, find_entry, from_unicode, play_url_to_id,
+from utils import (add_https_proto, chunk_values, html_to_kodi, find_entry, from_unicode, parse_iso8601, play_url_to_id,
                    program_to_url, realpage, url_to_program, youtube_to_plugin_url)
 
 
@@ -27,6 +27,9 @@ class ApiHelper:
     _VRTNU_SEARCH_URL = 'https://vrtnu-api.vrt.be/search'
     _VRTNU_SUGGEST_URL = 'https://vrtnu-api.vrt.be/suggest'
     _VRTNU_SCREENSHOT_URL = 'https://vrtnu-api.vrt.be/screenshots'
+    _MAX_FACET_LENGTH = 4000  # Split longer facet lists to keep Search API urls well below 8 KiB
+    _EPISODE_INDEXES_SIZE = 32  # Keep the episode indexes of this many programs in memory
+    _episode_indexes = dict()  # Per program an EpisodeIndex and its creation time, shared between instances
 
     def __init__(self, _favorites, _resumepoints):
         """Constructor for the ApiHelper class"""
@@ -136,6 +139,9 @@ class ApiHelper:
         if use_favorites:
             favorite_programs = self._favorites.programs()
 
+        # Scrape the asset_ids of episodes without an assetPath at once
+        self._metadata.resolve_asset_ids(episodes)
+
         for episode in episodes:
             # VRT API workaround: seasonTitle facet behaves as a partial match regex,
             # so we have to filter out the episodes from seasons that don't exactly match.
@@ -261,6 +267,35 @@ class ApiHelper:
         episodes = self.get_episodes(keywords=keywords, page=page)
         return self.__map_episodes(episodes, titletype='recent')
 
+    def get_episode_index(self, program):
+        """Get an index of all episodes of a program, built from cached VRT Search API data"""
+        from time import time
+        cached = self._episode_indexes.get(program)
+        if cached and time() - cached[1] < ttl('indirect'):
+            return cached[0]
+
+        cache_file = 'episodes.{program}.json'.format(program=program)
+        search_json = get_cache(cache_file, ttl=ttl('indirect'))
+        if search_json is None:
+            search_json = dict(results=self.get_episodes(program=program, season='allseasons'))
+            if search_json.get('results'):
+                from json import dumps
+                update_cache(cache_file, dumps(search_json), ttl=ttl('indirect'), tags=cache_tags(search_json))
+
+        episode_index = EpisodeIndex(search_json.get('results', []))
+        if len(self._episode_indexes) >= self._EPISODE_INDEXES_SIZE:
+            self._episode_indexes.clear()
+        self._episode_indexes[program] = (episode_index, time())
+        return episode_index
+
+    def find_episode_index(self, video_id=None, whatson_id=None, video_url=None):
+        """Find an already built episode index containing an episode by videoId, whatsonId or url"""
+        from time import time
+        for episode_index, created in self._episode_indexes.values():
+            if time() - created < ttl('indirect') and episode_index.find(video_id=video_id, whatson_id=whatson_id, video_url=video_url) is not None:
+                return episode_index
+        return None
+
     def get_upnext(self, info):
         """Get up next data from VRT Search API"""
         program = info.get('program')
@@ -269,29 +304,27 @@ class ApiHelper:
         current_ep_no = None
 
         # Get current episode unique identifier
-        ep_id = play_url_to_id(path)
-
-        # Get all episodes from current program and sort by program, seasonTitle and episodeNumber
-        episodes = sorted(self.get_episodes(keywords=program), key=lambda k: (k.get('program'), k.get('seasonTitle'), k.get('episodeNumber')))
-        upnext = {}
-        for episode in episodes:
-            if ep_id.get('whatson_id') == episode.get('whatsonId') or \
-               ep_id.get('video_id') == episode.get('videoId') or \
-               ep_id.get('video_url') == episode.get('url'):
-                season = episode.get('seasonTitle')
-                current_ep_no = episode.get('episodeNumber')
-                program = episode.get('program')
-                upnext['current'] = episode
-                try:
-                    next_episode = episodes[episodes.index(episode) + 1]
-                except IndexError:
-                    pass
-                else:
-                    if next_episode.get('program') == program and next_episode.get('episodeNumber') != current_ep_no:
-                        upnext['next'] = next_episode
-
-        current_ep = upnext.get('current')
-        next_ep = upnext.get('next')
+        ep_id = dict(video_id=info.get('video_id')) if info.get('video_id') else play_url_to_id(path)
+
+        # Look up the current and next episode in the index of all episodes of the current program
+        episode_index = self.find_episode_index(**ep_id)
+        if episode_index is None:
+            program_url = info.get('program_url')
+            if not program_url:
+                episode = self.get_single_episode_data(**ep_id)
+                program_url = episode.get('programUrl') if episode else None
+            if program_url:
+                episode_index = self.get_episode_index(url_to_program(program_url))
+
+        current_ep = None
+        next_ep = None
+        if episode_index:
+            current_ep = episode_index.get_episode(**ep_id)
+            next_ep = episode_index.get_next_episode(**ep_id)
+        if current_ep:
+            season = current_ep.get('seasonTitle')
+            current_ep_no = current_ep.get('episodeNumber')
+            program = current_ep.get('program')
 
         if next_ep is None:
             if current_ep is not None and current_ep.get('episodeNumber') == current_ep.get('seasonNbOfEpisodes') is not None:
@@ -363,6 +396,11 @@ class ApiHelper:
 
     def get_single_episode_data(self, video_id=None, whatson_id=None, video_url=None):
         """Get single episode api data by videoId, whatsonId or url"""
+        # Avoid an API request when the episode is part of an episode index already
+        episode_index = self.find_episode_index(video_id=video_id, whatson_id=whatson_id, video_url=video_url)
+        if episode_index:
+            return episode_index.get_episode(video_id=video_id, whatson_id=whatson_id, video_url=video_url)
+
         episode = None
         api_data = list()
         if video_id:
@@ -380,15 +418,19 @@ class ApiHelper:
         video = None
         episode = self.get_single_episode_data(video_id=video_id, whatson_id=whatson_id, video_url=video_url)
         if episode:
-            video_item = TitleItem(
-                label=self._metadata.get_label(episode),
-                art_dict=self._metadata.get_art(episode),
-                info_dict=self._metadata.get_info_labels(episode),
-                prop_dict=self._metadata.get_properties(episode),
-            )
-            video = dict(listitem=video_item, video_id=episode.get('videoId'), publication_id=episode.get('publicationId'))
+            video = self.episode_to_video(episode)
         return video
 
+    def episode_to_video(self, episode):
+        """Return a playable video from single episode api data"""
+        video_item = TitleItem(
+            label=self._metadata.get_label(episode),
+            art_dict=self._metadata.get_art(episode),
+            info_dict=self._metadata.get_info_labels(episode),
+            prop_dict=self._metadata.get_properties(episode),
+        )
+        return dict(listitem=video_item, video_id=episode.get('videoId'), publication_id=episode.get('publicationId'), episode=episode)
+
     def get_episode_by_air_date(self, channel_name, start_date, end_date=None):
         """Get an episode of a program given the channel and the air date in iso format (2019-07-06T19:35:00)"""
         channel = find_entry(CHANNELS, 'name', channel_name)
@@ -411,44 +453,22 @@ class ApiHelper:
                 return None
         video = None
         now = datetime.now(dateutil.tz.gettz('Europe/Brussels'))
-        if onairdate.hour < 6:
-            schedule_date = onairdate - timedelta(days=1)
-        else:
-            schedule_date = onairdate
-        schedule_datestr = schedule_date.isoformat().split('T')[0]
-        url = 'https://www.vrt.be/bin/epg/schedule.{date}.json'.format(date=schedule_datestr)
-        schedule_json = get_url_json(url, fail={})
-        episodes = schedule_json.get(channel.get('id'), [])
-        if not episodes:
-            return None
 
-        # Guess the episode
-        episode_guess = None
-        if not offairdate:
-            mindate = min(abs(onairdate - dateutil.parser.parse(episode.get('startTime'))) for episode in episodes)
-            episode_guess = next((episode for episode in episodes if abs(onairdate - dateutil.parser.parse(episode.get('startTime'))) == mindate), None)
-        else:
-            duration = offairdate - onairdate
-            midairdate = onairdate + timedelta(seconds=duration.total_seconds() / 2)
-            mindate = min(abs(midairdate
-                              - (dateutil.parser.parse(episode.get('startTime'))
-                                 + timedelta(seconds=(dateutil.parser.parse(episode.get('endTime'))
-                                                      - dateutil.parser.parse(episode.get('startTime'))).total_seconds() / 2))) for episode in episodes)
-            episode_guess = next((episode for episode in episodes
-                                  if abs(midairdate
-                                         - (dateutil.parser.parse(episode.get('startTime'))
-                                            + timedelta(seconds=(dateutil.parser.parse(episode.get('endTime'))
-                                                                 - dateutil.parser.parse(episode.get('startTime'))).total_seconds() / 2))) == mindate), None)
+        # Guess the episode overlapping most with the broadcast, or closest to its start time
+        from airdateresolver import AirDateResolver
+        episode_guess = AirDateResolver().resolve(channel.get('id'), onairdate, offairdate)
+        if not episode_guess:
+            return None
 
         if episode_guess and episode_guess.get('vrt.whatson-id', None):
-            offairdate_guess = dateutil.parser.parse(episode_guess.get('endTime'))
+            offairdate_guess = parse_iso8601(episode_guess.get('endTime'))
             video = self.get_single_episode(whatson_id=episode_guess.get('vrt.whatson-id'))
             if video:
                 return video
 
             # Airdate live2vod feature: use livestream cache of last 24 hours if no video was found
 
-            if now - timedelta(hours=24) <= dateutil.parser.parse(episode_guess.get('endTime')) <= now:
+            if now - timedelta(hours=24) <= offairdate_guess <= now:
                 start_date = onairdate.astimezone(dateutil.tz.UTC).isoformat()[0:19]
                 end_date = offairdate_guess.astimezone(dateutil.tz.UTC).isoformat()[0:19]
 
@@ -486,7 +506,7 @@ class ApiHelper:
         if len(api_data) != 1:
             return None
         episode = api_data[0]
-        log(2, str(episode))
+        log(2, '{episode}', episode=episode)
         video_item = TitleItem(
             label=self._metadata.get_label(episode),
             art_dict=self._metadata.get_art(episode),
@@ -523,6 +543,7 @@ class ApiHelper:
                 'size': '300',
             }
 
+        facet = None
         if variety:
             season = 'allseasons'
 
@@ -540,20 +561,25 @@ class ApiHelper:
             if variety == 'watchlater':
                 self._resumepoints.refresh(ttl=ttl('direct'))
                 episode_urls = self._resumepoints.watchlater_urls()
-                params['facets[url]'] = '[%s]' % (','.join(episode_urls))
+                facet = ('facets[url]', episode_urls)
 
             if variety == 'continue':
                 self._resumepoints.refresh(ttl=ttl('direct'))
                 episode_urls = self._resumepoints.resumepoints_urls()
-                params['facets[url]'] = '[%s]' % (','.join(episode_urls))
+                facet = ('facets[url]', episode_urls)
 
             if use_favorites:
                 program_urls = [program_to_url(p, 'medium') for p in self._favorites.programs()]
-                params['facets[programUrl]'] = '[%s]' % (','.join(program_urls))
+                facet = ('facets[programUrl]', program_urls)
             elif variety in ('offline', 'recent'):
                 channel_filter = [channel.get('name') for channel in CHANNELS if get_setting_bool(channel.get('name'), default=True)]
                 params['facets[programBrands]'] = '[%s]' % (','.join(channel_filter))
 
+            # Long facet lists are queried in chunks, see __get_chunked_search_json()
+            if facet and len(','.join(facet[1])) <= self._MAX_FACET_LENGTH:
+                params[facet[0]] = '[%s]' % (','.join(facet[1]))
+                facet = None
+
         if program:
             params['facets[programUrl]'] = program_to_url(program, 'medium')
 
@@ -587,10 +613,22 @@ class ApiHelper:
         if video_url:
             params['facets[url]'] = video_url
 
+        if facet and page:
+            # Every chunk needs the results up to the requested page, the page is selected after merging
+            params['size'] = min(page * params.pop('size'), 300)
+            del params['from']
+
         # Construct VRT NU Search API Url and get api data
         querystring = '&'.join('{}={}'.format(key, value) for key, value in list(params.items()))
         search_url = self._VRTNU_SEARCH_URL + '?' + querystring.replace(' ', '%20')  # Only encode spaces to minimize url length
-        if cache_file:
+        if facet:
+            search_json = get_cache(cache_file, ttl=ttl('indirect')) if cache_file else None
+            if search_json is None:
+                search_json = self.__get_chunked_search_json(search_url, facet, page=page)
+                if cache_file and search_json.get('results'):
+                    from json import dumps
+                    update_cache(cache_file, dumps(search_json), ttl=ttl('indirect'), tags=cache_tags(search_json))
+        elif cache_file:
             search_json = get_cached_url_json(url=search_url, cache=cache_file, ttl=ttl('indirect'), fail={})
         else:
             search_json = get_url_json(url=search_url, fail={})
@@ -614,15 +652,67 @@ class ApiHelper:
         total_results = search_json.get('meta').get('total_results')
 
         if all_items and total_results > api_page_size:
-            for api_page in range(1, api_pages):
-                api_page_url = search_url + '&from=' + str(api_page * api_page_size + 1)
-                api_page_json = get_url_json(api_page_url)
+            # Fetch the remaining pages concurrently, a failing page does not discard the others
+            api_page_urls = [search_url + '&from=' + str(api_page * api_page_size + 1) for api_page in range(1, api_pages)]
+            for api_page_json in parallel_map(get_url_json, api_page_urls):
                 if api_page_json is not None:
                     episodes += api_page_json.get('results', [{}])
 
         # Return episodes
         return episodes
 
+    def __get_chunked_search_json(self, search_url, facet, page=None):
+        """Query the Search API concurrently for chunks of a long facet list, and merge the results"""
+        facet_key, facet_values = facet
+        items_per_page = get_setting_int('itemsperpage', default=50)
+        chunk_urls = ['%s&%s=[%s]' % (search_url, facet_key, ','.join(chunk)) for chunk in chunk_values(facet_values, self._MAX_FACET_LENGTH)]
+        log(3, 'Split {key} facet of {count} values in {chunks} Search API queries', key=facet_key, count=len(facet_values), chunks=len(chunk_urls))
+
+        results = []
+        api_page_urls = []
+        for chunk_url, chunk_json in zip(chunk_urls, parallel_map(get_url_json, chunk_urls)):
+            if not chunk_json:
+                continue
+            results += chunk_json.get('results', [])
+            api_pages = chunk_json.get('meta').get('pages').get('total')
+            api_page_size = chunk_json.get('meta').get('pages').get('size')
+            if page:
+                # Paged listings only need the results up to the requested page
+                api_pages = min(api_pages, -(-page * items_per_page // api_page_size))
+            api_page_urls += [chunk_url + '&from=' + str(api_page * api_page_size + 1) for api_page in range(1, api_pages)]
+        for api_page_json in parallel_map(get_url_json, api_page_urls):
+            if api_page_json is not None:
+                results += api_page_json.get('results', [])
+
+        results = self.merge_episodes(results)
+        if page:
+            results = results[(page - 1) * items_per_page:page * items_per_page]
+        return dict(
+            meta=dict(pages=dict(total=1, size=len(results)), total_results=len(results)),
+            results=results,
+        )
+
+    @staticmethod
+    def merge_episodes(episodes):
+        """Deduplicate episodes from multiple Search API queries by videoId, and sort them most recent first"""
+
+        def sort_key(episode):
+            """Sort by publication date, like the listings do ('dateadded', descending)"""
+            asset_on_time = episode.get('assetOnTime')
+            return (bool(asset_on_time), parse_iso8601(asset_on_time) if asset_on_time else None)
+
+        unique_episodes = []
+        video_ids = set()
+        for episode in episodes:
+            video_id = episode.get('videoId')
+            if video_id:
+                if video_id in video_ids:
+                    continue
+                video_ids.add(video_id)
+            unique_episodes.append(episode)
+        unique_episodes.sort(key=sort_key, reverse=True)
+        return unique_episodes
+
     def get_live_screenshot(self, channel):
         """Get a live screenshot for a given channel, only supports Eén, Canvas and Ketnet"""
         url = '%s/%s.jpg' % (self._VRTNU_SCREENSHOT_URL, channel)
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Implements the storage backends for the HTTP cache"""
+
+from __future__ import absolute_import, division, unicode_literals
+from threading import Lock
+from time import time
+
+from kodiutils import (Lazy, addon_profile, delete, exists, get_cache_dir, get_cache_path, listdir, log, log_error,
+                       mkdirs, open_file, stat_file, update_timestamp, write_cache)
+from utils import to_unicode
+
+ACCESS_RESOLUTION = 60  # Only record cache accesses once per minute, to avoid writes
+
+
+class FileCacheStore:
+    """Store every cache entry as a separate file in a cache directory (using xbmcvfs)"""
+
+    def __init__(self, cache_dir):
+        """Initialize the file cache store"""
+        self.cache_dir = cache_dir
+
+    def _path(self, key):
+        """Return the path of a cache file"""
+        return get_cache_path(key, self.cache_dir)
+
+    @staticmethod
+    def _validators_path(path):
+        """Return the path of the file holding the HTTP validators of a cache file"""
+        return path + '.validators'
+
+    def get(self, key, ttl=None):
+        """Return the data of a cache entry, if it exists and is fresh"""
+        path = self._path(key)
+        if not exists(path):
+            return None
+        stat = stat_file(path)
+        now = time()
+        if now - stat.st_atime() > ACCESS_RESOLUTION:
+            # Record the access time for LRU eviction, without touching the fetch time
+            from os import utime
+            utime(path, (now, stat.st_mtime()))
+        if ttl is not None and now >= stat.st_mtime() + ttl:
+            return None
+        with open_file(path, 'r') as fdesc:
+            return fdesc.read()
+
+    def put(self, key, data, validators=None, ttl=None, tags=None, compress=False):  # pylint: disable=unused-argument
+        """Store the data of a cache entry, avoiding writes if possible (cache files are never compressed)"""
+        path = self._path(key)
+        if not exists(path):
+            # Create cache directory if missing
+            directory = get_cache_dir(self.cache_dir)
+            if not exists(directory):
+                mkdirs(directory)
+            write_cache(path, data)
+            self._update_validators(path, validators)
+            return
+
+        self._update_validators(path, validators)
+        with open_file(path, 'r') as fdesc:
+            cache = fdesc.read()
+
+        # Avoid writes if possible (i.e. SD cards)
+        if cache == data:
+            update_timestamp(path)
+            return
+
+        write_cache(path, data)
+
+    def touch(self, key, timestamp=None):
+        """Mark a cache entry as fetched at a given time (default: now)"""
+        from os import utime
+        path = self._path(key)
+        if timestamp is None:
+            update_timestamp(path)
+        else:
+            utime(path, (timestamp, timestamp))
+
+    def get_validators(self, key):
+        """Return the HTTP validators (ETag, Last-Modified) of a cache entry"""
+        from json import load
+        path = self._path(key)
+        if not exists(path):
+            return None
+        validators_path = self._validators_path(path)
+        if not exists(validators_path):
+            return None
+        with open_file(validators_path, 'r') as fdesc:
+            try:
+                return load(fdesc)
+            except ValueError:  # No JSON object could be decoded
+                return None
+
+    def _update_validators(self, path, validators):
+        """Store the HTTP validators of a cache file, or remove stale validators"""
+        validators_path = self._validators_path(path)
+        if not validators:
+            # Data that did not come from the server cannot be revalidated
+            if exists(validators_path):
+                delete(validators_path)
+            return
+        from json import dumps
+        with open_file(validators_path, 'w') as fdesc:
+            fdesc.write(dumps(validators))
+
+    def delete(self, key):
+        """Delete a cache entry"""
+        path = self._path(key)
+        if exists(path):
+            delete(path)
+        self._update_validators(path, None)
+
+    def prune(self, max_size, max_entries):
+        """Evict the least recently used cache files beyond a maximum total size and number of entries"""
+        directory = get_cache_dir(self.cache_dir)
+        if not exists(directory):
+            return 0, 0
+        _, files = listdir(directory)
+        entries = []
+        for filename in files:
+            if filename.endswith('.validators'):
+                continue
+            stat = stat_file(get_cache_path(filename, self.cache_dir))
+            entries.append((stat.st_atime(), filename, stat.st_size()))
+        entries.sort()
+        size = sum(entry[2] for entry in entries)
+        removed = reclaimed = 0
+        for _, filename, length in entries:
+            if size - reclaimed <= max_size and len(entries) - removed <= max_entries:
+                break
+            self.delete(filename)
+            removed += 1
+            reclaimed += length
+        return removed, reclaimed
+
+    def invalidate_tags(self, *tags):  # pylint: disable=unused-argument
+        """Delete all cache entries referencing any of the tags"""
+        # Cache files have no reverse index, so invalidate all of them
+        self.invalidate('*.json')
+
+    def invalidate(self, *patterns):
+        """Delete all cache entries matching any of the patterns"""
+        import fnmatch
+        directory = get_cache_dir(self.cache_dir)
+        if not exists(directory):
+            return
+        _, files = listdir(directory)
+        removes = set()
+        for expr in patterns:
+            removes.update(fnmatch.filter(files, expr))
+        for filename in removes:
+            self.delete(filename)
+
+
+class SQLiteCacheStore:
+    """Store all cache entries of a cache directory in a single indexed SQLite database"""
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, body TEXT NOT NULL, fetched REAL NOT NULL, ttl INTEGER, validators TEXT, accessed REAL)',
+        'CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key))',
+        'CREATE INDEX IF NOT EXISTS tags_key ON tags (key)',
+    ]
+
+    def __init__(self, cache_dir):
+        """Open the cache database and migrate existing cache files"""
+        import os
+        import sqlite3
+        self.cache_dir = cache_dir
+        self._lock = Lock()
+        profile = addon_profile()
+        if not exists(profile):
+            mkdirs(profile)
+        self._connection = sqlite3.connect(os.path.join(profile, cache_dir + '.db'), timeout=10, check_same_thread=False)
+        with self._lock, self._connection:
+            for statement in self.SCHEMA:
+                self._connection.execute(statement)
+            columns = [row[1] for row in self._connection.execute('PRAGMA table_info(cache)')]
+            if 'accessed' not in columns:
+                self._connection.execute('ALTER TABLE cache ADD COLUMN accessed REAL')
+        self._migrate()
+
+    def _execute(self, query, *args):
+        """Execute a query in a transaction and return all rows"""
+        with self._lock, self._connection:
+            return self._connection.execute(query, args).fetchall()
+
+    def get(self, key, ttl=None):
+        """Return the data of a cache entry, if it exists and is fresh"""
+        now = time()
+        if ttl is None:
+            rows = self._execute('SELECT body, accessed FROM cache WHERE key = ?', key)
+        else:
+            rows = self._execute('SELECT body, accessed FROM cache WHERE key = ? AND fetched > ?', key, now - ttl)
+        if not rows:
+            return None
+        body, accessed = rows[0]
+        if not isinstance(body, type('')):
+            body = bytes(body)  # Compressed data
+        if accessed is None or now - accessed > ACCESS_RESOLUTION:
+            # Record the access time for LRU eviction
+            self._execute('UPDATE cache SET accessed = ? WHERE key = ?', now, key)
+        return body
+
+    def put(self, key, data, validators=None, ttl=None, tags=None, compress=False):
+        """Store the data of a cache entry, optionally gzip compressed"""
+        from json import dumps
+        from sqlite3 import Binary
+        data = Binary(compress_data(data)) if compress else to_unicode(data)
+        validators = dumps(validators) if validators else None
+        log(3, "Write cache '{key}'.", key=key)
+        with self._lock, self._connection:
+            now = time()
+            self._connection.execute('INSERT OR REPLACE INTO cache (key, body, fetched, ttl, validators, accessed) VALUES (?, ?, ?, ?, ?, ?)',
+                                     (key, data, now, ttl, validators, now))
+            if tags is not None:
+                self._connection.execute('DELETE FROM tags WHERE key = ?', (key,))
+                self._connection.executemany('INSERT OR IGNORE INTO tags (tag, key) VALUES (?, ?)', [(tag, key) for tag in tags])
+
+    def touch(self, key, timestamp=None):
+        """Mark a cache entry as fetched at a given time (default: now)"""
+        log(3, "Cache '{key}' has not changed, updating timestamp only.", key=key)
+        self._execute('UPDATE cache SET fetched = ? WHERE key = ?', time() if timestamp is None else timestamp, key)
+
+    def get_validators(self, key):
+        """Return the HTTP validators (ETag, Last-Modified) of a cache entry"""
+        from json import loads
+        rows = self._execute('SELECT validators FROM cache WHERE key = ?', key)
+        if not rows or not rows[0][0]:
+            return None
+        return loads(rows[0][0])
+
+    def delete(self, key):
+        """Delete a cache entry"""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self._connection.execute('DELETE FROM tags WHERE key = ?', (key,))
+
+    def invalidate(self, *patterns):
+        """Delete all cache entries matching any of the patterns"""
+        # GLOB uses the primary key index for patterns with a literal prefix, like 'continue-*.json'
+        with self._lock, self._connection:
+            for pattern in patterns:
+                self._connection.execute('DELETE FROM tags WHERE key IN (SELECT key FROM cache WHERE key GLOB ?)', (pattern,))
+                self._connection.execute('DELETE FROM cache WHERE key GLOB ?', (pattern,))
+
+    def prune(self, max_size, max_entries):
+        """Evict the least recently used cache entries beyond a maximum total size and number of entries"""
+        with self._lock, self._connection:
+            entries = self._connection.execute('SELECT key, length(CAST(body AS BLOB)) FROM cache ORDER BY accessed, fetched, rowid').fetchall()
+            size = sum(entry[1] for entry in entries)
+            removed = reclaimed = 0
+            for key, length in entries:
+                if size - reclaimed <= max_size and len(entries) - removed <= max_entries:
+                    break
+                self._connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+                self._connection.execute('DELETE FROM tags WHERE key = ?', (key,))
+                removed += 1
+                reclaimed += length
+        return removed, reclaimed
+
+    def invalidate_tags(self, *tags):
+        """Delete all cache entries referencing any of the tags"""
+        with self._lock, self._connection:
+            keys = set()
+            for tag in tags:
+                keys.update(row[0] for row in self._connection.execute('SELECT key FROM tags WHERE tag = ?', (tag,)))
+            for key in keys:
+                self._connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+                self._connection.execute('DELETE FROM tags WHERE key = ?', (key,))
+        if keys:
+            log(2, 'Invalidated caches {keys} referencing {tags}', keys=Lazy(sorted, keys), tags=list(tags))
+
+    def _migrate(self):
+        """Move cache files from an existing cache directory into the database"""
+        from json import loads
+        directory = get_cache_dir(self.cache_dir)
+        if not exists(directory):
+            return
+        _, files = listdir(directory)
+        entries = []
+        for filename in files:
+            if filename.endswith('.validators'):
+                continue
+            path = get_cache_path(filename, self.cache_dir)
+            with open_file(path, 'r') as fdesc:
+                data = to_unicode(fdesc.read())
+            validators = None
+            if filename + '.validators' in files:
+                with open_file(path + '.validators', 'r') as fdesc:
+                    validators = to_unicode(fdesc.read())
+                try:
+                    loads(validators)
+                except ValueError:  # No JSON object could be decoded
+                    validators = None
+            stat = stat_file(path)
+            entries.append((filename, data, stat.st_mtime(), validators, stat.st_atime()))
+        if entries:
+            log(2, 'Migrating {count} cache files to the cache database', count=len(entries))
+            with self._lock, self._connection:
+                self._connection.executemany('INSERT OR IGNORE INTO cache (key, body, fetched, validators, accessed) VALUES (?, ?, ?, ?, ?)', entries)
+        for filename in files:
+            delete(get_cache_path(filename, self.cache_dir))
+
+    def close(self):
+        """Close the cache database"""
+        with self._lock:
+            self._connection.close()
+
+
+def compress_data(data):
+    """Return gzip compressed data"""
+    import zlib
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    return compressor.compress(data) + compressor.flush()
+
+
+def open_store(cache_dir, backend='sqlite'):
+    """Return a cache store for a cache directory, falling back to files if SQLite is unavailable"""
+    if backend == 'sqlite':
+        try:
+            return SQLiteCacheStore(cache_dir)
+        except ImportError as exc:
+            log_error('SQLite is not available, using cache files: {error}', error=exc)
+        except Exception as exc:  # pylint: disable=broad-except
+            log_error('Cannot open the cache database, using cache files: {error}', error=exc)
+    return FileCacheStore(cache_dir)
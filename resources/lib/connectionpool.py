@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Implements a per-process pool of persistent HTTP(S) connections for urllib"""
+
+from __future__ import absolute_import, division, unicode_literals
+from errno import ECONNRESET
+from socket import error as SocketError
+from threading import Lock
+from time import time
+
+try:  # Python 3
+    from http.client import BadStatusLine, HTTPConnection, HTTPException, HTTPSConnection
+    from urllib.error import URLError
+    from urllib.request import HTTPHandler, HTTPSHandler
+except ImportError:  # Python 2
+    from httplib import BadStatusLine, HTTPConnection, HTTPException, HTTPSConnection
+    from urllib2 import HTTPHandler, HTTPSHandler, URLError
+
+NO_STATUS_LINES = (  # The BadStatusLine of an empty response, per Python version
+    "''",  # Python 2.7.0 - 2.7.14
+    'No status line received - the server has closed the connection',  # Python 2.7.15+
+)
+
+
+class ConnectionPool:
+    """Keep idle HTTP(S) connections alive per host so they can be reused by later requests"""
+
+    def __init__(self, maxsize=8, max_idle_time=50):
+        """Initialize the connection pool"""
+        self._lock = Lock()
+        self._connections = dict()  # Per (scheme, host) a list of [connection, last response, last used]
+        self.maxsize = maxsize
+        self.max_idle_time = max_idle_time
+        self.requests = 0
+        self.opened = 0
+        self.reused = 0
+        self.stale = 0
+
+    def get(self, key):
+        """Check out an idle connection for a given (scheme, host), if any"""
+        now = time()
+        with self._lock:
+            self.requests += 1
+            entries = self._connections.get(key, [])
+            for entry in list(entries):
+                connection, response, last_used = entry
+                if not self.is_idle(response):
+                    continue
+                entries.remove(entry)
+                if now - last_used > self.max_idle_time:
+                    # The server has most likely closed this connection already
+                    connection.close()
+                    continue
+                self.reused += 1
+                return connection
+        return None
+
+    def put(self, key, connection, response):
+        """Check in a connection that can be reused once its response has been consumed"""
+        with self._lock:
+            entries = self._connections.setdefault(key, [])
+            entries.append([connection, response, time()])
+            # Drop the oldest connections when we exceed the pool size
+            while len(entries) > self.maxsize:
+                entries.pop(0)[0].close()
+
+    def opened_connection(self):
+        """Account for a newly opened connection"""
+        with self._lock:
+            self.opened += 1
+
+    def stale_connection(self):
+        """Account for a pooled connection that was closed by the server"""
+        with self._lock:
+            self.stale += 1
+            self.reused -= 1
+
+    @staticmethod
+    def is_idle(response):
+        """Whether the response on a connection was read completely, so the connection can be reused"""
+        return response.isclosed() and not getattr(response, 'length', None)
+
+    def clear(self):
+        """Close all pooled connections"""
+        with self._lock:
+            for entries in self._connections.values():
+                for connection, _, _ in entries:
+                    connection.close()
+            self._connections = dict()
+
+    def stats(self):
+        """Return connection pool statistics"""
+        with self._lock:
+            hosts = dict(('%s://%s' % key, len(entries)) for key, entries in self._connections.items())
+            return dict(
+                requests=self.requests,
+                opened=self.opened,
+                reused=self.reused,
+                stale=self.stale,
+                pooled=sum(hosts.values()),
+                hosts=hosts,
+            )
+
+
+POOL = ConnectionPool()
+
+
+class KeepAliveMixin:
+    """A urllib handler mixin that sends requests over pooled persistent connections"""
+
+    pool = POOL
+
+    def do_open(self, http_class, req, **http_conn_args):  # pylint: disable=arguments-differ
+        """Return a response for the request, preferably using a pooled connection"""
+        host = req.host if hasattr(req, 'host') else req.get_host()
+        if not host:
+            raise URLError('no host given')
+        key = (req.type if hasattr(req, 'type') else req.get_type(), host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+        headers = dict((name.title(), val) for name, val in headers.items())
+        headers['Connection'] = 'keep-alive'
+
+        connection = self.pool.get(key)
+        if connection is not None:
+            sent = False
+            try:
+                self._send_request(connection, req, headers)
+                sent = True
+                response = connection.getresponse()
+            except (HTTPException, SocketError) as exc:
+                connection.close()
+                # Only retry idempotent requests, and only when the server closed the idle connection before responding
+                if req.get_method() not in ('GET', 'HEAD') or sent and not self.closed_before_response(exc):
+                    # A closed connection is a URLError, whether the Python version considers it a socket error or not
+                    if isinstance(exc, SocketError) or self.closed_before_response(exc):
+                        raise URLError(exc)
+                    raise
+                self.pool.stale_connection()
+                connection = None
+
+        if connection is None:
+            connection = http_class(host, timeout=req.timeout, **http_conn_args)
+            self.pool.opened_connection()
+            try:
+                self._send_request(connection, req, headers)
+                response = connection.getresponse()
+            except SocketError as exc:  # timeout error
+                connection.close()
+                raise URLError(exc)
+            except HTTPException:
+                connection.close()
+                raise
+
+        if not response.will_close:
+            self.pool.put(key, connection, response)
+        return self._wrap_response(response, req)
+
+    @staticmethod
+    def closed_before_response(exc):
+        """Whether a connection was closed by the server before any response bytes arrived"""
+        # Python 3.5+ raises RemoteDisconnected, which is both a BadStatusLine and a socket error
+        if isinstance(exc, BadStatusLine):
+            return exc.line in NO_STATUS_LINES or isinstance(exc, SocketError)
+        return isinstance(exc, SocketError) and exc.errno == ECONNRESET
+
+    @staticmethod
+    def _send_request(connection, req, headers):
+        """Send the request over the connection"""
+        selector = req.selector if hasattr(req, 'selector') else req.get_selector()
+        connection.request(req.get_method(), selector, req.data, headers)
+
+    @staticmethod
+    def _wrap_response(response, req):
+        """Make a raw HTTP response look like the response urllib returns"""
+        if hasattr(response, 'getheader') and not hasattr(response, 'geturl'):  # Python 2
+            from socket import _fileobject  # pylint: disable=no-name-in-module
+            from urllib2 import addinfourl  # pylint: disable=import-error
+            response.recv = response.read
+            wrapped = addinfourl(_fileobject(response, close=True), response.msg, req.get_full_url())
+            wrapped.code = response.status
+            wrapped.msg = response.reason
+            return wrapped
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
+
+
+class KeepAliveHTTPHandler(KeepAliveMixin, HTTPHandler):
+    """A urllib HTTP handler using persistent connections"""
+
+    def http_open(self, req):
+        """Open an HTTP request"""
+        return self.do_open(HTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(KeepAliveMixin, HTTPSHandler):
+    """A urllib HTTPS handler using persistent connections"""
+
+    def https_open(self, req):
+        """Open an HTTPS request"""
+        if getattr(self, '_context', None) is not None:
+            return self.do_open(HTTPSConnection, req, context=getattr(self, '_context'))
+        return self.do_open(HTTPSConnection, req)
@@ -42,3 +42,143 @@ class TitleItem:
         self.prop_dict = prop_dict
         self.context_menu = context_menu
         self.is_playable = is_playable
+
+
+class EncodedJSON:
+    """This helper object holds a JSON array as fragments of items that are already encoded as JSON"""
+
+    def __init__(self, fragments):
+        """The constructor for the EncodedJSON class"""
+        self.fragments = fragments
+
+
+class JSONObjectItems:
+    """This helper object holds the key and value pairs of a JSON object, which may be generated while encoding"""
+
+    def __init__(self, items):
+        """The constructor for the JSONObjectItems class"""
+        self._items = items
+
+    def items(self):
+        """Return the key and value pairs"""
+        return self._items
+
+
+class EpisodeIndex:
+    """This helper object indexes all episodes of a program, ordered by season and episode number"""
+
+    _KEYS = dict(video_id='videoId', whatson_id='whatsonId', video_url='url')
+
+    def __init__(self, episodes):
+        """The constructor for the EpisodeIndex class"""
+        self.episodes = sorted(episodes, key=lambda k: (k.get('seasonTitle') or '', k.get('episodeNumber') or 0))
+        self.positions = dict((key, dict()) for key in self._KEYS)
+        for position, episode in enumerate(self.episodes):
+            for key, api_key in self._KEYS.items():
+                if episode.get(api_key):
+                    self.positions[key][episode.get(api_key)] = position
+
+    def find(self, video_id=None, whatson_id=None, video_url=None):
+        """Return the position of an episode by videoId, whatsonId or url"""
+        for key, value in (('video_id', video_id), ('whatson_id', whatson_id), ('video_url', video_url)):
+            if value and value in self.positions[key]:
+                return self.positions[key][value]
+        return None
+
+    def get_episode(self, video_id=None, whatson_id=None, video_url=None):
+        """Return an episode by videoId, whatsonId or url"""
+        position = self.find(video_id=video_id, whatson_id=whatson_id, video_url=video_url)
+        if position is None:
+            return None
+        return self.episodes[position]
+
+    def get_next_episode(self, video_id=None, whatson_id=None, video_url=None):
+        """Return the episode following an episode given by videoId, whatsonId or url"""
+        position = self.find(video_id=video_id, whatson_id=whatson_id, video_url=video_url)
+        if position is None or position + 1 >= len(self.episodes):
+            return None
+        current_episode = self.episodes[position]
+        next_episode = self.episodes[position + 1]
+        if next_episode.get('episodeNumber') == current_episode.get('episodeNumber'):
+            return None
+        return next_episode
+
+
+class ScheduleIndex:
+    """This helper object indexes the EPG schedule of a channel by start and end time, and keeps the untimed entries apart"""
+
+    def __init__(self, episodes):
+        """The constructor for the ScheduleIndex class"""
+        from utils import parse_iso8601
+        entries = sorted([(self.epoch(parse_iso8601(episode.get('startTime'))), self.epoch(parse_iso8601(episode.get('endTime'))), episode)
+                          for episode in episodes if episode.get('startTime') and episode.get('endTime')], key=lambda k: k[:2])
+        self.episodes = [entry[2] for entry in entries]
+        self.untimed = [episode for episode in episodes if not (episode.get('startTime') and episode.get('endTime'))]  # Listed, never looked up
+        self.starts = [entry[0] for entry in entries]
+        self.ends = [entry[1] for entry in entries]
+        self.max_ends = []  # Running maximum of the end times, to bound overlap lookups
+        for end in self.ends:
+            self.max_ends.append(max(end, self.max_ends[-1]) if self.max_ends else end)
+        midpoints = sorted(((start + end) / 2, position) for position, (start, end, _) in enumerate(entries))
+        self.midpoints = [midpoint for midpoint, _ in midpoints]
+        self.midpoint_positions = [position for _, position in midpoints]
+
+    @staticmethod
+    def epoch(date):
+        """Convert a timezone-aware datetime into seconds since the epoch"""
+        from calendar import timegm
+        return timegm(date.utctimetuple())
+
+    @staticmethod
+    def nearest(values, value):
+        """Return the position of the sorted value closest to a given value, the earliest one on a tie"""
+        from bisect import bisect_left
+        position = bisect_left(values, value)
+        if position == len(values) or (position > 0 and value - values[position - 1] <= values[position] - value):
+            return position - 1
+        return position
+
+    def playing(self, date):
+        """Return the position of the episode airing at a given datetime, if any"""
+        from bisect import bisect_right
+        now = self.epoch(date)
+        position = bisect_right(self.starts, now) - 1
+        if position >= 0 and now <= self.ends[position]:
+            return position
+        return None
+
+    def upcoming(self, date):
+        """Return the position of the first episode starting after a given datetime, if any"""
+        from bisect import bisect_right
+        position = bisect_right(self.starts, self.epoch(date))
+        if position < len(self.episodes):
+            return position
+        return None
+
+    def nearest_start(self, date):
+        """Return the position of the episode starting closest to a given datetime, if any"""
+        if not self.episodes:
+            return None
+        return self.nearest(self.starts, self.epoch(date))
+
+    def nearest_midpoint(self, date):
+        """Return the position of the episode whose middle is closest to a given datetime, if any"""
+        if not self.episodes:
+            return None
+        return self.midpoint_positions[self.nearest(self.midpoints, self.epoch(date))]
+
+    def overlapping(self, start_date, end_date):
+        """Return the position of the episode overlapping most with a given period, the one closest to its middle on a tie"""
+        from bisect import bisect_left, bisect_right
+        start, end = self.epoch(start_date), self.epoch(end_date)
+        middle = (start + end) / 2
+        best = None
+        best_key = None
+        for position in range(bisect_right(self.max_ends, start), bisect_left(self.starts, end)):
+            overlap = min(end, self.ends[position]) - max(start, self.starts[position])
+            if overlap <= 0:
+                continue
+            key = (-overlap, abs(middle - (self.starts[position] + self.ends[position]) / 2))
+            if best_key is None or key < best_key:
+                best, best_key = position, key
+        return best
@@ -6,8 +6,42 @@
 from __future__ import absolute_import, division, unicode_literals
 
 from data import CHANNELS
+from helperobjects import EncodedJSON, JSONObjectItems
 from kodiutils import log
 
+SEND_BUFFER_SIZE = 64 * 1024  # Send the encoded JSON output to IPTV Manager in chunks of this size
+
+
+def iterencode(data, encoder=None):
+    """Encode data as JSON incrementally, generators are encoded as arrays without being consumed up front"""
+    from types import GeneratorType
+    if encoder is None:
+        import json
+        encoder = json.JSONEncoder()
+    if isinstance(data, (dict, JSONObjectItems)):
+        yield '{'
+        for index, (key, value) in enumerate(data.items()):
+            yield (', ' if index else '') + encoder.encode(key) + ': '
+            for chunk in iterencode(value, encoder):
+                yield chunk
+        yield '}'
+    elif isinstance(data, EncodedJSON):
+        yield '['
+        for index, fragment in enumerate(data.fragments):
+            yield (', ' if index else '') + fragment
+        yield ']'
+    elif isinstance(data, GeneratorType):
+        yield '['
+        for index, value in enumerate(data):
+            if index:
+                yield ', '
+            for chunk in iterencode(value, encoder):
+                yield chunk
+        yield ']'
+    else:
+        for chunk in encoder.iterencode(data):
+            yield chunk
+
 
 class IPTVManager:
     """Interface to IPTV Manager"""
@@ -21,13 +55,22 @@ class IPTVManager:
 
         def send(self):
             """Decorator to send over a socket"""
-            import json
             import socket
             log(2, "Sending data output to IPTV Manager using port {port}", port=self.port)
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.connect(('127.0.0.1', self.port))
             try:
-                sock.sendall(json.dumps(func()).encode())  # pylint: disable=not-callable
+                # Send the JSON output while it is being encoded, in buffered chunks
+                chunks = []
+                length = 0
+                for chunk in iterencode(func()):  # pylint: disable=not-callable
+                    chunks.append(chunk)
+                    length += len(chunk)
+                    if length >= SEND_BUFFER_SIZE:
+                        sock.sendall(''.join(chunks).encode())
+                        chunks = []
+                        length = 0
+                sock.sendall(''.join(chunks).encode())
             finally:
                 sock.close()
 
@@ -57,5 +100,5 @@ class IPTVManager:
     def send_epg():  # pylint: disable=no-method-argument
         """Return JSONTV formatted information to IPTV Manager"""
         from tvguide import TVGuide
-        epg_data = TVGuide().get_epg_data()
-        return dict(version=1, epg=epg_data)
+        # Channels are sent while the EPG days are still being fetched
+        return dict(version=1, epg=JSONObjectItems(TVGuide().get_epg_data()))
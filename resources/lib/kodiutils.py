@@ -7,11 +7,12 @@ from contextlib import contextmanager
 from sys import version_info
 from socket import timeout
 from ssl import SSLError
+from string import Formatter
 
 import xbmc
 import xbmcaddon
 import xbmcplugin
-from utils import from_unicode, to_unicode
+from utils import from_unicode, parse_iso8601, to_unicode
 
 try:  # Python 3
     from urllib.request import HTTPErrorProcessor
@@ -20,6 +21,20 @@ except ImportError:  # Python 2
 
 ADDON = xbmcaddon.Addon()
 DEFAULT_CACHE_DIR = 'cache'
+WEBSCRAPER_CACHE_DIR = 'webscraper'  # Scraped video attributes, bounded separately from the HTTP cache
+STALE_CACHES = {  # Cache files that may be served stale while being refreshed in the background
+    'httpcachestaleprograms': ['programs.json', 'category.*.json', 'channel.*.json', 'featured.*.json', 'oneoff.json'],
+    'httpcachestaleepisodes': ['*recent-*.json', '*offline-*.json', 'continue-*.json', 'watchlater-*.json'],
+    'httpcachestaleschedule': ['schedule.*.json'],
+}
+SETTINGS = dict()  # Snapshot of add-on and Kodi settings, see invalidate_settings()
+GLOBAL_SETTINGS_TTL = 60  # Seconds to cache Kodi settings in the snapshot
+PRUNE_INTERVAL = 10  # Enforce the cache limits every so many cache writes
+CACHE_WRITES = dict(count=0)  # Number of HTTP cache writes, shared between invocations
+CACHE_STORES = dict()  # Opened cache stores per backend and cache directory
+OPENERS = dict()  # Cached urllib openers per proxy configuration
+FORMATTER = Formatter()  # Shared formatter for log messages and localized strings
+LOG_LEVEL_DEBUG = 99  # Log level threshold when Kodi debug logging is enabled
 
 SORT_METHODS = dict(
     # date=xbmcplugin.SORT_METHOD_DATE,
@@ -103,6 +118,19 @@ class SafeDict(dict):
         return '{' + key + '}'
 
 
+class Lazy:
+    """A log argument that is only evaluated when the message is emitted"""
+
+    def __init__(self, func, *args):
+        """Store the function and arguments to evaluate"""
+        self.func = func
+        self.args = args
+
+    def evaluate(self):
+        """Return the value of the log argument"""
+        return self.func(*self.args)
+
+
 def addon_icon():
     """Return add-on icon"""
     return get_addon_info('icon')
@@ -133,6 +161,11 @@ def addon_profile():
     return to_unicode(xbmc.translatePath(ADDON.getAddonInfo('profile')))
 
 
+def translate_path(path):
+    """Translate a special:// path into a local path"""
+    return to_unicode(xbmc.translatePath(path))
+
+
 def url_for(name, *args, **kwargs):
     """Wrapper for routing.url_for() to lookup by name"""
     import addon
@@ -299,10 +332,10 @@ def play(stream, video=None):
     subtitles_visible = get_setting_bool('showsubtitles', default=True)
     # Separate subtitle url for hls-streams
     if subtitles_visible and stream.subtitle_url is not None:
-        log(2, 'Subtitle URL: {url}', url=unquote(stream.subtitle_url))
+        log(2, 'Subtitle URL: {url}', url=Lazy(unquote, stream.subtitle_url))
         play_item.setSubtitles([stream.subtitle_url])
 
-    log(1, 'Play: {url}', url=unquote(stream.stream_url))
+    log(1, 'Play: {url}', url=Lazy(unquote, stream.stream_url))
     xbmcplugin.setResolvedUrl(plugin.handle, bool(stream.stream_url), listitem=play_item)
 
     while not xbmc.Player().isPlaying() and not xbmc.Monitor().abortRequested():
@@ -369,8 +402,7 @@ def set_locale():
 def localize(string_id, **kwargs):
     """Return the translated string from the .po language files, optionally translating variables"""
     if kwargs:
-        from string import Formatter
-        return Formatter().vformat(ADDON.getLocalizedString(string_id), (), SafeDict(**kwargs))
+        return FORMATTER.vformat(ADDON.getLocalizedString(string_id), (), SafeDict(**kwargs))
     return ADDON.getLocalizedString(string_id)
 
 
@@ -419,12 +451,20 @@ def localize_from_data(name, data):
     return next((localize(item.get('msgctxt')) for item in data if item.get('name') == name), name)
 
 
+def invalidate_settings():
+    """Invalidate the settings snapshot, at the start of a plugin invocation or when settings have changed"""
+    SETTINGS.clear()
+
+
 def get_setting(key, default=None):
     """Get an add-on setting as string"""
-    try:
-        value = to_unicode(ADDON.getSetting(key))
-    except RuntimeError:  # Occurs when the add-on is disabled
-        return default
+    value = SETTINGS.get(key)
+    if value is None:
+        try:
+            value = to_unicode(ADDON.getSetting(key))
+        except RuntimeError:  # Occurs when the add-on is disabled
+            return default
+        SETTINGS[key] = value
     if value == '' and default is not None:
         return default
     return value
@@ -432,52 +472,69 @@ def get_setting(key, default=None):
 
 def get_setting_bool(key, default=None):
     """Get an add-on setting as boolean"""
+    value = SETTINGS.get(('bool', key))
+    if value is not None:
+        return value
     try:
-        return ADDON.getSettingBool(key)
+        value = ADDON.getSettingBool(key)
     except (AttributeError, TypeError):  # On Krypton or older, or when not a boolean
         value = get_setting(key, default)
         if value not in ('false', 'true'):
             return default
-        return bool(value == 'true')
+        value = bool(value == 'true')
     except RuntimeError:  # Occurs when the add-on is disabled
         return default
+    SETTINGS[('bool', key)] = value
+    return value
 
 
 def get_setting_int(key, default=None):
     """Get an add-on setting as integer"""
+    value = SETTINGS.get(('int', key))
+    if value is not None:
+        return value
     try:
-        return ADDON.getSettingInt(key)
+        value = ADDON.getSettingInt(key)
     except (AttributeError, TypeError):  # On Krypton or older, or when not an integer
         value = get_setting(key, default)
         try:
-            return int(value)
+            value = int(value)
         except ValueError:
             return default
     except RuntimeError:  # Occurs when the add-on is disabled
         return default
+    SETTINGS[('int', key)] = value
+    return value
 
 
 def get_setting_float(key, default=None):
     """Get an add-on setting"""
+    value = SETTINGS.get(('float', key))
+    if value is not None:
+        return value
     try:
-        return ADDON.getSettingNumber(key)
+        value = ADDON.getSettingNumber(key)
     except (AttributeError, TypeError):  # On Krypton or older, or when not a float
         value = get_setting(key, default)
         try:
-            return float(value)
+            value = float(value)
         except ValueError:
             return default
     except RuntimeError:  # Occurs when the add-on is disabled
         return default
+    SETTINGS[('float', key)] = value
+    return value
 
 
 def set_setting(key, value):
     """Set an add-on setting"""
+    invalidate_settings()
     return ADDON.setSetting(key, from_unicode(str(value)))
 
 
 def set_setting_bool(key, value):
     """Set an add-on setting as boolean"""
+    invalidate_settings()
     try:
         return ADDON.setSettingBool(key, value)
     except (AttributeError, TypeError):  # On Krypton or older, or when not a boolean
@@ -490,6 +547,7 @@ def set_setting_bool(key, value):
 
 def set_setting_int(key, value):
     """Set an add-on setting as integer"""
+    invalidate_settings()
     try:
         return ADDON.setSettingInt(key, value)
     except (AttributeError, TypeError):  # On Krypton or older, or when not an integer
@@ -498,6 +556,7 @@ def set_setting_int(key, value):
 
 def set_setting_float(key, value):
     """Set an add-on setting"""
+    invalidate_settings()
     try:
         return ADDON.setSettingNumber(key, value)
     except (AttributeError, TypeError):  # On Krypton or older, or when not a float
@@ -511,8 +570,15 @@ def open_settings():
 
 def get_global_setting(key):
     """Get a Kodi setting"""
+    from time import time
+    # Kodi does not tell us when its own settings change, so only cache them briefly
+    cached = SETTINGS.get(('global', key))
+    if cached is not None and time() - cached[1] < GLOBAL_SETTINGS_TTL:
+        return cached[0]
     result = jsonrpc(method='Settings.GetSettingValue', params=dict(setting=key))
-    return result.get('result', {}).get('value')
+    value = result.get('result', {}).get('value')
+    SETTINGS[('global', key)] = (value, time())
+    return value
 
 
 def get_advanced_setting(key, default=None):
@@ -890,17 +956,33 @@ def wait_for_resumepoints():
     return False
 
 
+def get_log_level():
+    """Return the highest log level that is emitted, and cache it in the settings snapshot"""
+    if get_global_setting('debug.showloginfo'):  # Returns a boolean
+        log_level = LOG_LEVEL_DEBUG
+    else:
+        log_level = get_setting_int('max_log_level', default=0) or -1
+    SETTINGS['log_level'] = log_level
+    return log_level
+
+
+def reset_log_level():
+    """Forget the cached log level, so changes to Kodi debug logging are picked up"""
+    SETTINGS.pop('log_level', None)
+
+
 def log(level=1, message='', **kwargs):
-    """Log info messages to Kodi"""
-    debug_logging = get_global_setting('debug.showloginfo')  # Returns a boolean
-    max_log_level = get_setting_int('max_log_level', default=0)
-    if not debug_logging and not (level <= max_log_level and max_log_level != 0):
+    """Log info messages to Kodi, Lazy arguments are only evaluated when the message is emitted"""
+    log_level = SETTINGS.get('log_level')
+    if log_level is None:
+        log_level = get_log_level()
+    if level > log_level:
         return
     if kwargs:
-        from string import Formatter
-        message = Formatter().vformat(message, (), SafeDict(**kwargs))
+        kwargs = dict((key, value.evaluate() if isinstance(value, Lazy) else value) for key, value in kwargs.items())
+        message = FORMATTER.vformat(message, (), SafeDict(**kwargs))
     message = '[{addon}] {message}'.format(addon=addon_id(), message=message)
-    xbmc.log(from_unicode(message), level % 3 if debug_logging else 2)
+    xbmc.log(from_unicode(message), level % 3 if log_level == LOG_LEVEL_DEBUG else 2)
 
 
 def log_access(argv):
@@ -911,8 +993,7 @@ def log_access(argv):
 def log_error(message, **kwargs):
     """Log error messages to Kodi"""
     if kwargs:
-        from string import Formatter
-        message = Formatter().vformat(message, (), SafeDict(**kwargs))
+        message = FORMATTER.vformat(message, (), SafeDict(**kwargs))
     message = '[{addon}] {message}'.format(addon=addon_id(), message=message)
     xbmc.log(from_unicode(message), 4)
 
@@ -961,29 +1042,29 @@ def human_delta(seconds):
     return '%d second%s' % (seconds, 's' if seconds != 1 else '')
 
 
+def get_cache_store(cache_dir=DEFAULT_CACHE_DIR):
+    """Return the cache store for a cache directory"""
+    backend = 'files'
+    # Tokens are always kept in separate files
+    if cache_dir in (DEFAULT_CACHE_DIR, WEBSCRAPER_CACHE_DIR) and get_setting_int('httpcachebackend', default=0) == 0:
+        backend = 'sqlite'
+    key = (backend, cache_dir)
+    if key not in CACHE_STORES:
+        from cachestore import open_store
+        CACHE_STORES[key] = open_store(cache_dir, backend=backend)
+    return CACHE_STORES.get(key)
+
+
 def get_cache(cache_file, ttl=None, cache_dir=DEFAULT_CACHE_DIR):  # pylint: disable=redefined-outer-name
     """Get the content from cache, if it is still fresh"""
     if not get_setting_bool('usehttpcaching', default=True):
         return None
 
-    fullpath = get_cache_path(cache_file, cache_dir)
-    if not exists(fullpath):
+    data = get_cache_store(cache_dir).get(cache_file, ttl=ttl)
+    if data is None:
         return None
 
-    if ttl is not None:
-        from time import localtime, mktime
-        mtime = stat_file(fullpath).st_mtime()
-        now = mktime(localtime())
-        if now >= mtime + ttl:
-            return None
-
-#    if ttl is None:
-#        log(3, "Cache '{path}' is forced from cache.", path=path)
-#    else:
-#        log(3, "Cache '{path}' is fresh, expires in {time}.", path=path, time=human_delta(mtime + ttl - now))
-    with open_file(fullpath, 'r') as fdesc:
-        json = get_json_data(fdesc)
-
+    json = get_json_string(data)
     if json is None:
         return None
 
@@ -991,40 +1072,60 @@ def get_cache(cache_file, ttl=None, cache_dir=DEFAULT_CACHE_DIR):  # pylint: dis
         expiration_date = json.get('expirationDate', None)
         if expiration_date:
             from datetime import datetime
-            import dateutil.parser
             import dateutil.tz
             now = datetime.now(dateutil.tz.tzlocal())
-            exp = dateutil.parser.parse(expiration_date)
+            exp = parse_iso8601(expiration_date)
             if exp <= now:
-                log(2, "Cache expired: '{path}'", path=fullpath)
+                log(2, "Cache expired: '{cache}'", cache=cache_file)
                 return None
-    log(2, "Got item from cache '{path}'", path=fullpath)
+    log(2, "Got item from cache '{cache}'", cache=cache_file)
     return json
 
 
-def update_cache(cache_file, data, cache_dir=DEFAULT_CACHE_DIR):
+def update_cache(cache_file, data, cache_dir=DEFAULT_CACHE_DIR, validators=None, ttl=None, tags=None):  # pylint: disable=redefined-outer-name
     """Update the cache, if necessary"""
     if not get_setting_bool('usehttpcaching', default=True):
         return
-
-    fullpath = get_cache_path(cache_file, cache_dir)
-    if not exists(fullpath):
-        # Create cache directory if missing
-        directory = get_cache_dir(cache_dir)
-        if not exists(directory):
-            mkdirs(directory)
-        write_cache(fullpath, data)
-        return
-
-    with open_file(fullpath, 'r') as fdesc:
-        cache = fdesc.read()
-
-    # Avoid writes if possible (i.e. SD cards)
-    if cache == data:
-        update_timestamp(fullpath)
-        return
-
-    write_cache(fullpath, data)
+    compress = get_setting_bool('httpcachecompress', default=False)
+    get_cache_store(cache_dir).put(cache_file, data, validators=validators, ttl=ttl, tags=tags, compress=compress)
+    if cache_dir == DEFAULT_CACHE_DIR:
+        # Opportunistically enforce the cache limits
+        CACHE_WRITES['count'] += 1
+        if CACHE_WRITES['count'] % PRUNE_INTERVAL == 0:
+            prune_cache()
+
+
+def prune_cache():
+    """Evict the least recently used HTTP cache entries beyond the configured size and number of entries"""
+    max_size = get_setting_int('httpcachemaxsize', default=20) * 1024 * 1024
+    max_entries = get_setting_int('httpcachemaxentries', default=500)
+    removed, reclaimed = get_cache_store().prune(max_size, max_entries)
+    if removed:
+        log(2, 'Pruned {removed} cache entries, reclaimed {size} KiB', removed=removed, size=reclaimed // 1024)
+    return removed, reclaimed
+
+
+def cache_tags(json_data):
+    """Return the videos and programs referenced by Search, Suggest or Schedule API data"""
+    from utils import url_to_program
+    if isinstance(json_data, dict) and isinstance(json_data.get('results'), list):
+        items = json_data.get('results')  # VRT NU Search API
+    elif isinstance(json_data, list):
+        items = json_data  # VRT NU Suggest API
+    elif isinstance(json_data, dict):
+        items = [item for value in json_data.values() if isinstance(value, list) for item in value]  # VRT NU Schedule API
+    else:
+        return None
+    tags = set()
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        if item.get('videoId'):
+            tags.add('video:' + item.get('videoId'))
+        program = url_to_program(item.get('programUrl') or item.get('url') or '')
+        if program:
+            tags.add('program:' + program)
+    return tags
 
 
 def write_cache(fullpath, data):
@@ -1041,6 +1142,42 @@ def update_timestamp(fullpath):
     utime(fullpath, None)
 
 
+def response_validators(response):
+    """Return the HTTP validators (ETag, Last-Modified) from an HTTP response"""
+    info = response.info()
+    validators = dict()
+    for header in ('ETag', 'Last-Modified'):
+        value = info.get(header)
+        if value:
+            validators[header] = value
+    return validators or None
+
+
+def conditional_headers(cache_file, headers=None):
+    """Return request headers to revalidate a cache file, if we have validators for it"""
+    if not get_setting_bool('usehttpcaching', default=True):
+        return headers
+    validators = get_cache_store().get_validators(cache_file)
+    if not validators:
+        return headers
+    headers = dict(headers or {})
+    if validators.get('ETag'):
+        headers['If-None-Match'] = validators.get('ETag')
+    if validators.get('Last-Modified'):
+        headers['If-Modified-Since'] = validators.get('Last-Modified')
+    return headers
+
+
+def get_revalidated_cache(cache_file):
+    """Return the content of a cache file the server reported as not modified"""
+    store = get_cache_store()
+    store.touch(cache_file)
+    data = store.get(cache_file)
+    if data is None:
+        return None
+    return get_json_string(data)
+
+
 def ttl(kind='direct'):
     """Return the HTTP cache ttl in seconds based on kind of relation"""
     if kind == 'direct':
@@ -1050,34 +1187,116 @@ def ttl(kind='direct'):
     return 5 * 60
 
 
-def open_url(url, data=None, headers=None, method=None, cookiejar=None, follow_redirects=True, raise_errors=None):
-    """Return a urllib http response"""
+def get_opener(follow_redirects=True, cookiejar=None):
+    """Return a urllib opener, reusing a cached opener per proxy configuration"""
     try:  # Python 3
-        from urllib.error import HTTPError, URLError
-        from urllib.parse import unquote
-        from urllib.request import build_opener, HTTPCookieProcessor, ProxyHandler, Request
+        from urllib.request import build_opener, HTTPCookieProcessor, ProxyHandler
     except ImportError:  # Python 2
-        from urllib2 import build_opener, HTTPError, HTTPCookieProcessor, ProxyHandler, Request, URLError, unquote
+        from urllib2 import build_opener, HTTPCookieProcessor, ProxyHandler
+
+    proxies = get_proxies()
+    key = (follow_redirects, tuple(sorted(proxies.items())) if proxies else None)
+    if cookiejar is None and key in OPENERS:
+        return OPENERS.get(key)
 
     opener_args = []
     if not follow_redirects:
         opener_args.append(NoRedirection)
     if cookiejar is not None:
         opener_args.append(HTTPCookieProcessor(cookiejar))
-    proxies = get_proxies()
     if proxies:
         opener_args.append(ProxyHandler(proxies))
+    else:
+        # Keep connections alive when connecting directly
+        from connectionpool import KeepAliveHTTPHandler, KeepAliveHTTPSHandler
+        opener_args.extend([KeepAliveHTTPHandler(), KeepAliveHTTPSHandler()])
     opener = build_opener(*opener_args)
 
-    if not headers:
-        headers = dict()
+    # Openers with a cookiejar are specific to a single request flow
+    if cookiejar is None:
+        OPENERS[key] = opener
+    return opener
+
+
+def get_connection_pool_stats():
+    """Return statistics about the persistent HTTP connection pool"""
+    from connectionpool import POOL
+    return POOL.stats()
+
+
+def parallel_map(function, items, max_workers=None):
+    """Call a function for every item using a bounded number of threads, and return the results in order"""
+    return list(parallel_imap(function, items, max_workers=max_workers))
+
+
+def parallel_imap(function, items, max_workers=None):
+    """Call a function for every item using a bounded number of threads, and generate the results in order as soon as they are available"""
+    items = list(items)
+    if max_workers is None:
+        max_workers = get_setting_int('httpconcurrency', default=4)
+    results = [None] * len(items)
+
+    def worker(index, item):
+        """Store the result of a single call, a failing call leaves its result None"""
+        try:
+            results[index] = function(item)
+        except Exception as exc:  # pylint: disable=broad-except
+            log_error('Parallel call for {item} failed: {error}', item=item, error=exc)
+
+    if max_workers <= 1 or len(items) <= 1:
+        for index, item in enumerate(items):
+            worker(index, item)
+            yield results[index]
+        return
+
+    from threading import Event, Lock, Thread
+    lock = Lock()
+    queue = iter(enumerate(items))
+    done = [Event() for _ in items]
+
+    def consume():
+        """Process items from the shared queue until it is exhausted"""
+        while True:
+            with lock:
+                try:
+                    index, item = next(queue)
+                except StopIteration:
+                    return
+            try:
+                worker(index, item)
+            finally:
+                done[index].set()
+
+    for _ in range(min(max_workers, len(items))):
+        Thread(target=consume, name='ParallelMap').start()
+    for index in range(len(items)):
+        done[index].wait()
+        result, results[index] = results[index], None  # Do not hold on to results that were handed out
+        yield result
+
+
+def open_url(url, data=None, headers=None, method=None, cookiejar=None, follow_redirects=True, raise_errors=None, decode=True):
+    """Return a urllib http response, with a compressed body decoded unless the caller decodes it"""
+    try:  # Python 3
+        from urllib.error import HTTPError, URLError
+        from urllib.parse import unquote
+        from urllib.request import Request
+    except ImportError:  # Python 2
+        from urllib2 import HTTPError, Request, URLError, unquote
+
+    opener = get_opener(follow_redirects=follow_redirects, cookiejar=cookiejar)
+
+    headers = dict(headers or {})
+    # Negotiate compressed responses, which decode_response() transparently decodes (unless decode is False)
+    if not any(key.lower() == 'accept-encoding' for key in headers):
+        headers['Accept-Encoding'] = 'gzip, deflate'
     req = Request(url, headers=headers)
     if data is not None:
         req.data = data
-        log(2, 'URL post: {url}', url=unquote(url))
+        log(2, 'URL post: {url}', url=Lazy(unquote, url))
         log(2, 'URL post data: {data}', data=data)
     else:
-        log(2, 'URL get: {url}', url=unquote(url))
+        log(2, 'URL get: {url}', url=Lazy(unquote, url))
 
     if method is not None:
         req.get_method = lambda: method
@@ -1085,8 +1304,13 @@ def open_url(url, data=None, headers=None, method=None, cookiejar=None, follow_r
     if raise_errors is None:
         raise_errors = list()
     try:
-        return opener.open(req)
+        response = opener.open(req)
+        if not decode:
+            return response
+        return decode_response(response, raise_errors=raise_errors)
     except HTTPError as exc:
+        if exc.code == 304:  # Not Modified, our cached copy is still valid
+            return exc
         if isinstance(raise_errors, list) and 401 in raise_errors or raise_errors == 'all':
             raise
         if hasattr(req, 'selector'):  # Python 3.4+
@@ -1113,7 +1337,7 @@ def open_url(url, data=None, headers=None, method=None, cookiejar=None, follow_r
             log_error('HTTP Error {code}: {reason}', code=exc.code, reason=exc.reason)
             return None
         if exc.code in (400, 403) and exc.headers.get('Content-Type') and 'application/json' in exc.headers.get('Content-Type'):
-            return exc
+            return decode_response(exc, raise_errors=raise_errors)
         ok_dialog(heading='HTTP Error {code}'.format(code=exc.code), message='{}\n{}'.format(url, exc.reason))
         log_error('HTTP Error {code}: {reason}', code=exc.code, reason=exc.reason)
         return None
@@ -1137,6 +1361,34 @@ def open_url(url, data=None, headers=None, method=None, cookiejar=None, follow_r
         return None
 
 
+def decode_response(response, raise_errors=None):
+    """Return a response with a gzip or deflate encoded body decoded"""
+    encoding = response.info().get('Content-Encoding')
+    if encoding not in ('gzip', 'deflate'):
+        return response
+    import zlib
+    from io import BytesIO
+    try:  # Python 3
+        from urllib.response import addinfourl
+    except ImportError:  # Python 2
+        from urllib import addinfourl
+    data = response.read()
+    try:
+        # Accept both gzip and zlib framing
+        data = zlib.decompress(data, 32 + zlib.MAX_WBITS)
+    except zlib.error:
+        # Some servers send raw deflate data
+        try:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        except zlib.error as exc:
+            if raise_errors == 'all':
+                raise
+            log_error('Decoding {encoding} response failed: {error}\nurl: {url}', encoding=encoding, error=exc, url=response.geturl())
+            return None
+    log(3, 'Decoded {encoding} response: {size} bytes', encoding=encoding, size=len(data))
+    return addinfourl(BytesIO(data), response.info(), response.geturl(), response.getcode())
+
+
 def get_json_data(response, fail=None):
     """Return json object from HTTP response"""
     from json import load, loads
@@ -1152,24 +1404,48 @@ def get_json_data(response, fail=None):
         return fail
 
 
-def get_url_json(url, cache=None, headers=None, data=None, fail=None, raise_errors=None):
+def get_json_string(data):
+    """Return json object from a JSON string, or gzip compressed JSON data"""
+    from json import loads
+    if isinstance(data, bytes) and data[:2] == b'\x1f\x8b':
+        import zlib
+        # Parse the decompressed bytes directly, without an intermediate string copy
+        data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        if (3, 0, 0) <= version_info < (3, 6, 0):  # the JSON object must be str, not 'bytes'
+            data = to_unicode(data)
+    try:
+        return loads(data)
+    except ValueError as exc:  # No JSON object could be decoded
+        log_error('JSON ValueError: {exc}', exc=exc)
+        return None
+
+
+def get_url_json(url, cache=None, headers=None, data=None, fail=None, raise_errors=None, ttl=None):  # pylint: disable=redefined-outer-name
     """Return HTTP data"""
-    response = open_url(url, headers=headers, data=data, raise_errors=raise_errors)
+    request_headers = headers
+    if cache and data is None:
+        request_headers = conditional_headers(cache, headers)
+    response = open_url(url, headers=request_headers, data=data, raise_errors=raise_errors)
     if response:
+        if response.getcode() == 304:
+            json_data = get_revalidated_cache(cache)
+            if json_data is not None:
+                return json_data
+            # The cached copy is corrupt, fetch it again without validators
+            delete_cache(cache)
+            return get_url_json(url, cache=cache, headers=headers, fail=fail, raise_errors=raise_errors, ttl=ttl)
         json_data = get_json_data(response, fail=fail)
         if json_data:
             if cache:
                 from json import dumps
-                update_cache(cache, dumps(json_data))
+                update_cache(cache, dumps(json_data), validators=response_validators(response), ttl=ttl, tags=cache_tags(json_data))
             return json_data
     return fail
 
 
 def delete_cache(cache_file, cache_dir=DEFAULT_CACHE_DIR):
     """Delete a cached file"""
-    path = get_cache_path(cache_file, cache_dir)
-    if exists(path):
-        delete(path)
+    get_cache_store(cache_dir).delete(cache_file)
 
 
 def get_cached_url_json(url, cache, headers=None, ttl=None, fail=None):  # pylint: disable=redefined-outer-name
@@ -1178,26 +1454,60 @@ def get_cached_url_json(url, cache, headers=None, ttl=None, fail=None):  # pylin
     json_data = get_cache(cache, ttl=ttl)
     if json_data is not None:
         return json_data
-    return get_url_json(url, cache=cache, headers=headers, fail=fail)
+    # Serve stale api data and let the service refresh it in the background
+    if headers is None and ttl is not None and can_serve_stale(cache):
+        json_data = get_cache(cache, ttl=ttl + get_setting_int('httpcachemaxstale', default=24) * 60 * 60)
+        if json_data is not None:
+            queue_cache_refresh(url, cache, ttl)
+            return json_data
+    return get_url_json(url, cache=cache, headers=headers, fail=fail, ttl=ttl)
 
 
-def refresh_caches(cache_file=None):
+def can_serve_stale(cache_file):
+    """Whether an expired cache file may be served while it is refreshed in the background"""
+    if not get_setting_bool('httpcachestale', default=True):
+        return False
+    import fnmatch
+    for setting, patterns in STALE_CACHES.items():
+        if any(fnmatch.fnmatch(cache_file, pattern) for pattern in patterns):
+            return get_setting_bool(setting, default=True)
+    return False
+
+
+def queue_cache_refresh(url, cache_file, ttl):  # pylint: disable=redefined-outer-name
+    """Ask the VRT NU service to refresh an expired cache file"""
+    log(2, "Cache '{cache}' is stale, requesting a background refresh", cache=cache_file)
+    sender = '{addon_id}.SIGNAL'.format(addon_id=addon_id())
+    notify(sender=sender, message='refresh_cache', data=dict(url=url, cache=cache_file, ttl=ttl))
+
+
+def refresh_stale_cache(url, cache_file, ttl):  # pylint: disable=redefined-outer-name
+    """Refresh an expired cache file, unless it was refreshed in the meantime"""
+    if get_cache(cache_file, ttl=ttl) is not None:
+        return
+    log(2, "Refreshing stale cache '{cache}'", cache=cache_file)
+    get_url_json(url, cache=cache_file, ttl=ttl)
+
+
+def refresh_caches(cache_file=None, program=None):
     """Invalidate the needed caches and refresh container"""
     files = ['favorites.json', 'oneoff.json', 'resume_points.json']
     if cache_file and cache_file not in files:
         files.append(cache_file)
     invalidate_caches(*files)
+    if cache_file == '*.json':
+        get_cache_store(WEBSCRAPER_CACHE_DIR).invalidate('*.json')
+    if program:
+        invalidate_tagged_caches('program:' + program)
     container_refresh()
     notification(message=localize(30981))
 
 
 def invalidate_caches(*caches):
     """Invalidate multiple cache files"""
-    import fnmatch
-    _, files = listdir(get_cache_dir())
-    # Invalidate caches related to menu list refreshes
-    removes = set()
-    for expr in caches:
-        removes.update(fnmatch.filter(files, expr))
-    for filename in removes:
-        delete(get_cache_path(filename))
+    get_cache_store().invalidate(*caches)
+
+
+def invalidate_tagged_caches(*tags):
+    """Invalidate the cache files referencing any of the tags (e.g. 'video:<videoId>' or 'program:<program>')"""
+    get_cache_store().invalidate_tags(*tags)
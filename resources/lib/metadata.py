@@ -14,16 +14,164 @@ except ImportError:  # Python 2
 from data import CHANNELS, SECONDS_MARGIN
 from kodiutils import colour, get_setting_bool, localize, localize_datelong, log, url_for
 from utils import (add_https_proto, assetpath_to_id, capitalize, find_entry, from_unicode,
-                   html_to_kodi, reformat_url, shorten_link, to_unicode, unescape,
+                   html_to_kodi, parse_iso8601, reformat_url, shorten_link, to_unicode, unescape,
                    url_to_episode)
 
 
+class EpisodeRecord:
+    """This class derives the metadata fields of single item json api data in a single pass"""
+
+    def __init__(self, api_data):
+        """The constructor for the EpisodeRecord class"""
+        self.api_data = api_data
+        self._asset_id = False  # Not looked up yet, it may require scraping the VRT NU website
+        self._texts = dict()
+
+        # VRT NU Search API
+        if api_data.get('type') == 'episode':
+            from datetime import datetime
+            # Add proper year information when season falls in range
+            # NOTE: Estuary skin is using premiered/aired year, which is incorrect
+            self.year = int()
+            try:
+                if int(api_data.get('seasonTitle')) in range(1900, datetime.now().year + 1):
+                    self.year = int(api_data.get('seasonTitle'))
+            except (TypeError, ValueError):
+                pass
+
+            # If this is a oneoff (e.g. movie) and we get a year of release, do not set season, episode or 'aired'
+            self.is_movie = bool(api_data.get('programType') == 'oneoff' and self.year)
+            if self.is_movie:
+                self.season = ''
+                self.episode = ''
+                self.aired = ''
+            else:
+                try:
+                    self.season = int(api_data.get('seasonTitle'))
+                except (TypeError, ValueError):
+                    try:
+                        self.season = int(api_data.get('seasonName'))
+                    except (TypeError, ValueError):
+                        self.season = api_data.get('seasonTitle')
+                try:
+                    self.episode = int(api_data.get('episodeNumber'))
+                except (TypeError, ValueError):
+                    self.episode = int()
+                self.aired = ''
+                if api_data.get('broadcastDate'):
+                    import dateutil.tz
+                    self.aired = datetime.fromtimestamp(api_data.get('broadcastDate', 0) / 1000, dateutil.tz.UTC).strftime('%Y-%m-%d')
+
+            self.date = ''
+            self.dateadded = ''
+            if api_data.get('assetOnTime'):
+                asset_on_time = parse_iso8601(api_data.get('assetOnTime'))
+                self.date = asset_on_time.strftime('%d.%m.%Y')
+                self.dateadded = asset_on_time.strftime('%Y-%m-%d %H:%M:%S')
+            self.duration = api_data.get('duration', int()) * 60  # Minutes to seconds
+
+        # VRT NU Suggest API
+        elif api_data.get('type') == 'program':
+            self.year = int()
+            self.is_movie = False
+            self.season = None
+            self.episode = int()
+            self.date = ''
+            self.aired = ''
+            self.dateadded = ''
+            self.duration = int()
+
+        # VRT NU Schedule API (some are missing vrt.whatson-id)
+        elif api_data.get('vrt.whatson-id') or api_data.get('startTime'):
+            from datetime import timedelta
+            import dateutil.tz
+            self.year = int()
+            self.is_movie = False
+            self.season = None
+            self.episode = int()
+            self.date = ''
+            self.dateadded = ''
+            # Untimed schedule entries have no air date or duration
+            if api_data.get('startTime') and api_data.get('endTime'):
+                start_time = parse_iso8601(api_data.get('startTime'))
+                end_time = parse_iso8601(api_data.get('endTime'))
+                if end_time < start_time:
+                    end_time = end_time + timedelta(days=1)
+                self.aired = start_time.astimezone(dateutil.tz.UTC).strftime('%Y-%m-%d')
+                self.duration = (end_time - start_time).total_seconds()
+            else:
+                self.aired = ''
+                self.duration = int()
+
+        # Not Found
+        else:
+            self.year = ''
+            self.is_movie = False
+            self.season = None
+            self.episode = int()
+            self.date = ''
+            self.aired = ''
+            self.dateadded = ''
+            self.duration = ''
+
+    def text(self, *keys):
+        """The Kodi formatted text of the first non-empty HTML field, converted on first use"""
+        text = self._texts.get(keys)
+        if text is None:
+            text = html_to_kodi(next((self.api_data.get(key) for key in keys if self.api_data.get(key)), ''))
+            self._texts[keys] = text
+        return text
+
+    @property
+    def scrape_url(self):
+        """The VRT NU web page to scrape when the api data lacks an asset path"""
+        if self.api_data.get('url'):
+            return add_https_proto(self.api_data.get('url'))
+        return None
+
+    def get_asset_id(self, scrape=True):
+        """The asset_id, looked up on first use, optionally scraping the VRT NU website as a fallback"""
+        if self._asset_id is False:
+            # VRT NU Search API or VRT NU Schedule API (some are missing vrt.whatson-id)
+            asset_id = None
+            if (self.api_data.get('type') == 'episode' or self.api_data.get('vrt.whatson-id')
+                    or self.api_data.get('startTime')):
+                asset_id = assetpath_to_id(self.api_data.get('assetPath'))
+
+            # Fallback to VRT NU website scraping
+            if not asset_id and self.scrape_url:
+                if not scrape:
+                    return None
+                from webscraper import get_asset_id
+                asset_id = get_asset_id(self.scrape_url)
+            self._asset_id = asset_id
+        return self._asset_id
+
+    def set_asset_id(self, asset_id):
+        """Set a scraped asset_id"""
+        self._asset_id = asset_id
+
+
 class Metadata:
     """This class creates appropriate Kodi ListItem metadata from single item json api data"""
 
+    _RECORDS_SIZE = 1000
+
     def __init__(self, _favorites, _resumepoints):
         self._favorites = _favorites
         self._resumepoints = _resumepoints
+        self._records = dict()  # Per api_data object the EpisodeRecord of its derived fields
+        self._defer_scraping = get_setting_bool('deferwebscraping', default=False)
+
+    def get_record(self, api_data):
+        """Get the EpisodeRecord of single item json api data, deriving its fields only once"""
+        record = self._records.get(id(api_data))
+        if record is None or record.api_data is not api_data:
+            if len(self._records) >= self._RECORDS_SIZE:
+                self._records.clear()
+            record = EpisodeRecord(api_data)
+            self._records[id(api_data)] = record
+        return record
 
     @staticmethod
     def get_studio(api_data):
@@ -92,6 +240,14 @@ class Metadata:
                         capitalize(localize(30401)),
                         'RunPlugin(%s)' % url_for('watchlater', asset_id=asset_id, title=program_title, url=url)
                     ))
+            elif self._defer_scraping and api_data.get('url'):
+                # Look up the asset_id by web scraping only when watching later
+                program_title = to_unicode(quote_plus(from_unicode(program_title)))
+                url = url_to_episode(api_data.get('url', ''))
+                context_menu.append((
+                    capitalize(localize(30401)),
+                    'RunPlugin(%s)' % url_for('scrape_watchlater', title=program_title, url=url)
+                ))
 
         # FOLLOW PROGRAM
         if self._favorites.is_activated():
@@ -143,32 +299,37 @@ class Metadata:
                 ))
 
         # REFRESH MENU
+        refresh_args = dict(cache_file=cache_file)
+        if program:
+            # Also refresh other menus listing this program
+            refresh_args.update(program=program)
         context_menu.append((
             localize(30413),  # Refresh menu
-            'RunPlugin(%s)' % url_for('delete_cache', cache_file=cache_file)
+            'RunPlugin(%s)' % url_for('delete_cache', **refresh_args)
         ))
 
         return context_menu, colour(favorite_marker), colour(watchlater_marker)
 
-    @staticmethod
-    def get_asset_id(api_data):
+    def get_asset_id(self, api_data, scrape=None):
         """Get asset_id from single item json api data"""
-        asset_id = None
-
-        # VRT NU Search API
-        if api_data.get('type') == 'episode':
-            asset_id = assetpath_to_id(api_data.get('assetPath'))
-
-        # VRT NU Schedule API (some are missing vrt.whatson-id)
-        elif api_data.get('vrt.whatson-id') or api_data.get('startTime'):
-            asset_id = assetpath_to_id(api_data.get('assetPath'))
-
-        # Fallback to VRT NU website scraping
-        if not asset_id and api_data.get('url'):
-            from webscraper import get_asset_id
-            asset_id = get_asset_id(add_https_proto(api_data.get('url')))
-
-        return asset_id
+        if scrape is None:
+            scrape = not self._defer_scraping
+        return self.get_record(api_data).get_asset_id(scrape=scrape)
+
+    def resolve_asset_ids(self, items):
+        """Look up the asset_ids of a listing at once, scraping the VRT NU web pages of items lacking an asset path concurrently"""
+        # Asset ids are only used for VRT NU resumepoints
+        if self._defer_scraping or not self._resumepoints.is_activated():
+            return
+        records = [self.get_record(item) for item in items]
+        records = [record for record in records if record.get_asset_id(scrape=False) is None and record.scrape_url]
+        if not records:
+            return
+        from webscraper import get_asset_ids
+        asset_ids = get_asset_ids([record.scrape_url for record in records])
+        for record in records:
+            # Do not scrape an item again when web scraping failed
+            record.set_asset_id(asset_ids.get(record.scrape_url))
 
     def get_playcount(self, api_data):
         """Get playcount from single item json api data"""
@@ -247,41 +408,19 @@ class Metadata:
         # Not Found
         return ''
 
-    @staticmethod
-    def get_duration(api_data):
+    def get_duration(self, api_data):
         """Get duration int from single item json api data"""
-
-        # VRT NU Search API
-        if api_data.get('type') == 'episode':
-            return api_data.get('duration', int()) * 60  # Minutes to seconds
-
-        # VRT NU Suggest API
-        if api_data.get('type') == 'program':
-            return int()
-
-        # VRT NU Schedule API (some are missing vrt.whatson-id)
-        if api_data.get('vrt.whatson-id') or api_data.get('startTime'):
-            from datetime import timedelta
-            import dateutil.parser
-            start_time = dateutil.parser.parse(api_data.get('startTime'))
-            end_time = dateutil.parser.parse(api_data.get('endTime'))
-            if end_time < start_time:
-                end_time = end_time + timedelta(days=1)
-            return (end_time - start_time).total_seconds()
-
-        # Not Found
-        return ''
+        return self.get_record(api_data).duration
 
     def get_plot(self, api_data, season=False, date=None):
         """Get plot string from single item json api data"""
         from datetime import datetime
-        import dateutil.parser
         import dateutil.tz
 
         # VRT NU Search API
         if api_data.get('type') == 'episode':
             if season:
-                plot = html_to_kodi(api_data.get('programDescription', ''))
+                plot = self.get_record(api_data).text('programDescription')
 
                 # Add additional metadata to plot
                 plot_meta = ''
@@ -294,7 +433,7 @@ class Metadata:
             plot_meta = ''
             # Only display when a video disappears if it is within the next 3 months
             if api_data.get('assetOffTime'):
-                offtime = dateutil.parser.parse(api_data.get('assetOffTime'))
+                offtime = parse_iso8601(api_data.get('assetOffTime'))
 
                 # Show the remaining days/hours the episode is still available
                 if offtime:
@@ -335,7 +474,7 @@ class Metadata:
                     plot_meta += '  '
                 plot_meta += '[B]%s[/B]' % rating
 
-            plot = html_to_kodi(api_data.get('description', ''))
+            plot = self.get_record(api_data).text('description')
 
             if plot_meta:
                 plot = '%s\n\n%s' % (plot_meta, plot)
@@ -368,21 +507,17 @@ class Metadata:
         # Not Found
         return ''
 
-    @staticmethod
-    def get_plotoutline(api_data, season=False):
+    def get_plotoutline(self, api_data, season=False):
         """Get plotoutline string from single item json api data"""
         # VRT NU Search API
         if api_data.get('type') == 'episode':
             if season:
-                plotoutline = html_to_kodi(api_data.get('programDescription', ''))
-                return plotoutline
+                return self.get_record(api_data).text('programDescription')
 
             if api_data.get('displayOptions', {}).get('showShortDescription'):
-                plotoutline = html_to_kodi(api_data.get('shortDescription', ''))
-                return plotoutline
+                return self.get_record(api_data).text('shortDescription')
 
-            plotoutline = html_to_kodi(api_data.get('subtitle'))
-            return plotoutline
+            return self.get_record(api_data).text('subtitle')
 
         # VRT NU Suggest API
         if api_data.get('type') == 'program':
@@ -397,154 +532,27 @@ class Metadata:
 
     def get_season(self, api_data):
         """Get season int from single item json api data"""
-
-        # VRT NU Search API
-        if api_data.get('type') == 'episode':
-            # If this is a oneoff video and the season is a year, don't return a season
-            if api_data.get('programType') == 'oneoff' and self.get_year(api_data):
-                return ''
-            try:
-                season = int(api_data.get('seasonTitle'))
-            except ValueError:
-                try:
-                    season = int(api_data.get('seasonName'))
-                except ValueError:
-                    season = api_data.get('seasonTitle')
-            return season
-
-        # VRT NU Suggest API
-        if api_data.get('type') == 'program':
-            return None
-
-        # VRT NU Schedule API (some are missing vrt.whatson-id)
-        if api_data.get('vrt.whatson-id') or api_data.get('startTime'):
-            return None
-
-        # Not Found
-        return None
+        return self.get_record(api_data).season
 
     def get_episode(self, api_data):
         """Get episode int from single item json api data"""
+        return self.get_record(api_data).episode
 
-        # VRT NU Search API
-        if api_data.get('type') == 'episode':
-            # If this is a oneoff video and the season is a year, don't return an episode
-            if api_data.get('programType') == 'oneoff' and self.get_year(api_data):
-                return ''
-            try:
-                episode = int(api_data.get('episodeNumber'))
-            except ValueError:
-                episode = int()
-            return episode
-
-        # VRT NU Suggest API
-        if api_data.get('type') == 'program':
-            return int()
-
-        # VRT NU Schedule API (some are missing vrt.whatson-id)
-        if api_data.get('vrt.whatson-id') or api_data.get('startTime'):
-            return int()
-
-        # Not Found
-        return int()
-
-    @staticmethod
-    def get_date(api_data):
+    def get_date(self, api_data):
         """Get date string from single item json api data"""
-
-        # VRT NU Search API
-        if api_data.get('type') == 'episode':
-            import dateutil.parser
-            return dateutil.parser.parse(api_data.get('assetOnTime')).strftime('%d.%m.%Y')
-
-        # VRT NU Suggest API
-        if api_data.get('type') == 'program':
-            return ''
-
-        # VRT NU Schedule API (some are missing vrt.whatson-id)
-        if api_data.get('vrt.whatson-id') or api_data.get('startTime'):
-            return ''
-
-        # Not Found
-        return ''
+        return self.get_record(api_data).date
 
     def get_aired(self, api_data):
         """Get aired string from single item json api data"""
+        return self.get_record(api_data).aired
 
-        # VRT NU Search API
-        if api_data.get('type') == 'episode':
-            # FIXME: Due to a bug in Kodi, ListItem.Year, as shown in Info pane, is based on 'aired' when set
-            # If this is a oneoff (e.g. movie) and we get a year of release, do not set 'aired'
-            if api_data.get('programType') == 'oneoff' and self.get_year(api_data):
-                return ''
-            aired = ''
-            if api_data.get('broadcastDate'):
-                from datetime import datetime
-                import dateutil.tz
-                aired = datetime.fromtimestamp(api_data.get('broadcastDate', 0) / 1000, dateutil.tz.UTC).strftime('%Y-%m-%d')
-            return aired
-
-        # VRT NU Suggest API
-        if api_data.get('type') == 'program':
-            return ''
-
-        # VRT NU Schedule API (some are missing vrt.whatson-id)
-        if api_data.get('vrt.whatson-id') or api_data.get('startTime'):
-            from datetime import datetime
-            import dateutil.parser
-            import dateutil.tz
-            aired = dateutil.parser.parse(api_data.get('startTime')).astimezone(dateutil.tz.UTC).strftime('%Y-%m-%d')
-            return aired
-
-        # Not Found
-        return ''
-
-    @staticmethod
-    def get_dateadded(api_data):
+    def get_dateadded(self, api_data):
         """Get dateadded string from single item json api data"""
+        return self.get_record(api_data).dateadded
 
-        # VRT NU Search API
-        if api_data.get('type') == 'episode':
-            import dateutil.parser
-            return dateutil.parser.parse(api_data.get('assetOnTime')).strftime('%Y-%m-%d %H:%M:%S')
-
-        # VRT NU Suggest API
-        if api_data.get('type') == 'program':
-            return ''
-
-        # VRT NU Schedule API (some are missing vrt.whatson-id)
-        if api_data.get('vrt.whatson-id') or api_data.get('startTime'):
-            return ''
-
-        # Not Found
-        return ''
-
-    @staticmethod
-    def get_year(api_data):
+    def get_year(self, api_data):
         """Get year integer from single item json api data"""
-        from datetime import datetime
-
-        # VRT NU Search API
-        if api_data.get('type') == 'episode':
-            # Add proper year information when season falls in range
-            # NOTE: Estuary skin is using premiered/aired year, which is incorrect
-            try:
-                if int(api_data.get('seasonTitle')) in range(1900, datetime.now().year + 1):
-                    return int(api_data.get('seasonTitle'))
-            except ValueError:
-                pass
-            return int()
-
-        # VRT NU Suggest API
-        if api_data.get('type') == 'program':
-            return int()
-
-        # VRT NU Schedule API (some are missing vrt.whatson-id)
-        if api_data.get('vrt.whatson-id') or api_data.get('startTime'):
-            return int()
-
-        # Not Found
-        return ''
+        return self.get_record(api_data).year
 
     def get_mediatype(self, api_data, season=False):
         """Get art dict from single item json api data"""
@@ -555,7 +563,7 @@ class Metadata:
                 return 'season'
 
             # If this is a oneoff (e.g. movie) and we get a year of release, do not set 'aired'
-            if api_data.get('programType') == 'oneoff' and self.get_year(api_data):
+            if self.get_record(api_data).is_movie:
                 return 'movie'
 
             return 'episode'
@@ -686,13 +694,15 @@ class Metadata:
         # Not Found
         return {}
 
-    @staticmethod
-    def get_title(api_data):
+    def get_title(self, api_data):
         """Get an appropriate video title"""
 
         # VRT NU Search API
         if api_data.get('type') == 'episode':
-            title = html_to_kodi(api_data.get('title') or api_data.get('shortDescription', '???'))
+            if api_data.get('title') or 'shortDescription' in api_data:
+                title = self.get_record(api_data).text('title', 'shortDescription')
+            else:
+                title = '???'
 
         # VRT NU Suggest API
         elif api_data.get('type') == 'program':
@@ -704,8 +714,7 @@ class Metadata:
 
         return title
 
-    @staticmethod
-    def get_label(api_data, titletype=None, return_sort=False):
+    def get_label(self, api_data, titletype=None, return_sort=False):
         """Get an appropriate label string matching the type of listing and VRT NU provided displayOptions from single item json api data"""
 
         # VRT NU Search API
@@ -719,12 +728,10 @@ class Metadata:
             if not titletype:
                 titletype = program_type
 
-            if display_options.get('showEpisodeTitle'):
-                label = html_to_kodi(api_data.get('title', '') or api_data.get('shortDescription', ''))
-            elif display_options.get('showShortDescription'):
-                label = html_to_kodi(api_data.get('shortDescription', '') or api_data.get('title', ''))
+            if display_options.get('showShortDescription') and not display_options.get('showEpisodeTitle'):
+                label = self.get_record(api_data).text('shortDescription', 'title')
             else:
-                label = html_to_kodi(api_data.get('title', '') or api_data.get('shortDescription', ''))
+                label = self.get_record(api_data).text('title', 'shortDescription')
 
             sort = 'unsorted'
             ascending = True
@@ -813,7 +820,6 @@ class Metadata:
             It also compensates for TV-guides covering from 6AM to 6AM
        """
         from datetime import timedelta
-        import dateutil.parser
 
         if date == 'today':
             if now.hour < 6:
@@ -827,4 +833,4 @@ class Metadata:
             if now.hour < 6:
                 return now
             return now + timedelta(days=1)
-        return dateutil.parser.parse(date)
+        return parse_iso8601(date)
@@ -9,7 +9,7 @@ from xbmc import getInfoLabel, Player, PlayList
 from apihelper import ApiHelper
 from data import CHANNELS
 from favorites import Favorites
-from kodiutils import addon_id, get_setting_bool, has_addon, jsonrpc, kodi_version_major, log, log_error, notify, set_property
+from kodiutils import addon_id, get_property, get_setting_bool, has_addon, jsonrpc, kodi_version_major, log, log_error, notify, set_property
 from resumepoints import ResumePoints
 from utils import play_url_to_id, to_unicode, url_to_episode
 
@@ -17,6 +17,8 @@ from utils import play_url_to_id, to_unicode, url_to_episode
 class PlayerInfo(Player, object):  # pylint: disable=useless-object-inheritance
     """Class for communication with Kodi player"""
 
+    _PREFETCH_BEFORE_END = 120  # Seconds before the end of an episode to resolve the stream of the next episode
+
     def __init__(self):
         """PlayerInfo initialisation"""
         self.resumepoints = ResumePoints()
@@ -37,6 +39,9 @@ class PlayerInfo(Player, object):  # pylint: disable=useless-object-inheritance
         self.ep_id = None
         self.url = None
         self.whatson_id = None
+        self.program_url = None
+        self.video_id = None
+        self.next_video_id = None
         from random import randint
         self.thread_id = randint(1, 10001)
         log(3, '[PlayerInfo {id}] Initialized', id=self.thread_id)
@@ -65,6 +70,9 @@ class PlayerInfo(Player, object):  # pylint: disable=useless-object-inheritance
         self.title = None
         self.url = None
         self.whatson_id = None
+        self.program_url = None
+        self.video_id = None
+        self.next_video_id = None
 
         ep_id = play_url_to_id(self.path)
 
@@ -88,10 +96,12 @@ class PlayerInfo(Player, object):  # pylint: disable=useless-object-inheritance
             return
 
         from metadata import Metadata
-        self.asset_id = Metadata(None, None).get_asset_id(episode)
+        self.asset_id = Metadata(None, None).get_asset_id(episode, scrape=True)
         self.title = episode.get('program')
         self.url = url_to_episode(episode.get('url', ''))
         self.whatson_id = episode.get('whatsonId') or None  # Avoid empty string
+        self.program_url = episode.get('programUrl')
+        self.video_id = episode.get('videoId')
 
         # Kodi 17 doesn't have onAVStarted
         if kodi_version_major() < 18:
@@ -181,6 +191,7 @@ class PlayerInfo(Player, object):  # pylint: disable=useless-object-inheritance
         """Get latest stream position while playing"""
         while self.isPlaying() and not self.quit.is_set():
             self.update_position()
+            self.prefetch_next_stream()
             if self.quit.wait(timeout=0.2):
                 break
         self.onPlayerExit()
@@ -204,20 +215,66 @@ class PlayerInfo(Player, object):  # pylint: disable=useless-object-inheritance
         """Push episode info to Up Next service add-on"""
         if has_addon('service.upnext') and get_setting_bool('useupnext', default=True) and self.isPlaying():
             info_tag = self.getVideoInfoTag()
-            next_info = self.apihelper.get_upnext(dict(
-                program=to_unicode(info_tag.getTVShowTitle()),
-                playcount=info_tag.getPlayCount(),
-                rating=info_tag.getRating(),
-                path=self.path,
-                runtime=self.total,
-            ))
+            next_info = self.get_prepared_upnext()
+            if next_info:
+                next_info.get('current_episode').update(
+                    playcount=info_tag.getPlayCount(),
+                    rating=info_tag.getRating(),
+                    runtime=self.total,
+                )
+            else:
+                next_info = self.apihelper.get_upnext(dict(
+                    program=to_unicode(info_tag.getTVShowTitle()),
+                    playcount=info_tag.getPlayCount(),
+                    rating=info_tag.getRating(),
+                    path=self.path,
+                    program_url=self.program_url,
+                    runtime=self.total,
+                ))
             if next_info:
+                self.next_video_id = next_info.get('play_info').get('video_id')
                 from base64 import b64encode
                 from json import dumps
                 data = [to_unicode(b64encode(dumps(next_info).encode()))]
                 sender = '{addon_id}.SIGNAL'.format(addon_id=addon_id())
                 notify(sender=sender, message='upnext_data', data=data)
 
+    def prefetch_next_stream(self):
+        """Resolve the stream of the next Up Next episode in the background, shortly before the current episode ends"""
+        if not self.next_video_id or self.last_pos is None or self.total - self.last_pos > self._PREFETCH_BEFORE_END:
+            return
+        video_id = self.next_video_id
+        self.next_video_id = None
+        Thread(target=self.prefetch_stream, name='StreamPrefetch', args=(video_id,)).start()
+
+    def prefetch_stream(self, video_id):
+        """Resolve the stream of an episode ahead of time"""
+        episode = self.apihelper.get_single_episode_data(video_id=video_id)
+        if episode is None:
+            return
+        from streamservice import StreamService
+        from tokenresolver import TokenResolver
+        video = dict(video_id=episode.get('videoId'), publication_id=episode.get('publicationId'))
+        StreamService(TokenResolver()).prefetch_stream(video, episode=episode)
+
+    def get_prepared_upnext(self):
+        """Get the Up Next payload prepared when playback was resolved, if it matches the current episode"""
+        prepared = get_property('vrtnu_upnext')
+        if prepared == 'busy':
+            from time import time
+            time_out = time() + 5  # 5 seconds timeout
+            log(3, '[PlayerInfo {id}] Up Next data is being prepared, wait', id=self.thread_id)
+            while prepared == 'busy' and time() < time_out and not self.quit.wait(timeout=0.05):
+                prepared = get_property('vrtnu_upnext')
+        if not prepared or prepared == 'busy':
+            return None
+        from json import loads
+        prepared = loads(prepared)
+        if not self.video_id or prepared.get('video_id') != self.video_id:
+            return None
+        log(3, '[PlayerInfo {id}] Use prepared Up Next data for {video_id}', id=self.thread_id, video_id=self.video_id)
+        return prepared.get('next_info')
+
     def update_position(self):
         """Update the player position, when possible"""
         try:
@@ -6,7 +6,8 @@ from __future__ import absolute_import, division, unicode_literals
 from xbmc import Monitor
 from apihelper import ApiHelper
 from favorites import Favorites
-from kodiutils import container_refresh, invalidate_caches, log
+from kodiutils import (Lazy, addon_id, container_refresh, get_setting_bool, get_setting_int, invalidate_caches, invalidate_settings,
+                       log, log_error, prune_cache, refresh_stale_cache, reset_log_level)
 from playerinfo import PlayerInfo
 from resumepoints import ResumePoints
 from tokenresolver import TokenResolver
@@ -27,7 +28,25 @@ class VrtMonitor(Monitor, object):  # pylint: disable=useless-object-inheritance
 
     def run(self):
         """Main loop"""
+        from time import time
+        pruned = 0
+        exported = 0
         while not self.abortRequested():
+            # Kodi does not notify us when debug logging is toggled
+            reset_log_level()
+            # Enforce the HTTP cache limits every hour
+            if time() - pruned > 60 * 60:
+                prune_cache()
+                pruned = time()
+            # Regenerate the XMLTV file periodically
+            if get_setting_bool('xmltv.enabled', default=False) and time() - exported > get_setting_int('xmltv.interval', default=12) * 60 * 60:
+                from xmltv import XMLTV
+                try:
+                    XMLTV().write()
+                except (IOError, OSError) as exc:  # e.g. an unwritable XMLTV folder
+                    log_error('XMLTV export failed: {error}', error=exc)
+                # Do not retry a failed export every 10 seconds
+                exported = time()
             if self.waitForAbort(10):
                 break
 
@@ -59,12 +78,19 @@ class VrtMonitor(Monitor, object):  # pylint: disable=useless-object-inheritance
             # NOTE: With Python 3.5 and older json.loads() does not support bytes or bytearray, so we convert to unicode
             from base64 import b64decode
             data = loads(to_unicode(b64decode(hexdata[0])))
-            log(2, '[Up Next notification] sender={sender}, method={method}, data={data}', sender=sender, method=method, data=to_unicode(data))
+            log(2, '[Up Next notification] sender={sender}, method={method}, data={data}', sender=sender, method=method, data=Lazy(to_unicode, data))
             self._playerinfo.add_upnext(data.get('video_id'))
 
+        # Handle background refreshes of stale caches
+        elif sender == '{addon_id}.SIGNAL'.format(addon_id=addon_id()) and method.endswith('refresh_cache'):
+            from json import loads
+            data = loads(data)
+            refresh_stale_cache(data.get('url'), data.get('cache'), data.get('ttl'))
+
     def onSettingsChanged(self):  # pylint: disable=invalid-name
         """Handler for changes to settings"""
 
+        invalidate_settings()
         log(1, 'Settings changed')
         TokenResolver().refresh_login()
 
@@ -12,10 +12,10 @@ except ImportError:  # Python 2
     from urllib2 import quote, HTTPError
 
 from helperobjects import ApiData, StreamURLS
-from kodiutils import (addon_profile, can_play_drm, container_reload, exists, end_of_directory, get_max_bandwidth,
-                       get_setting_bool, get_url_json, has_inputstream_adaptive, invalidate_caches,
-                       kodi_version_major, localize, log, log_error, mkdir, ok_dialog, open_settings,
-                       open_url, supports_drm, to_unicode)
+from kodiutils import (addon_profile, can_play_drm, clear_property, container_reload, exists, end_of_directory,
+                       get_max_bandwidth, get_property, get_setting_bool, get_url_json, has_inputstream_adaptive,
+                       invalidate_caches, invalidate_tagged_caches, kodi_version_major, localize, log, log_error, mkdir, ok_dialog,
+                       open_settings, open_url, set_property, supports_drm, to_unicode)
 
 
 class StreamService:
@@ -28,6 +28,7 @@ class StreamService:
     _INVALID_LOCATION = 'INVALID_LOCATION'
     _INCOMPLETE_ROAMING_CONFIG = 'INCOMPLETE_ROAMING_CONFIG'
     _GEOBLOCK_ERROR_CODES = (_INCOMPLETE_ROAMING_CONFIG, _INVALID_LOCATION)
+    _PREFETCH_MAX_AGE = 10 * 60  # Seconds a pre-resolved stream may be used, at most until the vrtPlayerToken expires
 
     def __init__(self, _tokenresolver):
         """Initialize Stream Service class"""
@@ -35,6 +36,7 @@ class StreamService:
         self._create_settings_dir()
         self._can_play_drm = can_play_drm()
         self._vualto_license_url = None
+        self._interactive = True
 
     def _get_vualto_license_url(self):
         """Get Widevine license URL from Vualto API"""
@@ -270,9 +272,13 @@ class StreamService:
             message = localize(30964)  # Geoblock error: Cannot be played, need Belgian phone number validation
             return self._handle_stream_api_error(message, stream_json)
         if stream_json.get('code') == 'VIDEO_NOT_FOUND':
-            # Refresh listing
-            invalidate_caches('*.json')
-            container_reload()
+            # Refresh the listings referencing this video, or all listings when we do not know the video
+            if api_data.video_id:
+                invalidate_tagged_caches('video:' + api_data.video_id)
+            else:
+                invalidate_caches('*.json')
+            if self._interactive:
+                container_reload()
             message = localize(30987)  # No stream found
             return self._handle_stream_api_error(message, stream_json)
 
@@ -280,16 +286,65 @@ class StreamService:
         message = localize(30954)  # Whoops something went wrong
         return self._handle_stream_api_error(message, stream_json)
 
+    def prefetch_stream(self, video, episode=None):
+        """Resolve a stream ahead of time without user interaction, and hand it over to the next play_upnext"""
+        from time import time
+        self._interactive = False
+        try:
+            stream = self.get_stream(video)
+        finally:
+            self._interactive = True
+        if stream is None or stream.stream_url is None:
+            return False
+
+        expires = time() + self._PREFETCH_MAX_AGE
+        token_expiration = self._tokenresolver.get_token_expiration('vrtPlayerToken', 'ondemand')
+        if token_expiration:
+            from calendar import timegm
+            expires = min(expires, timegm(token_expiration.utctimetuple()))
+        from json import dumps
+        set_property('vrtnu_nextstream', dumps(dict(
+            video_id=video.get('video_id'),
+            expires=expires,
+            episode=episode,
+            stream=dict(
+                stream_url=stream.stream_url,
+                subtitle_url=stream.subtitle_url,
+                license_key=stream.license_key,
+                use_inputstream_adaptive=stream.use_inputstream_adaptive,
+            ),
+        )))
+        log(2, 'Pre-resolved stream for {video_id}', video_id=video.get('video_id'))
+        return True
+
     @staticmethod
-    def _handle_stream_api_error(message, video_json=None):
+    def get_prefetched_stream(video_id):
+        """Get a stream and its episode data resolved ahead of time, if it is still valid"""
+        prefetched = get_property('vrtnu_nextstream')
+        if not prefetched:
+            return None
+        clear_property('vrtnu_nextstream')
+        from json import loads
+        from time import time
+        prefetched = loads(prefetched)
+        if prefetched.get('video_id') != video_id:
+            return None
+        if prefetched.get('expires', 0) <= time():
+            log(2, 'Pre-resolved stream for {video_id} expired', video_id=video_id)
+            return None
+        stream = StreamURLS(**prefetched.get('stream'))
+        return stream, prefetched.get('episode')
+
+    def _handle_stream_api_error(self, message, video_json=None):
         """Show localized stream api error messages in Kodi GUI"""
         if video_json:
             log_error(video_json.get('message'))
+        if not self._interactive:
+            return
         ok_dialog(message=message)
         end_of_directory()
 
-    @staticmethod
-    def _handle_bad_stream_error(protocol, code=None, reason=None):
+    def _handle_bad_stream_error(self, protocol, code=None, reason=None):
         """Show a localized error message in Kodi GUI for a failing VRT NU stream based on protocol: hls, hls_aes, mpeg_dash)
             message: VRT NU stream <stream_type> problem, try again with (InputStream Adaptive) (and) (DRM) enabled/disabled:
                 30959=and DRM, 30960=disabled, 30961=enabled
@@ -307,6 +362,8 @@ class StreamService:
             message = localize(30958, protocol=protocol.upper(), component='InputStream Adaptive', state=localize(30960))
         heading = 'HTTP Error {code}: {reason}'.format(code=code, reason=reason) if code and reason else None
         log_error('Unable to play stream. {error}', error=heading)
+        if not self._interactive:
+            return
         ok_dialog(heading=heading, message=message)
         end_of_directory()
 
@@ -346,6 +403,8 @@ class StreamService:
                 break
 
         if stream_bandwidth > max_bandwidth and not hls_variant_url:
+            if not self._interactive:
+                return None
             message = localize(30057, max=max_bandwidth, min=stream_bandwidth)
             ok_dialog(message=message)
             open_settings()
@@ -7,7 +7,7 @@ from kodiutils import (addon_profile, delete, delete_cache, exists, get_cache, g
                        get_url_json, has_credentials, invalidate_caches, listdir,
                        localize, log, log_error, notification, ok_dialog,
                        open_settings, set_setting, update_cache)
-from utils import from_unicode
+from utils import from_unicode, parse_iso8601
 
 try:  # Python 3
     import http.cookiejar as cookielib
@@ -264,6 +264,14 @@ class TokenResolver:
             return token.get(name)
         return None
 
+    def get_token_expiration(self, name, variant=None):
+        """Get the expiration date of a cached token"""
+        cache_file = self._get_token_filename(name, variant)
+        token = get_cache(cache_file, cache_dir=self._TOKEN_CACHE_DIR)
+        if not token or not token.get('expirationDate'):
+            return None
+        return parse_iso8601(token.get('expirationDate'))
+
     def _get_fresh_token(self, refresh_token, name):
         """Refresh an expired X-VRT-Token, vrtlogin-at or vrtlogin-rt token"""
         refresh_url = self._TOKEN_GATEWAY_URL + '/refreshtoken?legacy=true'
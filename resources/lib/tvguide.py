@@ -5,17 +5,16 @@
 
 from __future__ import absolute_import, division, unicode_literals
 from datetime import datetime, timedelta
-import dateutil.parser
 import dateutil.tz
 
 from data import CHANNELS, RELATIVE_DATES
 from favorites import Favorites
-from helperobjects import TitleItem
-from kodiutils import (colour, get_cached_url_json, get_url_json, has_addon, localize,
-                       localize_datelong, show_listing, themecolour, ttl, url_for)
+from helperobjects import EncodedJSON, ScheduleIndex, TitleItem
+from kodiutils import (colour, get_cache, get_cache_store, get_cached_url_json, get_setting_int, get_url_json, has_addon,
+                       localize, localize_datelong, parallel_imap, show_listing, themecolour, ttl, update_cache, url_for)
 from metadata import Metadata
 from resumepoints import ResumePoints
-from utils import add_https_proto, find_entry, html_to_kodi, url_to_program
+from utils import add_https_proto, find_entry, html_to_kodi, parse_iso8601, url_to_program
 
 
 class TVGuide:
@@ -28,6 +27,26 @@ class TVGuide:
         self._favorites = Favorites()
         self._resumepoints = ResumePoints()
         self._metadata = Metadata(self._favorites, self._resumepoints)
+        self._schedules = dict()  # Per schedule date the loaded schedule and its ScheduleIndex per channel
+
+    def get_schedule_index(self, date, channel_id, now=None):
+        """Return the ScheduleIndex of a channel for a given date, loading every schedule only once"""
+        if now is None:
+            now = datetime.now(dateutil.tz.tzlocal())
+        epg = self.parse(date, now)
+        schedule_date = epg.strftime('%Y-%m-%d')
+        if schedule_date not in self._schedules:
+            epg_url = epg.strftime(self.VRT_TVGUIDE)
+            if date in ('today', 'yesterday', 'tomorrow'):
+                cache_file = 'schedule.{date}.json'.format(date=date)
+                schedule = get_cached_url_json(url=epg_url, cache=cache_file, ttl=ttl('indirect'), fail={})
+            else:
+                schedule = get_url_json(url=epg_url, fail={})
+            self._schedules[schedule_date] = (schedule, dict())
+        schedule, indexes = self._schedules[schedule_date]
+        if channel_id not in indexes:
+            indexes[channel_id] = ScheduleIndex(schedule.get(channel_id, []))
+        return indexes[channel_id]
 
     def show_tvguide(self, date=None, channel=None):
         """Offer a menu depending on the information provided"""
@@ -151,25 +170,22 @@ class TVGuide:
     def get_episode_items(self, date, channel):
         """Show episodes for a given date and channel"""
         now = datetime.now(dateutil.tz.tzlocal())
-        epg = self.parse(date, now)
-        epg_url = epg.strftime(self.VRT_TVGUIDE)
 
         self._favorites.refresh(ttl=ttl('indirect'))
         self._resumepoints.refresh(ttl=ttl('indirect'))
 
         cache_file = 'schedule.{date}.json'.format(date=date)
-        if date in ('today', 'yesterday', 'tomorrow'):
-            schedule = get_cached_url_json(url=epg_url, cache=cache_file, ttl=ttl('indirect'), fail={})
-        else:
-            schedule = get_url_json(url=epg_url, fail={})
-
         entry = find_entry(CHANNELS, 'name', channel)
         if entry:
-            episodes = schedule.get(entry.get('id'), [])
+            schedule_index = self.get_schedule_index(date, entry.get('id'), now)
         else:
-            episodes = []
+            schedule_index = ScheduleIndex([])
+        playing = schedule_index.playing(now)
+        # Scrape the asset_ids of episodes without an assetPath at once
+        self._metadata.resolve_asset_ids(schedule_index.episodes + schedule_index.untimed)
         episode_items = []
-        for episode in episodes:
+        # Episodes without a start or end time cannot be placed in the schedule, so they are listed last
+        for position, episode in enumerate(schedule_index.episodes + schedule_index.untimed):
             program = url_to_program(episode.get('url', ''))
             context_menu, favorite_marker, watchlater_marker = self._metadata.get_context_menu(episode, program, cache_file)
             label = self._metadata.get_label(episode)
@@ -184,9 +200,7 @@ class TVGuide:
                 label = '[COLOR={greyedout}]%s[/COLOR]' % label
 
             # Now playing
-            start_date = dateutil.parser.parse(episode.get('startTime'))
-            end_date = dateutil.parser.parse(episode.get('endTime'))
-            if start_date <= now <= end_date:
+            if position == playing:
                 if is_playable:
                     label = '[COLOR={highlighted}]%s[/COLOR] %s' % (label, localize(30301))
                 else:
@@ -209,70 +223,114 @@ class TVGuide:
     @staticmethod
     def get_episode_path(episode, channel):
         """Return a playable plugin:// path for an episode"""
-        now = datetime.now(dateutil.tz.tzlocal())
-        end_date = dateutil.parser.parse(episode.get('endTime'))
         if episode.get('url') and episode.get('vrt.whatson-id'):
             return url_for('play_whatson_id', whatson_id=episode.get('vrt.whatson-id'))
-        if now - timedelta(hours=24) <= end_date <= now:
-            return url_for('play_air_date', channel, episode.get('startTime')[:19], episode.get('endTime')[:19])
+        # Untimed episodes cannot be played by air date
+        if episode.get('startTime') and episode.get('endTime'):
+            now = datetime.now(dateutil.tz.tzlocal())
+            end_date = parse_iso8601(episode.get('endTime'))
+            if now - timedelta(hours=24) <= end_date <= now:
+                return url_for('play_air_date', channel, episode.get('startTime')[:19], episode.get('endTime')[:19])
         return url_for('noop', whatsonid=episode.get('vrt.whatson-id', ''))
 
-    def get_epg_data(self):
-        """Return EPG data"""
+    @classmethod
+    def get_schedule(cls, epg):
+        """Get the EPG schedule of all channels for a given date"""
+        cache_file = 'schedule.{date}.json'.format(date=epg.strftime('%Y-%m-%d'))
+        return get_cached_url_json(url=epg.strftime(cls.VRT_TVGUIDE), cache=cache_file, ttl=ttl('indirect'), fail={})
+
+    def get_epg_data(self, days=None):
+        """Generate the JSONTV encoded EPG data per channel for a window of days around today
+            The days are fetched concurrently, and each day is used as soon as it is available
+        """
         now = datetime.now(dateutil.tz.tzlocal())
+        if days is None:
+            days = get_setting_int('iptv.epg_days', default=1)
+        today = self.parse('today', now)
+        fetching = parallel_imap(self.get_epg_day, [today + timedelta(days=offset) for offset in range(-days, days + 1)])
+        fetched = []
+
+        def epg_days():
+            """Generate the EPG days in order, waiting for the days that are still being fetched"""
+            for epg_day in fetched:
+                yield epg_day
+            for epg_day in fetching:
+                fetched.append(epg_day or {})
+                yield epg_day or {}
+
+        def programmes(channel_id):
+            """Generate the encoded programmes of a channel day by day, and release them once they are used"""
+            for epg_day in epg_days():
+                programme = epg_day.pop(channel_id, None)
+                if programme:
+                    yield programme
+
+        for channel in CHANNELS:
+            if channel.get('has_tvguide') and channel.get('epg_id'):
+                yield channel.get('epg_id'), EncodedJSON(programmes(channel.get('id')))
+
+    def get_epg_day(self, epg):
+        """Return the JSONTV encoded programmes per channel for a given date
+            Channels whose schedule did not change since the previous EPG are reused as they were encoded then
+       """
+        import hashlib
+        import json
+        date = epg.strftime('%Y-%m-%d')
+        schedule = self.get_schedule(epg)
+        cache_file = 'iptv.epg.{date}.json'.format(date=date)
+        previous = get_cache(cache_file) or {}
+        channels = previous.get('channels', {})
+        if not schedule:
+            return dict((channel_id, entry.get('programmes')) for channel_id, entry in channels.items())
+
+        # An unchanged schedule response means nothing changed for any channel
+        validators = get_cache_store().get_validators('schedule.{date}.json'.format(date=date))
+        if validators and previous.get('validators') == validators:
+            return dict((channel_id, entry.get('programmes')) for channel_id, entry in channels.items())
+
+        epg_day = dict()
+        for channel_id, episodes in schedule.items():
+            digest = hashlib.md5(json.dumps(episodes, sort_keys=True).encode('utf-8')).hexdigest()
+            entry = channels.get(channel_id)
+            if not entry or entry.get('hash') != digest:
+                programmes = ', '.join(json.dumps(programme) for programme in self.get_epg_programmes([schedule], channel_id))
+                entry = dict(hash=digest, programmes=programmes)
+            epg_day[channel_id] = entry
+        if epg_day != channels or validators != previous.get('validators'):
+            update_cache(cache_file, json.dumps(dict(validators=validators, channels=epg_day)))
+        return dict((channel_id, entry.get('programmes')) for channel_id, entry in epg_day.items())
 
-        epg_data = dict()
-        for date in ['yesterday', 'today', 'tomorrow']:
-            epg = self.parse(date, now)
-            epg_url = epg.strftime(self.VRT_TVGUIDE)
-            schedule = get_url_json(url=epg_url, fail={})
-            for channel_id, episodes in list(schedule.items()):
-                channel = find_entry(CHANNELS, 'id', channel_id)
-                epg_id = channel.get('epg_id')
-                if epg_id not in epg_data:
-                    epg_data[epg_id] = []
-                for episode in episodes:
-                    if episode.get('url') and episode.get('vrt.whatson-id'):
-                        path = url_for('play_whatson_id', whatson_id=episode.get('vrt.whatson-id'))
-                    else:
-                        path = None
-                    epg_data[epg_id].append(dict(
-                        start=episode.get('startTime'),
-                        stop=episode.get('endTime'),
-                        image=add_https_proto(episode.get('image', '')),
-                        title=episode.get('title'),
-                        subtitle=html_to_kodi(episode.get('subtitle', '')),
-                        description=html_to_kodi(episode.get('description', '')),
-                        stream=path,
-                    ))
-        return epg_data
+    @staticmethod
+    def get_epg_programmes(schedules, channel_id):
+        """Generate the EPG programmes of a channel from a list of daily schedules"""
+        for schedule in schedules:
+            for episode in schedule.get(channel_id, []):
+                if episode.get('url') and episode.get('vrt.whatson-id'):
+                    path = url_for('play_whatson_id', whatson_id=episode.get('vrt.whatson-id'))
+                else:
+                    path = None
+                yield dict(
+                    start=episode.get('startTime'),
+                    stop=episode.get('endTime'),
+                    image=add_https_proto(episode.get('image', '')),
+                    title=episode.get('title'),
+                    subtitle=html_to_kodi(episode.get('subtitle', '')),
+                    description=html_to_kodi(episode.get('description', '')),
+                    stream=path,
+                )
 
     def playing_now(self, channel):
         """Return the EPG information for what is playing now"""
         now = datetime.now(dateutil.tz.tzlocal())
-        epg = now
-        # Daily EPG information shows information from 6AM until 6AM
-        if epg.hour < 6:
-            epg += timedelta(days=-1)
-
         entry = find_entry(CHANNELS, 'name', channel)
         if not entry:
             return ''
 
-        epg_url = epg.strftime(self.VRT_TVGUIDE)
-        schedule = get_cached_url_json(url=epg_url, cache='schedule.today.json', ttl=ttl('indirect'), fail={})
-        episodes = iter(schedule.get(entry.get('id'), []))
-
-        while True:
-            try:
-                episode = next(episodes)
-            except StopIteration:
-                break
-            start_date = dateutil.parser.parse(episode.get('startTime'))
-            end_date = dateutil.parser.parse(episode.get('endTime'))
-            if start_date <= now <= end_date:  # Now playing
-                return episode.get('title')
-        return ''
+        schedule_index = self.get_schedule_index('today', entry.get('id'), now)
+        position = schedule_index.playing(now)
+        if position is None:
+            return ''
+        return schedule_index.episodes[position].get('title')
 
     @staticmethod
     def episode_description(episode):
@@ -282,45 +340,28 @@ class TVGuide:
     def live_description(self, channel):
         """Return the EPG information for current and next live program"""
         now = datetime.now(dateutil.tz.tzlocal())
-        epg = now
-        # Daily EPG information shows information from 6AM until 6AM
-        if epg.hour < 6:
-            epg += timedelta(days=-1)
-
         entry = find_entry(CHANNELS, 'name', channel)
         if not entry:
             return ''
 
-        epg_url = epg.strftime(self.VRT_TVGUIDE)
-        schedule = get_cached_url_json(url=epg_url, cache='schedule.today.json', ttl=ttl('indirect'), fail={})
-        episodes = iter(schedule.get(entry.get('id'), []))
+        schedule_index = self.get_schedule_index('today', entry.get('id'), now)
+        episodes = schedule_index.episodes
+        if not episodes:
+            return ''
 
         description = ''
-        episode = None
-        while True:
-            try:
-                episode = next(episodes)
-            except StopIteration:
-                break
-            start_date = dateutil.parser.parse(episode.get('startTime'))
-            end_date = dateutil.parser.parse(episode.get('endTime'))
-            if start_date <= now <= end_date:  # Now playing
-                description = '[COLOR={highlighted}][B]%s[/B] %s[/COLOR]\n' % (localize(30421), self.episode_description(episode))
-                try:
-                    description += '[B]%s[/B] %s' % (localize(30422), self.episode_description(next(episodes)))
-                except StopIteration:
-                    break
-                break
-            if now < start_date:  # Nothing playing now, but this may be next
-                description = '[B]%s[/B] %s\n' % (localize(30422), self.episode_description(episode))
-                try:
-                    description += '[B]%s[/B] %s' % (localize(30422), self.episode_description(next(episodes)))
-                except StopIteration:
-                    break
-                break
-        if episode and not description:
+        position = schedule_index.playing(now)
+        if position is not None:  # Now playing
+            description = '[COLOR={highlighted}][B]%s[/B] %s[/COLOR]\n' % (localize(30421), self.episode_description(episodes[position]))
+        else:  # Nothing playing now, but this may be next
+            position = schedule_index.upcoming(now)
+            if position is not None:
+                description = '[B]%s[/B] %s\n' % (localize(30422), self.episode_description(episodes[position]))
+        if position is None:
             # Add a final 'No transmission' program
-            description = '[COLOR={highlighted}][B]%s[/B] %s - 06:00\n» %s[/COLOR]' % (localize(30421), episode.get('end'), localize(30423))
+            description = '[COLOR={highlighted}][B]%s[/B] %s - 06:00\n» %s[/COLOR]' % (localize(30421), episodes[-1].get('end'), localize(30423))
+        elif position + 1 < len(episodes):
+            description += '[B]%s[/B] %s' % (localize(30422), self.episode_description(episodes[position + 1]))
         return colour(description)
 
     @staticmethod
@@ -331,7 +372,7 @@ class TVGuide:
        """
         entry = find_entry(RELATIVE_DATES, 'id', date)
         if not entry:
-            return dateutil.parser.parse(date)
+            return parse_iso8601(date)
 
         offset = entry.get('offset')
         if now.hour < 6:
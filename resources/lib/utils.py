@@ -24,9 +24,22 @@ HTML_MAPPING = [
     (re.compile(r'<li>', re.I), '- '),
     (re.compile(r'</?(li|ul|ol)(|\s[^>]+)>', re.I), '\n'),
     (re.compile(r'</?(code|div|p|pre|span)(|\s[^>]+)>', re.I), ''),
+]
+HTML_WHITESPACE_MAPPING = [
     (re.compile('<br>\n{0,1}', re.I), ' '),  # This appears to be specific formatting for VRT NU, but unwanted by us
     (re.compile('(&nbsp;\n){2,}', re.I), '\n'),  # Remove repeating non-blocking spaced newlines
 ]
+HTML_TAG_REGEX = re.compile(r'(<[^<>]*>)')
+HTML_TAGS = dict()  # Memo of converted tags, descriptions use only a few distinct tags
+HTML_TAGS_SIZE = 256
+HTML_NESTED_TAG_REGEX = re.compile('<[^>]*<')  # A tag within a tag, where the order of HTML_MAPPING matters
+HTML_CACHE = dict()  # Memo of converted texts, listings share program descriptions and EPG titles
+HTML_CACHE_SIZE = 1024
+KODI_MARKUP_REGEX = re.compile(r'\[(?:/?[BI]|COLOR=[^\]]*|/COLOR)\]')
+ISO8601_REGEX = re.compile(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?(Z|[+-]\d{2}(?::?\d{2})?)?$')
+ISO8601_CACHE = dict()  # Memo of parsed timestamps, EPG entries share most of their start and end times
+ISO8601_CACHE_SIZE = 4096
+TZ_OFFSETS = dict()  # Shared tzinfo objects per UTC offset in minutes
 
 
 def to_unicode(text, encoding='utf-8', errors='strict'):
@@ -55,11 +68,50 @@ def strip_newlines(text):
     return text.replace('\n', '').strip()
 
 
+def strip_kodi_markup(text):
+    """Strip the Kodi formatting from html_to_kodi() output, for other applications"""
+    return KODI_MARKUP_REGEX.sub('', text)
+
+
+def html_tag_to_kodi(tag):
+    """Convert a single HTML tag into Kodi formatted text"""
+    kodi_tag = HTML_TAGS.get(tag)
+    if kodi_tag is None:
+        kodi_tag = tag
+        for key, val in HTML_MAPPING:
+            kodi_tag = key.sub(val, kodi_tag)
+        if len(HTML_TAGS) >= HTML_TAGS_SIZE:
+            HTML_TAGS.clear()
+        HTML_TAGS[tag] = kodi_tag
+    return kodi_tag
+
+
 def html_to_kodi(text):
     """Convert VRT HTML content into Kodi formatted text"""
-    for key, val in HTML_MAPPING:
-        text = key.sub(val, text)
-    return unescape(text).strip()
+    kodi_text = HTML_CACHE.get(text)
+    if kodi_text is not None:
+        return kodi_text
+    kodi_text = text
+    if '<' in kodi_text:
+        if HTML_NESTED_TAG_REGEX.search(kodi_text):
+            for key, val in HTML_MAPPING:
+                kodi_text = key.sub(val, kodi_text)
+        else:
+            # Every mapping matches whole tags, so tags can be converted one by one in a single pass
+            parts = HTML_TAG_REGEX.split(kodi_text)
+            parts[1::2] = [html_tag_to_kodi(tag) for tag in parts[1::2]]
+            kodi_text = ''.join(parts)
+    # Removed tags may join <br> or &nbsp; with a newline, so these go last
+    if '<' in kodi_text or '&' in kodi_text:
+        for key, val in HTML_WHITESPACE_MAPPING:
+            kodi_text = key.sub(val, kodi_text)
+    if '&' in kodi_text:
+        kodi_text = unescape(kodi_text)
+    kodi_text = kodi_text.strip()
+    if len(HTML_CACHE) >= HTML_CACHE_SIZE:
+        HTML_CACHE.clear()
+    HTML_CACHE[text] = kodi_text
+    return kodi_text
 
 
 def reformat_url(url, url_type, domain='www.vrt.be'):
@@ -237,3 +289,57 @@ def youtube_to_plugin_url(url):
     if not url.endswith('/'):
         url += '/'
     return url
+
+
+def chunk_values(values, max_length, separator=','):
+    """Split a list of strings into chunks whose joined length does not exceed max_length"""
+    chunks = []
+    chunk = []
+    length = 0
+    for value in values:
+        if chunk and length + len(separator) + len(value) > max_length:
+            chunks.append(chunk)
+            chunk = []
+            length = 0
+        length += len(value) + (len(separator) if chunk else 0)
+        chunk.append(value)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def parse_iso8601(timestamp, memo=True):
+    """Parse an ISO 8601 timestamp as used by the VRT APIs (e.g. 2020-07-20T06:00:00.000+02:00) into a datetime
+        Anything else is handed to dateutil, like the returned timezones are dateutil timezones
+   """
+    if memo:
+        parsed = ISO8601_CACHE.get(timestamp)
+        if parsed is not None:
+            return parsed
+    match = ISO8601_REGEX.match(timestamp)
+    if match is None:
+        import dateutil.parser
+        parsed = dateutil.parser.parse(timestamp)
+    else:
+        from datetime import datetime
+        year, month, day, hour, minute, second, fraction, offset = match.groups()
+        tzinfo = None
+        if offset:
+            if offset == 'Z':
+                minutes = 0
+            else:
+                minutes = int(offset[1:3]) * 60 + int(offset[-2:] if len(offset) > 3 else 0)
+                if offset[0] == '-':
+                    minutes = -minutes
+            tzinfo = TZ_OFFSETS.get(minutes)
+            if tzinfo is None:
+                import dateutil.tz
+                tzinfo = dateutil.tz.UTC if minutes == 0 else dateutil.tz.tzoffset(None, minutes * 60)
+                TZ_OFFSETS[minutes] = tzinfo
+        parsed = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0),
+                          int(fraction.ljust(6, '0')) if fraction else 0, tzinfo)
+    if memo:
+        if len(ISO8601_CACHE) >= ISO8601_CACHE_SIZE:
+            ISO8601_CACHE.clear()
+        ISO8601_CACHE[timestamp] = parsed
+    return parsed
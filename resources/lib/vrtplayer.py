@@ -6,9 +6,9 @@ from __future__ import absolute_import, division, unicode_literals
 from apihelper import ApiHelper
 from favorites import Favorites
 from helperobjects import TitleItem
-from kodiutils import (colour, delete_cached_thumbnail, end_of_directory, get_addon_info,
-                       get_setting, get_setting_bool, get_setting_int, has_credentials,
-                       localize, log_error, ok_dialog, play, set_setting, show_listing,
+from kodiutils import (clear_property, colour, delete_cached_thumbnail, end_of_directory, get_addon_info,
+                       get_setting, get_setting_bool, get_setting_int, has_addon, has_credentials,
+                       localize, log, log_error, ok_dialog, play, set_property, set_setting, show_listing,
                        ttl, url_for, wait_for_resumepoints)
 from resumepoints import ResumePoints
 from utils import find_entry, realpage
@@ -357,6 +357,13 @@ class VRTPlayer:
 
     def play_upnext(self, video_id):
         """Play the next episode of a program by video_id"""
+        # Use the stream the service resolved ahead of time, if any
+        from streamservice import StreamService
+        prefetched = StreamService.get_prefetched_stream(video_id)
+        if prefetched:
+            stream, episode = prefetched
+            self.play(self._apihelper.episode_to_video(episode), stream=stream)
+            return
         video = self._apihelper.get_single_episode(video_id=video_id)
         if not video:
             log_error('Play Up Next with video_id {video_id} failed', video_id=video_id)
@@ -365,15 +372,43 @@ class VRTPlayer:
             return
         self.play(video)
 
-    @staticmethod
-    def play(video):
+    def play(self, video, stream=None):
         """A wrapper for playing video items"""
-        from tokenresolver import TokenResolver
-        from streamservice import StreamService
-        _tokenresolver = TokenResolver()
-        _streamservice = StreamService(_tokenresolver)
-        stream = _streamservice.get_stream(video)
+        # Never let the service push the Up Next data of a previous episode
+        clear_property('vrtnu_upnext')
+        if stream is None:
+            from tokenresolver import TokenResolver
+            from streamservice import StreamService
+            _tokenresolver = TokenResolver()
+            _streamservice = StreamService(_tokenresolver)
+            stream = _streamservice.get_stream(video)
         if stream is None:
             end_of_directory()
             return
+        # Prepare Up Next from the episode data we already have, without delaying playback
+        upnext = None
+        if video.get('episode') and has_addon('service.upnext') and get_setting_bool('useupnext', default=True):
+            from threading import Thread
+            # Set property to let the service wait for the Up Next data when playback starts
+            set_property('vrtnu_upnext', 'busy')
+            upnext = Thread(target=self.prepare_upnext, name='UpNextPrepare', args=(video.get('episode'),))
+            upnext.start()
         play(stream, video.get('listitem'))
+        if upnext:
+            upnext.join()
+
+    def prepare_upnext(self, episode):
+        """Precompute the Up Next payload of an episode, so the service only needs to push it"""
+        from json import dumps
+        next_info = None
+        try:
+            next_info = self._apihelper.get_upnext(dict(
+                program=episode.get('program'),
+                video_id=episode.get('videoId'),
+                program_url=episode.get('programUrl'),
+            ))
+        finally:
+            # Without next_info the service looks up the Up Next data itself
+            if next_info:
+                log(3, '[Up Next] Prepared next episode for {video_id}', video_id=episode.get('videoId'))
+            set_property('vrtnu_upnext', dumps(dict(video_id=episode.get('videoId'), next_info=next_info)))
@@ -5,68 +5,248 @@
 from __future__ import absolute_import, division, unicode_literals
 
 try:  # Python 3
+    from html.parser import HTMLParser
     from urllib.error import HTTPError
 except ImportError:  # Python 2
+    from HTMLParser import HTMLParser
     from urllib2 import HTTPError
 
-from kodiutils import get_cache, log_error, open_url, ttl, update_cache
+from kodiutils import (WEBSCRAPER_CACHE_DIR, delete_cache, get_cache, get_cache_store, get_setting_int, log, log_error, open_url,
+                       parallel_map, ttl, update_cache)
 from utils import assetpath_to_id
 
 
-def get_video_attributes(vrtnu_url):
-    """Return a dictionary with video attributes by scraping the VRT NU website"""
+_FAILED = dict()  # Per VRT NU url the time web scraping it failed, shared between invocations
+_MAX_WORKERS = 4  # Limit the number of concurrent page downloads, whatever the API concurrency
+_CACHE_ENTRIES = 1000  # Keep the video attributes of the most recently used pages
+_CACHE_SIZE = 5 * 1024 * 1024
+_LEGACY_CACHE_FILE = 'web_video_attrs_multi.json'
+_MIGRATED = dict(done=False)  # Whether the legacy cache file was migrated, shared between invocations
+_CHUNK_SIZE = 16 * 1024
 
-    # Get cache
-    cache_file = 'web_video_attrs_multi.json'
-    video_attrs_multi = get_cache(cache_file, ttl=ttl('indirect'))
-    if not video_attrs_multi:
-        video_attrs_multi = dict()
-    if vrtnu_url in video_attrs_multi:
-        return video_attrs_multi[vrtnu_url]
 
-    # Scrape video attributes
-    from bs4 import BeautifulSoup, SoupStrainer
+class VideoAttributesParser(HTMLParser):
+    """Incrementally extract the nui-media attributes of the video player or livestream blocks of a VRT NU web page"""
+
+    BLOCK_TAGS = ('section', 'div')
+    BLOCK_CLASSES = set(['video-player', 'livestream__inner'])
+
+    def __init__(self, epg_channel=None):
+        """Initialize the parser, looking for the livestream block of an EPG channel if given"""
+        HTMLParser.__init__(self)
+        self.epg_channel = epg_channel
+        self.video_attrs = None  # The nui-media attributes of the wanted block, or else of the last block
+        self.done = False
+        self._blocks = 0
+        self._block_tag = None
+        self._block_depth = 0
+        self._block_epg_channel = None
+        self._block_video_player = False
+        self._block_video_attrs = None
+
+    def handle_starttag(self, tag, attrs):
+        """Track video player and livestream blocks and their first nui-media element"""
+        if self.done:
+            return
+        if self._block_tag is None:
+            if tag not in self.BLOCK_TAGS:
+                return
+            attrs = dict((name, value or '') for name, value in attrs)
+            classes = attrs.get('class', '').split()
+            if not self.BLOCK_CLASSES.intersection(classes):
+                return
+            self._blocks += 1
+            # Without an EPG channel, a page listing multiple blocks is ambiguous
+            if not self.epg_channel and self._blocks > 1:
+                self.video_attrs = None
+                self.done = True
+                return
+            self._block_tag = tag
+            self._block_depth = 1
+            self._block_epg_channel = attrs.get('data-epgchannel')
+            self._block_video_player = 'video-player' in classes
+            self._block_video_attrs = None
+            return
+
+        if tag == self._block_tag:
+            self._block_depth += 1
+        elif tag == 'nui-media' and self._block_video_attrs is None:
+            self._block_video_attrs = dict((name, value or '') for name, value in attrs)
+            if self.epg_channel and self.epg_channel == self._block_epg_channel:
+                self.video_attrs = self._block_video_attrs
+                self.done = True
+            elif not self.epg_channel and self._block_video_player:
+                # Episode pages have a single video player, do not read further
+                self.video_attrs = self._block_video_attrs
+                self.done = True
+
+    def handle_endtag(self, tag):
+        """Close a video player or livestream block"""
+        if self.done or self._block_tag is None or tag != self._block_tag:
+            return
+        self._block_depth -= 1
+        if self._block_depth == 0:
+            self.end_block()
+
+    def end_block(self):
+        """End the current block, an EPG channel block without nui-media ends the search"""
+        self.video_attrs = self._block_video_attrs
+        if self.epg_channel and self.epg_channel == self._block_epg_channel:
+            self.done = True
+        self._block_tag = None
+
+    def close(self):
+        """Process any remaining data, and end an unterminated block"""
+        HTMLParser.close(self)
+        if not self.done and self._block_tag is not None:
+            self.end_block()
+
+
+def read_chunks(response, chunk_size=_CHUNK_SIZE, encoding=None):
+    """Generate the body of a response in chunks, decompressing a gzip or deflate encoded body while it is being read"""
+    import zlib
+    if encoding not in ('gzip', 'deflate'):
+        for chunk in iter(lambda: response.read(chunk_size), b''):
+            yield chunk
+        return
+    # Accept both gzip and zlib framing
+    decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+    started = False
+    for chunk in iter(lambda: response.read(chunk_size), b''):
+        try:
+            data = decompressor.decompress(chunk)
+        except zlib.error:
+            if started:
+                raise
+            # Some servers send raw deflate data
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = decompressor.decompress(chunk)
+        started = True
+        yield data
+    yield decompressor.flush()
+
+
+def extract_video_attributes(response, epg_channel=None, chunk_size=_CHUNK_SIZE, encoding=None):
+    """Return the nui-media attributes of a VRT NU web page, reading the response in chunks until they are found"""
+    from codecs import getincrementaldecoder
+    decoder = getincrementaldecoder('utf-8')(errors='replace')
+    parser = VideoAttributesParser(epg_channel=epg_channel)
+    for chunk in read_chunks(response, chunk_size=chunk_size, encoding=encoding):
+        parser.feed(decoder.decode(chunk))
+        if parser.done:
+            return parser.video_attrs
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    return parser.video_attrs
+
+
+def get_cache_file(vrtnu_url):
+    """Return the cache file holding the video attributes of a VRT NU web page"""
+    from hashlib import md5
+    return 'video_attrs.%s.json' % md5(vrtnu_url.encode('utf-8')).hexdigest()
+
+
+def get_cached_video_attributes(vrtnu_url):
+    """Return the cached video attributes of a VRT NU web page, if they are still fresh"""
+    return get_cache(get_cache_file(vrtnu_url), ttl=ttl('indirect'), cache_dir=WEBSCRAPER_CACHE_DIR)
+
+
+def cache_video_attributes(vrtnu_url, video_attrs):
+    """Cache the video attributes of a VRT NU web page"""
+    from json import dumps
+    update_cache(get_cache_file(vrtnu_url), dumps(video_attrs), cache_dir=WEBSCRAPER_CACHE_DIR)
+
+
+def migrate_cache():
+    """Move the video attributes from the former single cache file into separate cache entries"""
+    if _MIGRATED['done']:
+        return
+    _MIGRATED['done'] = True
+    video_attrs_multi = get_cache(_LEGACY_CACHE_FILE, ttl=ttl('indirect'))
+    if video_attrs_multi:
+        log(2, 'Migrating {count} scraped video attributes to separate cache entries', count=len(video_attrs_multi))
+        for vrtnu_url, video_attrs in video_attrs_multi.items():
+            cache_video_attributes(vrtnu_url, video_attrs)
+    delete_cache(_LEGACY_CACHE_FILE)
+
+
+def scrape_video_attributes(vrtnu_url):
+    """Return a dictionary with video attributes by scraping a VRT NU web page, without caching"""
+    import zlib
     try:
-        response = open_url(vrtnu_url, raise_errors='all')
+        # Decompress the web page while parsing it, so we can stop downloading once the video is found
+        response = open_url(vrtnu_url, raise_errors='all', decode=False)
     except HTTPError as exc:
         log_error('Web scraping video attributes failed: {error}', error=exc)
         return None
     if response is None:
         return None
-    html_page = response.read()
-    strainer = SoupStrainer(['section', 'div'], {'class': ['video-player', 'livestream__inner']})
-    soup = BeautifulSoup(html_page, 'html.parser', parse_only=strainer)
-    item = None
     epg_channel = None
     if '#epgchannel=' in vrtnu_url:
         epg_channel = vrtnu_url.split('#epgchannel=')[1]
-    for item in soup:
-        if epg_channel and epg_channel == item.get('data-epgchannel'):
-            break
-    if not epg_channel and len(soup) > 1:
-        return None
     try:
-        video_attrs = item.find(name='nui-media').attrs
-    except AttributeError as exc:
-        log_error('Web scraping video attributes failed: {error}', error=exc)
+        video_attrs = extract_video_attributes(response, epg_channel=epg_channel, encoding=response.info().get('Content-Encoding'))
+    except zlib.error as exc:
+        log_error('Web scraping video attributes failed: {error}\nurl: {url}', error=exc, url=vrtnu_url)
         return None
+    finally:
+        response.close()
+    if video_attrs is None:
+        log_error('Web scraping video attributes failed: no video found at {url}', url=vrtnu_url)
+    return video_attrs
+
+
+def get_video_attributes_multi(vrtnu_urls):
+    """Return a dictionary with video attributes per url, scraping the uncached VRT NU web pages concurrently"""
+    from time import time
+    migrate_cache()
+
+    # Get cache
+    video_attrs_multi = dict()
+    missing = []
+    for vrtnu_url in vrtnu_urls:
+        if vrtnu_url in video_attrs_multi or vrtnu_url in missing:
+            continue
+        video_attrs = get_cached_video_attributes(vrtnu_url)
+        if video_attrs is None:
+            missing.append(vrtnu_url)
+        else:
+            video_attrs_multi[vrtnu_url] = video_attrs
+
+    # Skip urls that failed recently
+    for vrtnu_url, failed in list(_FAILED.items()):
+        if time() - failed >= ttl('direct'):
+            del _FAILED[vrtnu_url]
+    missing = [vrtnu_url for vrtnu_url in missing if vrtnu_url not in _FAILED]
+    if not missing:
+        return video_attrs_multi
 
-    # Update cache
-    if vrtnu_url in video_attrs_multi:
-        # Update existing
+    # Scrape video attributes
+    max_workers = min(get_setting_int('httpconcurrency', default=4), _MAX_WORKERS)
+    for vrtnu_url, video_attrs in zip(missing, parallel_map(scrape_video_attributes, missing, max_workers=max_workers)):
+        if video_attrs is None:
+            _FAILED[vrtnu_url] = time()
+            continue
         video_attrs_multi[vrtnu_url] = video_attrs
-    else:
-        # Create new
-        video_attrs_multi.update({vrtnu_url: video_attrs})
-    from json import dumps
-    update_cache(cache_file, dumps(video_attrs_multi))
 
-    return video_attrs
+        # Update cache
+        cache_video_attributes(vrtnu_url, video_attrs)
+
+    # Evict the least recently used video attributes
+    get_cache_store(WEBSCRAPER_CACHE_DIR).prune(_CACHE_SIZE, _CACHE_ENTRIES)
+    return video_attrs_multi
+
+
+def get_video_attributes(vrtnu_url):
+    """Return a dictionary with video attributes by scraping the VRT NU website"""
+    return get_video_attributes_multi([vrtnu_url]).get(vrtnu_url)
 
 
 def get_asset_path(vrtnu_url):
     """Return an asset_path by scraping the VRT NU website"""
     video_attrs = get_video_attributes(vrtnu_url)
+    if not video_attrs:
+        return None
     asset_path = video_attrs.get('assetpath')
     return asset_path
 
@@ -75,3 +255,9 @@ def get_asset_id(vrtnu_url):
     """Return an asset_id by scraping the VRT NU website"""
     asset_id = assetpath_to_id(get_asset_path(vrtnu_url))
     return asset_id
+
+
+def get_asset_ids(vrtnu_urls):
+    """Return a dictionary with an asset_id per url by scraping the VRT NU website concurrently"""
+    video_attrs_multi = get_video_attributes_multi(vrtnu_urls)
+    return dict((vrtnu_url, assetpath_to_id(video_attrs.get('assetpath'))) for vrtnu_url, video_attrs in video_attrs_multi.items())
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Implementation of XMLTV class"""
+
+from __future__ import absolute_import, division, unicode_literals
+from xml.sax.saxutils import escape, quoteattr
+
+from data import CHANNELS
+from kodiutils import addon_id, addon_profile, get_setting, get_setting_int, log, log_error, parallel_map, translate_path
+from utils import parse_iso8601, strip_kodi_markup
+
+
+class XMLTV:
+    """Export the VRT NU TV guide as an XMLTV file"""
+
+    _FILENAME = 'vrtnu.xml'
+
+    def get_path(self):
+        """Return the path of the XMLTV file"""
+        import os
+        folder = get_setting('xmltv.folder') or addon_profile()
+        return os.path.join(translate_path(folder), self._FILENAME)
+
+    @staticmethod
+    def timestamp(date):
+        """Convert an ISO 8601 timestamp into an XMLTV timestamp (e.g. 20200720190000 +0200)"""
+        return parse_iso8601(date).strftime('%Y%m%d%H%M%S %z')
+
+    @staticmethod
+    def channel_element(channel):
+        """Return the XMLTV channel element of a channel"""
+        element = '  <channel id=%s>\n' % quoteattr(channel.get('epg_id'))
+        element += '    <display-name lang="nl">%s</display-name>\n' % escape(channel.get('label'))
+        if channel.get('logo'):
+            element += '    <icon src=%s/>\n' % quoteattr(channel.get('logo'))
+        return element + '  </channel>\n'
+
+    def programme_element(self, channel, programme):
+        """Return the XMLTV programme element of an EPG programme"""
+        element = '  <programme start=%s stop=%s channel=%s>\n' % (
+            quoteattr(self.timestamp(programme.get('start'))),
+            quoteattr(self.timestamp(programme.get('stop'))),
+            quoteattr(channel.get('epg_id')),
+        )
+        # XMLTV consumers do not understand Kodi formatting
+        element += '    <title lang="nl">%s</title>\n' % escape(strip_kodi_markup(programme.get('title') or ''))
+        if programme.get('subtitle'):
+            element += '    <sub-title lang="nl">%s</sub-title>\n' % escape(strip_kodi_markup(programme.get('subtitle')))
+        if programme.get('description'):
+            element += '    <desc lang="nl">%s</desc>\n' % escape(strip_kodi_markup(programme.get('description')))
+        if programme.get('image'):
+            element += '    <icon src=%s/>\n' % quoteattr(programme.get('image'))
+        return element + '  </programme>\n'
+
+    @staticmethod
+    def replace(source, target):
+        """Replace a file by another file, atomically where the platform allows it"""
+        import os
+        try:  # Python 3
+            os.replace(source, target)
+        except AttributeError:  # Python 2
+            if os.name == 'nt' and os.path.exists(target):
+                os.remove(target)
+            os.rename(source, target)
+
+    def write(self, days=None, path=None):
+        """Write the XMLTV file element by element to a temporary file, and replace the XMLTV file with it"""
+        import io
+        from datetime import datetime, timedelta
+        import dateutil.tz
+        from tvguide import TVGuide
+        if days is None:
+            days = get_setting_int('xmltv.days', default=1)
+        if path is None:
+            path = self.get_path()
+
+        today = TVGuide.parse('today', datetime.now(dateutil.tz.tzlocal()))
+        schedules = parallel_map(TVGuide.get_schedule, [today + timedelta(days=offset) for offset in range(-days, days + 1)])
+        schedules = [schedule for schedule in schedules if schedule]
+        if not schedules:
+            log_error('XMLTV export to {path} failed, no EPG schedules available', path=path)
+            return False
+
+        channels = [channel for channel in CHANNELS if channel.get('has_tvguide') and channel.get('epg_id')]
+        temp_path = path + '.tmp'
+        with io.open(temp_path, 'w', encoding='utf-8') as fdesc:
+            fdesc.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE tv SYSTEM "xmltv.dtd">\n')
+            fdesc.write('<tv generator-info-name=%s>\n' % quoteattr(addon_id()))
+            for channel in channels:
+                fdesc.write(self.channel_element(channel))
+            for channel in channels:
+                for programme in TVGuide.get_epg_programmes(schedules, channel.get('id')):
+                    fdesc.write(self.programme_element(channel, programme))
+            fdesc.write('</tv>\n')
+        self.replace(temp_path, path)
+        log(1, 'Exported XMLTV file to {path}', path=path)
+        return True
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Benchmark performance sensitive code paths, run with: make benchmark"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+from timeit import timeit
+
+
+def benchmark_episode_mapping():
+    """Benchmark mapping a 300-episode Search API page without asset paths, with and without an EpisodeRecord per episode"""
+    from favorites import Favorites
+    from kodiutils import WEBSCRAPER_CACHE_DIR, delete_cache
+    from metadata import EpisodeRecord, Metadata
+    from test_metadata import ActivatedResumePoints, search_episode
+    from webscraper import cache_video_attributes, get_cache_file
+    episodes = [search_episode(number) for number in range(1, 301)]
+
+    class UnmemoizedMetadata(Metadata):
+        """Metadata deriving every field again on every access, without memoization"""
+
+        def get_record(self, api_data):
+            """Always derive a new record"""
+            return EpisodeRecord(api_data)
+
+    def mapping(metadata):
+        """Map a page of episodes like ApiHelper.episode_to_listitem() does, except for the context menu"""
+        metadata.get_label(episodes[0])  # Warm up
+        for episode in episodes:
+            metadata.get_label(episode, 'reeksoplopend', return_sort=True)
+            metadata.get_playcount(episode)
+            metadata.get_info_labels(episode)
+            metadata.get_art(episode)
+            metadata.get_properties(episode)
+
+    try:
+        # Episodes without an assetPath fall back to the cached web scraper attributes
+        for episode in episodes:
+            cache_video_attributes('https:' + episode.get('url'), dict(assetpath=episode.pop('assetPath')))
+        number = 3
+        before = timeit(lambda: mapping(UnmemoizedMetadata(Favorites(), ActivatedResumePoints())), number=number) / number
+        after = timeit(lambda: mapping(Metadata(Favorites(), ActivatedResumePoints())), number=number) / number
+        print('Mapping 300 episodes: %.1f ms without, %.1f ms with EpisodeRecord' % (before * 1000, after * 1000))
+    finally:
+        for episode in episodes:
+            delete_cache(get_cache_file('https:' + episode.get('url')), cache_dir=WEBSCRAPER_CACHE_DIR)
+
+
+def benchmark_html_to_kodi():
+    """Benchmark converting 300 program descriptions in a single pass, with and without memoization"""
+    from test_utils import html_to_kodi_in_order
+    import utils
+    descriptions = ['<p>Aflevering %d van <b>Thuis</b>.<br>\nMet <i>Fien</i> &amp; Wout.</p>\n<p>&nbsp;</p>\n<p>&nbsp;</p>\n'
+                    '<ul><li>Regie: Jan</li><li>Scenario: Ann</li></ul>' % (number % 30) for number in range(300)]
+
+    def convert(function, memo=True):
+        """Convert all descriptions"""
+        if not memo:
+            utils.HTML_CACHE.clear()
+        for description in descriptions:
+            function(description)
+            if not memo:
+                utils.HTML_CACHE.clear()
+
+    number = 20
+    in_order = timeit(lambda: convert(html_to_kodi_in_order), number=number) / number
+    single_pass = timeit(lambda: convert(utils.html_to_kodi, memo=False), number=number) / number
+    memoized = timeit(lambda: convert(utils.html_to_kodi), number=number) / number
+    print('Converting 300 descriptions: %.2f ms in order, %.2f ms single pass, %.2f ms memoized' % (
+        in_order * 1000, single_pass * 1000, memoized * 1000))
+
+
+def benchmark_log_disabled():
+    """Benchmark the per-call overhead of log messages that are discarded"""
+    import kodiutils
+    xbmc = __import__('xbmc')
+    addon = __import__('xbmcaddon').Addon()
+    xbmc.settings['debug.showloginfo'] = False
+    addon.settings['max_log_level'] = '0'
+    number = 100000
+    try:
+        seconds = timeit(lambda: kodiutils.log(2, 'URL get: {url}', url=kodiutils.Lazy(str, 'https://www.vrt.be/vrtnu/')), number=number)
+    finally:
+        xbmc.settings['debug.showloginfo'] = True
+        addon.settings['max_log_level'] = '3'
+    print('Disabled log() overhead: %.3f µs per call' % (seconds * 1e6 / number))
+
+
+def benchmark_parse_iso8601():
+    """Benchmark parse_iso8601 against dateutil on a full day schedule"""
+    from datetime import datetime, timedelta
+    import dateutil.parser
+    import utils
+    day = datetime(2020, 7, 20, 6)
+    timestamps = []
+    for channel in range(10):
+        for minutes in range(0, 24 * 60, 30):
+            start = day + timedelta(minutes=minutes + channel)
+            end = start + timedelta(minutes=30)
+            timestamps += [start.strftime('%Y-%m-%dT%H:%M:%S.000+02:00'), end.strftime('%Y-%m-%dT%H:%M:%S.000+02:00')]
+    dateutil_time = timeit(lambda: [dateutil.parser.parse(timestamp) for timestamp in timestamps], number=3) / 3
+    fast_time = timeit(lambda: [utils.parse_iso8601(timestamp, memo=False) for timestamp in timestamps], number=3) / 3
+    utils.ISO8601_CACHE.clear()
+    memo_time = timeit(lambda: [utils.parse_iso8601(timestamp) for timestamp in timestamps], number=3) / 3
+    print('Parsing %d schedule timestamps: dateutil %.1f ms, parse_iso8601 %.1f ms, memoized %.1f ms'
+          % (len(timestamps), dateutil_time * 1000, fast_time * 1000, memo_time * 1000))
+
+
+def main():
+    """Run all benchmarks"""
+    for name, benchmark in sorted(globals().items()):
+        if name.startswith('benchmark_'):
+            benchmark()
+
+
+if __name__ == '__main__':
+    main()
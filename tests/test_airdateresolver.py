@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Unit tests for AirDateResolver functionality"""
+
+# pylint: disable=invalid-name
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+from datetime import date
+from time import time
+import unittest
+from airdateresolver import AirDateResolver
+from helperobjects import ScheduleIndex
+from utils import parse_iso8601
+
+xbmc = __import__('xbmc')
+xbmcaddon = __import__('xbmcaddon')
+xbmcgui = __import__('xbmcgui')
+xbmcplugin = __import__('xbmcplugin')
+xbmcvfs = __import__('xbmcvfs')
+
+
+class TestAirDateResolver(unittest.TestCase):
+    """TestCase class"""
+
+    _resolver = AirDateResolver()
+
+    def test_schedule_dates(self):
+        """Test selecting the schedules around the 06:00 day boundary"""
+        self.assertEqual(self._resolver.schedule_dates(parse_iso8601('2020-07-20T19:00:00+02:00'), parse_iso8601('2020-07-20T19:45:00+02:00')),
+                         [date(2020, 7, 20)])
+        self.assertEqual(self._resolver.schedule_dates(parse_iso8601('2020-07-21T05:30:00+02:00'), parse_iso8601('2020-07-21T06:30:00+02:00')),
+                         [date(2020, 7, 20), date(2020, 7, 21)])
+        self.assertEqual(self._resolver.schedule_dates(parse_iso8601('2020-07-21T07:00:00Z'), parse_iso8601('2020-07-21T08:00:00Z')),
+                         [date(2020, 7, 21)])
+
+    def test_resolve(self):
+        """Test resolving an air date across two schedules"""
+        episodes = [
+            dict(title='Nachtcinema', startTime='2020-07-21T04:30:00.000+02:00', endTime='2020-07-21T06:10:00.000+02:00', **{'vrt.whatson-id': '1'}),
+            dict(title='Ochtendjournaal', startTime='2020-07-21T06:10:00.000+02:00', endTime='2020-07-21T06:30:00.000+02:00', **{'vrt.whatson-id': '2'}),
+            dict(title='Buck', startTime='2020-07-21T06:30:00.000+02:00', endTime='2020-07-21T06:40:00.000+02:00', **{'vrt.whatson-id': '3'}),
+        ]
+        self._resolver._windows[('O8', date(2020, 7, 20), date(2020, 7, 21))] = (ScheduleIndex(episodes), time())  # pylint: disable=protected-access
+        episode = self._resolver.resolve('O8', parse_iso8601('2020-07-21T06:05:00+02:00'), parse_iso8601('2020-07-21T06:35:00+02:00'))
+        self.assertEqual(episode.get('vrt.whatson-id'), '2')
+        episode = self._resolver.resolve('O8', parse_iso8601('2020-07-21T06:29:00+02:00'))
+        self.assertEqual(episode.get('vrt.whatson-id'), '3')
+        # No overlap falls back to the closest middle of a broadcast
+        schedule_index = ScheduleIndex(episodes)
+        self.assertIsNone(schedule_index.overlapping(parse_iso8601('2020-07-21T06:45:00+02:00'), parse_iso8601('2020-07-21T07:00:00+02:00')))
+        self.assertEqual(schedule_index.overlapping(parse_iso8601('2020-07-21T04:00:00+02:00'), parse_iso8601('2020-07-21T06:20:00+02:00')), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -159,6 +159,32 @@ class TestApiHelper(unittest.TestCase):
         self.assertTrue(self._apihelper.valid_categories(local_categories))
         self.assertEqual(online_categories, local_categories)
 
+    def test_merge_episodes(self):
+        """Test merging chunked Search API results"""
+        episodes = [
+            dict(videoId='vid-1', assetOnTime='2020-07-20T10:00:00+02:00'),
+            dict(videoId='vid-2', assetOnTime='2020-07-21T10:00:00+02:00'),
+            dict(videoId='vid-1', assetOnTime='2020-07-20T10:00:00+02:00'),
+            dict(videoId='vid-3', assetOnTime='2020-03-21T10:00:00+01:00'),
+        ]
+        merged = self._apihelper.merge_episodes(episodes)
+        self.assertEqual([episode.get('videoId') for episode in merged], ['vid-2', 'vid-1', 'vid-3'])
+
+    def test_episode_index(self):
+        """Test looking up episodes and their next episode in an episode index"""
+        from helperobjects import EpisodeIndex
+        episodes = [
+            dict(videoId='vid-3', url='//www.vrt.be/vrtnu/a-z/buck/2/buck-s2a1/', seasonTitle='2', episodeNumber=1),
+            dict(videoId='vid-2', url='//www.vrt.be/vrtnu/a-z/buck/1/buck-s1a2/', seasonTitle='1', episodeNumber=2),
+            dict(videoId='vid-1', whatsonId='123', url='//www.vrt.be/vrtnu/a-z/buck/1/buck-s1a1/', seasonTitle='1', episodeNumber=1),
+        ]
+        episode_index = EpisodeIndex(episodes)
+        self.assertEqual(episode_index.get_episode(whatson_id='123').get('videoId'), 'vid-1')
+        self.assertEqual(episode_index.get_next_episode(video_id='vid-1').get('videoId'), 'vid-2')
+        self.assertEqual(episode_index.get_next_episode(video_url='//www.vrt.be/vrtnu/a-z/buck/1/buck-s1a2/').get('videoId'), 'vid-3')
+        self.assertIsNone(episode_index.get_next_episode(video_id='vid-3'))
+        self.assertIsNone(episode_index.get_episode(video_id='vid-4'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Unit tests for the HTTP cache storage backends"""
+
+# pylint: disable=invalid-name
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+from time import time
+import unittest
+import kodiutils
+from cachestore import FileCacheStore, SQLiteCacheStore
+
+
+class TestCacheStore(unittest.TestCase):
+    """TestCase class"""
+
+    cache_dir = 'test_cachestore'
+
+    def tearDown(self):
+        """Remove the test cache directory and database"""
+        import os
+        import shutil
+        shutil.rmtree(kodiutils.get_cache_dir(self.cache_dir), ignore_errors=True)
+        database = os.path.join(kodiutils.addon_profile(), self.cache_dir + '.db')
+        if os.path.exists(database):
+            os.remove(database)
+
+    def _test_store(self, store):
+        """Test the common cache store operations"""
+        store.put('programs.json', '[1, 2, 3]', validators=dict(ETag='"abc"'))
+        self.assertEqual(store.get('programs.json'), '[1, 2, 3]')
+        self.assertEqual(store.get('programs.json', ttl=60), '[1, 2, 3]')
+        self.assertEqual(store.get_validators('programs.json'), dict(ETag='"abc"'))
+
+        # Expired entries are only returned without a ttl
+        store.touch('programs.json', time() - 120)
+        self.assertIsNone(store.get('programs.json', ttl=60))
+        self.assertEqual(store.get('programs.json'), '[1, 2, 3]')
+        store.touch('programs.json')
+        self.assertEqual(store.get('programs.json', ttl=60), '[1, 2, 3]')
+
+        # Locally written data drops the validators
+        store.put('programs.json', '[1, 2]')
+        self.assertIsNone(store.get_validators('programs.json'))
+
+        for key in ('continue-1.json', 'continue-2.json', 'my-recent-1.json', 'recent-1.json'):
+            store.put(key, '{}')
+        store.invalidate('continue-*.json', 'my-recent-*.json')
+        self.assertIsNone(store.get('continue-1.json'))
+        self.assertIsNone(store.get('continue-2.json'))
+        self.assertIsNone(store.get('my-recent-1.json'))
+        self.assertEqual(store.get('recent-1.json'), '{}')
+
+        store.delete('recent-1.json')
+        self.assertIsNone(store.get('recent-1.json'))
+        self.assertIsNone(store.get_validators('recent-1.json'))
+
+    def test_sqlite_invalidate_tags(self):
+        """Test invalidating only the SQLite cache entries referencing a video"""
+        store = SQLiteCacheStore(self.cache_dir)
+        try:
+            store.put('recent-1.json', '{}', tags=['video:vid-1', 'program:de-afspraak'])
+            store.put('programs.json', '[]', tags=['program:de-afspraak', 'program:het-journaal'])
+            store.put('schedule.today.json', '{}', tags=['video:vid-2'])
+            store.invalidate_tags('video:vid-1')
+            self.assertIsNone(store.get('recent-1.json'))
+            self.assertEqual(store.get('programs.json'), '[]')
+            store.invalidate_tags('program:de-afspraak')
+            self.assertIsNone(store.get('programs.json'))
+            self.assertEqual(store.get('schedule.today.json'), '{}')
+        finally:
+            store.close()
+
+    def test_sqlite_compress(self):
+        """Test storing gzip compressed SQLite cache entries"""
+        store = SQLiteCacheStore(self.cache_dir)
+        try:
+            store.put('programs.json', '[{"title": "Het journaal"}]', compress=True)
+            data = store.get('programs.json')
+            self.assertEqual(data[:2], b'\x1f\x8b')
+            self.assertEqual(kodiutils.get_json_string(data), [dict(title='Het journaal')])
+        finally:
+            store.close()
+
+    def test_cache_tags(self):
+        """Test extracting videos and programs from API data"""
+        search_json = dict(results=[dict(videoId='vid-1', programUrl='//www.vrt.be/vrtnu/a-z/de-afspraak/')])
+        self.assertEqual(kodiutils.cache_tags(search_json), {'video:vid-1', 'program:de-afspraak'})
+        suggest_json = [dict(programUrl='//www.vrt.be/vrtnu/a-z/het-journaal/', title='Het journaal')]
+        self.assertEqual(kodiutils.cache_tags(suggest_json), {'program:het-journaal'})
+        schedule_json = {'O8': [dict(url='//www.vrt.be/vrtnu/a-z/het-journaal/2020/het-journaal-d20200720/')], 'date': '2020-07-20'}
+        self.assertEqual(kodiutils.cache_tags(schedule_json), {'program:het-journaal'})
+
+    def test_file_store_prune(self):
+        """Test evicting the least recently used cache files"""
+        import os
+        store = FileCacheStore(self.cache_dir)
+        for index in range(5):
+            store.put('recent-%d.json' % index, '[%d]' % index)
+            path = kodiutils.get_cache_path('recent-%d.json' % index, self.cache_dir)
+            os.utime(path, (time() - 7200 + index, time() - 7200))
+        self._test_prune_order(store)
+
+    def test_sqlite_store_prune(self):
+        """Test evicting the least recently used SQLite cache entries"""
+        store = SQLiteCacheStore(self.cache_dir)
+        try:
+            for index in range(5):
+                store.put('recent-%d.json' % index, '[%d]' % index)
+            self._test_prune_order(store)
+        finally:
+            store.close()
+
+    def _test_prune_order(self, store):
+        """Test evicting cache entries in order of access"""
+        self.assertEqual(store.prune(1024, 10), (0, 0))
+        self.assertEqual(store.prune(1024, 3), (2, 6))
+        self.assertIsNone(store.get('recent-0.json'))
+        self.assertIsNone(store.get('recent-1.json'))
+        self.assertEqual(store.prune(3, 10), (2, 6))
+        self.assertEqual(store.get('recent-4.json'), '[4]')
+
+    def test_file_store(self):
+        """Test the file cache store"""
+        self._test_store(FileCacheStore(self.cache_dir))
+
+    def test_sqlite_store(self):
+        """Test the SQLite cache store"""
+        store = SQLiteCacheStore(self.cache_dir)
+        try:
+            self._test_store(store)
+        finally:
+            store.close()
+
+    def test_migration(self):
+        """Test migrating cache files into the SQLite cache store"""
+        files = FileCacheStore(self.cache_dir)
+        files.put('programs.json', '[1, 2, 3]', validators=dict(ETag='"abc"'))
+        files.put('oneoff.json', '[]')
+        files.touch('oneoff.json', time() - 120)
+
+        store = SQLiteCacheStore(self.cache_dir)
+        try:
+            self.assertEqual(store.get('programs.json'), '[1, 2, 3]')
+            self.assertEqual(store.get_validators('programs.json'), dict(ETag='"abc"'))
+            self.assertEqual(store.get('oneoff.json'), '[]')
+            self.assertIsNone(store.get('oneoff.json', ttl=60))
+            _, remaining = kodiutils.listdir(kodiutils.get_cache_dir(self.cache_dir))
+            self.assertEqual(remaining, [])
+        finally:
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
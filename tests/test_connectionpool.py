@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Unit tests for the persistent HTTP connection pool"""
+
+# pylint: disable=invalid-name
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+from threading import Thread
+import unittest
+import kodiutils
+from connectionpool import POOL
+
+try:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class KeepAliveRequestHandler(BaseHTTPRequestHandler):
+    """A minimal HTTP/1.1 request handler that keeps connections open"""
+    protocol_version = 'HTTP/1.1'
+    not_modified = 0
+    posts = 0
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Return a small JSON document, or 304 Not Modified when revalidated"""
+        etag = '"%s"' % self.path
+        if self.headers.get('If-None-Match') == etag:
+            KeepAliveRequestHandler.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'{"path": "%s"}' % self.path.encode()
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/json')
+        if self.path == '/corrupt':
+            self.send_header('Content-Encoding', 'gzip')
+        elif 'gzip' in self.headers.get('Accept-Encoding', ''):
+            from cachestore import compress_data
+            body = compress_data(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Close the connection without telling the client, like servers do with idle connections
+        if self.path == '/close':
+            self.close_connection = True
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Count the posted requests"""
+        KeepAliveRequestHandler.posts += 1
+        self.rfile.read(int(self.headers.get('Content-Length')))
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keep the test output clean"""
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """A threading HTTP server"""
+    daemon_threads = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    """TestCase class"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start a local HTTP server"""
+        cls._server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+        cls._url = 'http://127.0.0.1:%d' % cls._server.server_address[1]
+        cls._thread = Thread(target=cls._server.serve_forever)
+        cls._thread.daemon = True
+        cls._thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the local HTTP server"""
+        POOL.clear()
+        cls._server.shutdown()
+        cls._server.server_close()
+
+    def test_reuse_connection(self):
+        """Test that consecutive requests to the same host reuse a single connection"""
+        POOL.clear()
+        before = kodiutils.get_connection_pool_stats()
+        for page in range(5):
+            json_data = kodiutils.get_url_json('%s/page/%d' % (self._url, page))
+            self.assertEqual(json_data, dict(path='/page/%d' % page))
+        after = kodiutils.get_connection_pool_stats()
+        self.assertEqual(after.get('opened') - before.get('opened'), 1)
+        self.assertEqual(after.get('reused') - before.get('reused'), 4)
+        self.assertEqual(after.get('pooled'), 1)
+
+    def test_cached_opener(self):
+        """Test that openers are reused for the same configuration"""
+        self.assertIs(kodiutils.get_opener(), kodiutils.get_opener())
+        self.assertIsNot(kodiutils.get_opener(), kodiutils.get_opener(follow_redirects=False))
+
+    def test_stale_connection(self):
+        """Test that a connection closed by the server is transparently replaced"""
+        POOL.clear()
+        kodiutils.get_url_json(self._url + '/first')
+        # Close the pooled sockets behind the pool's back
+        for entries in getattr(POOL, '_connections').values():
+            for connection, _, _ in entries:
+                connection.sock.close()
+        json_data = kodiutils.get_url_json(self._url + '/second')
+        self.assertEqual(json_data, dict(path='/second'))
+
+    def test_closed_connection(self):
+        """Test that only idempotent requests are retried when the server closed a pooled connection"""
+        from time import sleep
+        POOL.clear()
+        kodiutils.get_url_json(self._url + '/close')
+        sleep(0.1)
+        stale = kodiutils.get_connection_pool_stats().get('stale')
+        json_data = kodiutils.get_url_json(self._url + '/second')
+        self.assertEqual(json_data, dict(path='/second'))
+        self.assertEqual(kodiutils.get_connection_pool_stats().get('stale'), stale + 1)
+
+        kodiutils.get_url_json(self._url + '/close')
+        sleep(0.1)
+        posts = KeepAliveRequestHandler.posts
+        self.assertIsNone(kodiutils.open_url(self._url + '/post', data=b'{}'))
+        self.assertEqual(KeepAliveRequestHandler.posts, posts)
+        self.assertIsNotNone(kodiutils.open_url(self._url + '/post', data=b'{}'))
+        self.assertEqual(KeepAliveRequestHandler.posts, posts + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
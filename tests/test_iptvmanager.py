@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Unit tests for IPTV Manager functionality"""
+
+# pylint: disable=invalid-name
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import socket
+from threading import Thread
+import unittest
+from helperobjects import EncodedJSON
+from iptvmanager import IPTVManager, iterencode
+
+xbmc = __import__('xbmc')
+xbmcaddon = __import__('xbmcaddon')
+xbmcgui = __import__('xbmcgui')
+xbmcplugin = __import__('xbmcplugin')
+xbmcvfs = __import__('xbmcvfs')
+
+
+class TestIPTVManager(unittest.TestCase):
+    """TestCase class"""
+
+    def test_iterencode(self):
+        """Test encoding nested generators incrementally"""
+        def programmes(channel):
+            """Generate programmes of a channel"""
+            for number in range(3):
+                yield dict(title='%s %d' % (channel, number), stream=None)
+
+        data = dict(version=1, epg=dict((channel, programmes(channel)) for channel in ('een.be', 'canvas.be')))
+        expected = json.loads(json.dumps(dict(version=1, epg=dict(
+            (channel, [dict(title='%s %d' % (channel, number), stream=None) for number in range(3)]) for channel in ('een.be', 'canvas.be')
+        ))))
+        self.assertEqual(json.loads(''.join(iterencode(data))), expected)
+        self.assertEqual(json.loads(''.join(iterencode(dict(empty=(item for item in []), title='Eén')))), dict(empty=[], title='Eén'))
+        # Cached fragments of encoded items are streamed as they are
+        encoded = EncodedJSON(['{"title": "een.be 0"}, {"title": "een.be 1"}', '{"title": "een.be 2"}'])
+        self.assertEqual(json.loads(''.join(iterencode(dict(epg=encoded, empty=EncodedJSON([]))))),
+                         dict(epg=[dict(title='een.be %d' % number) for number in range(3)], empty=[]))
+
+    def test_send_channels(self):
+        """Test sending channels over a socket"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        received = []
+
+        def receive():
+            """Receive all data from a single connection"""
+            conn, _ = server.accept()
+            data = b''
+            while True:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            conn.close()
+            received.append(data)
+
+        thread = Thread(target=receive)
+        thread.start()
+        try:
+            IPTVManager(server.getsockname()[1]).send_channels()
+            thread.join()
+        finally:
+            server.close()
+        channels = json.loads(received[0].decode())
+        self.assertEqual(channels.get('version'), 1)
+        self.assertTrue(channels.get('streams'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -59,6 +59,51 @@ class TestKodiUtils(unittest.TestCase):
         kodiutils.log(3, 'Logging as debug')
         kodiutils.log_error('Logging as error')
 
+    def test_lazy_logging(self):
+        """Test that Lazy log arguments are only evaluated when the message is emitted"""
+        calls = []
+        xbmc.settings['debug.showloginfo'] = False
+        addon.settings['max_log_level'] = '1'
+        kodiutils.log(2, 'Not logged: {value}', value=kodiutils.Lazy(calls.append, 2))
+        self.assertEqual(calls, [])
+        kodiutils.log(1, 'Logged: {value}', value=kodiutils.Lazy(calls.append, 1))
+        self.assertEqual(calls, [1])
+        # Other callables are logged as they are
+        kodiutils.log(1, 'Logged: {value}', value=calls.append)
+        self.assertEqual(calls, [1])
+
+    def test_parallel_map(self):
+        """Test calling a function concurrently while keeping the results in order"""
+        from time import sleep
+
+        def fetch(page):
+            """Return pages in reverse order of completion, and fail on one page"""
+            sleep(0.01 * (5 - page))
+            if page == 2:
+                raise ValueError('Page not available')
+            return dict(page=page)
+
+        results = kodiutils.parallel_map(fetch, range(5), max_workers=3)
+        self.assertEqual(results, [dict(page=0), dict(page=1), None, dict(page=3), dict(page=4)])
+        self.assertEqual(kodiutils.parallel_map(fetch, [3], max_workers=1), [dict(page=3)])
+
+    def test_parallel_imap(self):
+        """Test generating the results of concurrent calls in order, as soon as they are available"""
+        from threading import Event
+        first_used = Event()
+
+        def fetch(page):
+            """Only finish the second page once the first page was used"""
+            if page == 1:
+                first_used.wait(timeout=5)
+                return dict(page=page, waited=first_used.is_set())
+            return dict(page=page)
+
+        results = kodiutils.parallel_imap(fetch, range(2), max_workers=2)
+        self.assertEqual(next(results), dict(page=0))
+        first_used.set()
+        self.assertEqual(list(results), [dict(page=1, waited=True)])
+
     @staticmethod
     def test_input_down():
         """Test pressing down key"""
@@ -94,6 +139,115 @@ class TestKodiUtils(unittest.TestCase):
         self.assertTrue(isinstance(ret, list))
         self.assertEqual(len(ret), 2)
 
+    def test_settings_snapshot(self):
+        """Test reading settings from the settings snapshot"""
+        addon.settings['colour_theme'] = 'dark'
+        self.assertEqual(kodiutils.get_setting('colour_theme'), 'dark')
+        # Bypass the test stub's automatic invalidation
+        dict.__setitem__(addon.settings, 'colour_theme', 'light')
+        self.assertEqual(kodiutils.get_setting('colour_theme'), 'dark')
+        kodiutils.invalidate_settings()
+        self.assertEqual(kodiutils.get_setting('colour_theme'), 'light')
+        kodiutils.set_setting('colour_theme', 'custom')
+        self.assertEqual(kodiutils.get_setting('colour_theme'), 'custom')
+
+    def test_conditional_get(self):
+        """Test revalidating an expired cache file using its ETag"""
+        from threading import Thread
+        from test_connectionpool import KeepAliveRequestHandler, ThreadingHTTPServer
+        server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://127.0.0.1:%d/conditional' % server.server_address[1]
+        cache_file = 'test_conditional_get.json'
+        try:
+            kodiutils.delete_cache(cache_file)
+            json_data = kodiutils.get_cached_url_json(url, cache=cache_file, ttl=30)
+            self.assertEqual(json_data, dict(path='/conditional'))
+            store = kodiutils.get_cache_store()
+            self.assertEqual(store.get_validators(cache_file), dict(ETag='"/conditional"'))
+
+            # Expire the cache file
+            from time import time
+            store.touch(cache_file, time() - 60)
+            not_modified = KeepAliveRequestHandler.not_modified
+            json_data = kodiutils.get_cached_url_json(url, cache=cache_file, ttl=30)
+            self.assertEqual(json_data, dict(path='/conditional'))
+            self.assertEqual(KeepAliveRequestHandler.not_modified, not_modified + 1)
+
+            # Locally modified data must not be revalidated
+            kodiutils.update_cache(cache_file, '{"path": "/local"}')
+            self.assertIsNone(store.get_validators(cache_file))
+        finally:
+            kodiutils.delete_cache(cache_file)
+            server.shutdown()
+            server.server_close()
+
+    def test_gzip_encoding(self):
+        """Test negotiating and decoding gzip compressed responses"""
+        from threading import Thread
+        import zlib
+        from test_connectionpool import KeepAliveRequestHandler, ThreadingHTTPServer
+        server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%d/gzip' % server.server_address[1]
+            response = kodiutils.open_url(url)
+            self.assertEqual(response.info().get('Content-Encoding'), 'gzip')
+            self.assertEqual(kodiutils.get_json_data(response), dict(path='/gzip'))
+            # Requests explicitly asking for an identity encoding are left alone
+            response = kodiutils.open_url(url, headers={'Accept-Encoding': 'identity'})
+            self.assertIsNone(response.info().get('Content-Encoding'))
+            self.assertEqual(kodiutils.get_json_data(response), dict(path='/gzip'))
+            # Responses that fail to decode are errors
+            url = 'http://127.0.0.1:%d/corrupt' % server.server_address[1]
+            self.assertIsNone(kodiutils.open_url(url))
+            self.assertRaises(zlib.error, kodiutils.open_url, url, raise_errors='all')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_stale_while_revalidate(self):
+        """Test serving an expired cache file while refreshing it in the background"""
+        from threading import Thread
+        from time import time
+        from test_connectionpool import KeepAliveRequestHandler, ThreadingHTTPServer
+        server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://127.0.0.1:%d/stale' % server.server_address[1]
+        cache_file = 'schedule.test.json'
+        store = kodiutils.get_cache_store()
+        addon.settings.update(httpcachestale='true', httpcachestaleschedule='true', httpcachemaxstale='24')
+        try:
+            kodiutils.update_cache(cache_file, '{"path": "/expired"}')
+            store.touch(cache_file, time() - 120)
+            self.assertTrue(kodiutils.can_serve_stale(cache_file))
+            self.assertFalse(kodiutils.can_serve_stale('web_video_attrs_multi.json'))
+            json_data = kodiutils.get_cached_url_json(url, cache=cache_file, ttl=60)
+            self.assertEqual(json_data, dict(path='/expired'))
+
+            kodiutils.refresh_stale_cache(url, cache_file, 60)
+            json_data = kodiutils.get_cached_url_json(url, cache=cache_file, ttl=60)
+            self.assertEqual(json_data, dict(path='/stale'))
+
+            # Beyond the maximum staleness we fetch synchronously
+            addon.settings['httpcachemaxstale'] = '1'
+            kodiutils.update_cache(cache_file, '{"path": "/expired"}')
+            store.touch(cache_file, time() - 7200)
+            json_data = kodiutils.get_cached_url_json(url, cache=cache_file, ttl=60)
+            self.assertEqual(json_data, dict(path='/stale'))
+        finally:
+            for key in ('httpcachestale', 'httpcachestaleschedule', 'httpcachemaxstale'):
+                addon.settings.pop(key, None)
+            kodiutils.delete_cache(cache_file)
+            server.shutdown()
+            server.server_close()
+
 
 if __name__ == '__main__':
     unittest.main()
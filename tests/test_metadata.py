@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Unit tests for Metadata functionality"""
+
+# pylint: disable=invalid-name
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import unittest
+from favorites import Favorites
+from kodiutils import WEBSCRAPER_CACHE_DIR, delete_cache
+from metadata import Metadata
+from resumepoints import ResumePoints
+from webscraper import cache_video_attributes, get_cache_file
+
+xbmc = __import__('xbmc')
+xbmcaddon = __import__('xbmcaddon')
+xbmcgui = __import__('xbmcgui')
+xbmcplugin = __import__('xbmcplugin')
+xbmcvfs = __import__('xbmcvfs')
+
+
+class ActivatedResumePoints(ResumePoints):
+    """Resumepoints that are activated, without any resumepoints stored"""
+
+    @staticmethod
+    def is_activated():
+        """Pretend to have credentials"""
+        return True
+
+    def get_position(self, asset_id):
+        """No resumepoints"""
+        return 0
+
+    def get_total(self, asset_id):
+        """No resumepoints"""
+        return 0
+
+
+def search_episode(number):
+    """Return a VRT NU Search API episode"""
+    return dict(
+        type='episode',
+        program='Thuis',
+        programType='series',
+        title='Aflevering %d' % number,
+        subtitle='Aflevering %d' % number,
+        description='<p>Het leven in <b>Thuis</b> gaat verder.</p>',
+        seasonTitle='26',
+        seasonName='26',
+        episodeNumber=number,
+        assetPath='/content/dam/vrt/2020/07/20/thuis-s26a%d-depot_WP00%d' % (number, number),
+        assetOnTime='2020-07-20T18:00:00.000+02:00',
+        assetOffTime='2021-07-20T18:00:00.000+02:00',
+        broadcastDate=1595260800000,
+        duration=25,
+        categories=[],
+        displayOptions=dict(showEpisodeTitle=True, showEpisodeNumber=True),
+        url='//www.vrt.be/vrtnu/a-z/thuis/26/thuis-s26a%d/' % number,
+        videoThumbnailUrl='//images.vrt.be/thuis.jpg',
+    )
+
+
+class TestMetadata(unittest.TestCase):
+    """TestCase class"""
+
+    _metadata = Metadata(Favorites(), ActivatedResumePoints())
+
+    def test_episode_record(self):
+        """Test deriving metadata fields of Search API and Schedule API data"""
+        episode = search_episode(12)
+        self.assertEqual(self._metadata.get_season(episode), 26)
+        self.assertEqual(self._metadata.get_episode(episode), 12)
+        self.assertEqual(self._metadata.get_year(episode), 0)
+        self.assertEqual(self._metadata.get_aired(episode), '2020-07-20')
+        self.assertEqual(self._metadata.get_dateadded(episode), '2020-07-20 18:00:00')
+        self.assertEqual(self._metadata.get_duration(episode), 1500)
+        self.assertEqual(self._metadata.get_asset_id(episode), 'contentdamvrt20200720thuiss26a12depotwp0012')
+        self.assertIs(self._metadata.get_record(episode), self._metadata.get_record(episode))
+        self.assertEqual(self._metadata.get_title(episode), 'Aflevering 12')
+        self.assertEqual(self._metadata.get_title(dict(episode, title='', shortDescription='')), '')
+        self.assertEqual(self._metadata.get_title(dict(episode, title='')), '???')
+
+        movie = dict(search_episode(1), programType='oneoff', seasonTitle='2019')
+        self.assertEqual(self._metadata.get_year(movie), 2019)
+        self.assertEqual(self._metadata.get_season(movie), '')
+        self.assertEqual(self._metadata.get_mediatype(movie), 'movie')
+
+        schedule_entry = {'vrt.whatson-id': '123', 'startTime': '2020-07-20T23:30:00.000+02:00', 'endTime': '2020-07-21T00:15:00.000+02:00'}
+        self.assertEqual(self._metadata.get_aired(schedule_entry), '2020-07-20')
+        self.assertEqual(self._metadata.get_duration(schedule_entry), 2700)
+
+    def test_resolve_asset_ids(self):
+        """Test looking up the asset_ids of episodes without an assetPath at once"""
+        metadata = Metadata(Favorites(), ActivatedResumePoints())
+        episodes = [search_episode(number) for number in range(1, 4)]
+        try:
+            for episode in episodes:
+                cache_video_attributes('https:' + episode.get('url'), dict(assetpath=episode.pop('assetPath')))
+            self.assertIsNone(metadata.get_asset_id(episodes[0], scrape=False))
+            metadata.resolve_asset_ids(episodes)
+        finally:
+            for episode in episodes:
+                delete_cache(get_cache_file('https:' + episode.get('url')), cache_dir=WEBSCRAPER_CACHE_DIR)
+        # The asset_ids are filled in without looking them up again
+        self.assertEqual([metadata.get_asset_id(episode, scrape=False) for episode in episodes],
+                         ['contentdamvrt20200720thuiss26a%ddepotwp00%d' % (number, number) for number in range(1, 4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,6 +35,24 @@ class TestRouting(unittest.TestCase):
         addon.run(['plugin://plugin.video.vrt.nu/noop', '0', ''])
         self.assertEqual(plugin.url_for(addon.noop), 'plugin://plugin.video.vrt.nu/noop')
 
+    def test_connection_pool_stats(self):
+        """Connection pool statistics are logged after each route"""
+        from kodiutils import reset_log_level
+        messages = []
+        xbmc_log = xbmc.log
+        xbmc.log = lambda msg, level=0: messages.append(msg)
+        xbmc.settings['debug.showloginfo'] = True
+        reset_log_level()
+        try:
+            addon.run(['plugin://plugin.video.vrt.nu/noop', '0', ''])
+        finally:
+            xbmc.log = xbmc_log
+        stats = [message for message in messages if 'Connection pool: ' in message]
+        self.assertEqual(len(stats), 1)
+        self.assertNotIn('<function', stats[0])
+        self.assertIn('requests', stats[0])
+        self.assertIn('pooled', stats[0])
+
     def test_favorites(self):
         """Favorites menu: /favorites"""
         addon.run(['plugin://plugin.video.vrt.nu/favorites', '0', ''])
@@ -20,6 +20,8 @@ xbmcgui = __import__('xbmcgui')
 xbmcplugin = __import__('xbmcplugin')
 xbmcvfs = __import__('xbmcvfs')
 
+addon = xbmcaddon.Addon()
+
 channels = ['een', 'canvas', 'ketnet']
 
 
@@ -84,6 +86,95 @@ class TestTVGuide(unittest.TestCase):
         episode_items = self._tvguide.get_episode_items('tomorrow', 'ketnet')
         self.assertTrue(episode_items)
 
+    def test_schedule_index(self):
+        """Test looking up airing, upcoming and nearest episodes in a schedule index"""
+        from helperobjects import ScheduleIndex
+        from utils import parse_iso8601
+        episodes = [
+            dict(title='Journaal', startTime='2020-07-20T19:00:00.000+02:00', endTime='2020-07-20T19:45:00.000+02:00'),
+            dict(title='Thuis', startTime='2020-07-20T20:10:00.000+02:00', endTime='2020-07-20T20:40:00.000+02:00'),
+            dict(title='Dagelijkse kost', startTime='2020-07-20T19:45:00.000+02:00', endTime='2020-07-20T20:00:00.000+02:00'),
+            dict(title='Het weer', startTime='2020-07-20T19:55:00.000+02:00'),
+        ]
+        schedule_index = ScheduleIndex(episodes)
+        self.assertEqual([episode.get('title') for episode in schedule_index.episodes], ['Journaal', 'Dagelijkse kost', 'Thuis'])
+        self.assertEqual([episode.get('title') for episode in schedule_index.untimed], ['Het weer'])
+        self.assertEqual(schedule_index.playing(parse_iso8601('2020-07-20T17:50:00Z')), 1)
+        self.assertIsNone(schedule_index.playing(parse_iso8601('2020-07-20T18:05:00Z')))
+        self.assertEqual(schedule_index.upcoming(parse_iso8601('2020-07-20T18:05:00Z')), 2)
+        self.assertIsNone(schedule_index.upcoming(parse_iso8601('2020-07-20T20:15:00+02:00')))
+        self.assertEqual(schedule_index.nearest_start(parse_iso8601('2020-07-20T19:50:00+02:00')), 1)
+        self.assertEqual(schedule_index.nearest_midpoint(parse_iso8601('2020-07-20T20:20:00+02:00')), 2)
+        self.assertIsNone(ScheduleIndex([]).nearest_start(parse_iso8601('2020-07-20T20:20:00+02:00')))
+
+    def test_untimed_episode_items(self):
+        """Test listing the episodes without a start or end time after the scheduled ones"""
+        import json
+        from kodiutils import delete_cache, update_cache
+        date = TVGuide.parse('today', datetime.now(dateutil.tz.tzlocal())).strftime('%Y-%m-%d')
+        schedule = {
+            'O8': [
+                {'title': 'Het weer', 'vrt.whatson-id': '1', 'start': '19:45', 'startTime': date + 'T19:45:00.000+02:00'},
+                {'title': 'Journaal', 'vrt.whatson-id': '2', 'start': '19:00', 'startTime': date + 'T19:00:00.000+02:00',
+                 'endTime': date + 'T19:45:00.000+02:00'},
+            ],
+        }
+        try:
+            update_cache('schedule.today.json', json.dumps(schedule))
+            episode_items = TVGuide().get_episode_items('today', 'een')
+            self.assertEqual(len(episode_items), 2)
+            self.assertIn('Journaal', episode_items[0].label)
+            self.assertIn('Het weer', episode_items[1].label)
+        finally:
+            delete_cache('schedule.today.json')
+
+    def test_epg_day_delta(self):
+        """Test reusing the encoded EPG programmes of channels whose schedule did not change"""
+        import json
+        from kodiutils import delete_cache, get_cache, update_cache
+        epg = datetime(2020, 7, 20)
+        schedule = {
+            'O8': [dict(title='Journaal', startTime='2020-07-20T19:00:00.000+02:00', endTime='2020-07-20T19:45:00.000+02:00')],
+            '1H': [dict(title='Terzake', startTime='2020-07-20T20:00:00.000+02:00', endTime='2020-07-20T20:30:00.000+02:00')],
+        }
+        try:
+            update_cache('schedule.2020-07-20.json', json.dumps(schedule))
+            epg_day = self._tvguide.get_epg_day(epg)
+            self.assertEqual(json.loads('[%s]' % epg_day.get('O8'))[0].get('title'), 'Journaal')
+
+            # Mark the stored encoded programmes to detect their reuse
+            previous = get_cache('iptv.epg.2020-07-20.json')
+            for entry in previous.get('channels').values():
+                entry['programmes'] = '"reused"'
+            update_cache('iptv.epg.2020-07-20.json', json.dumps(previous))
+            schedule['1H'][0]['title'] = 'De afspraak'
+            update_cache('schedule.2020-07-20.json', json.dumps(schedule))
+            epg_day = self._tvguide.get_epg_day(epg)
+            self.assertEqual(epg_day.get('O8'), '"reused"')
+            self.assertEqual(json.loads('[%s]' % epg_day.get('1H'))[0].get('title'), 'De afspraak')
+        finally:
+            delete_cache('schedule.2020-07-20.json')
+            delete_cache('iptv.epg.2020-07-20.json')
+
+    def test_epg_data(self):
+        """Test generating the JSONTV encoded EPG data of every channel"""
+        import json
+        from helperobjects import JSONObjectItems
+        from iptvmanager import iterencode
+        from kodiutils import delete_cache, update_cache
+        date = TVGuide.parse('today', datetime.now(dateutil.tz.tzlocal())).strftime('%Y-%m-%d')
+        schedule = {
+            'O8': [dict(title='Journaal', startTime='2020-07-20T19:00:00.000+02:00', endTime='2020-07-20T19:45:00.000+02:00')],
+        }
+        try:
+            update_cache('schedule.{date}.json'.format(date=date), json.dumps(schedule))
+            epg_data = json.loads(''.join(iterencode(JSONObjectItems(self._tvguide.get_epg_data(days=0)))))
+            self.assertEqual([programme.get('title') for programme in epg_data.get('een.be')], ['Journaal'])
+            self.assertEqual(epg_data.get('canvas.be'), [])
+        finally:
+            delete_cache('schedule.{date}.json'.format(date=date))
+            delete_cache('iptv.epg.{date}.json'.format(date=date))
+
     def test_parse(self):
         """Test parsing date"""
         now = datetime.now(dateutil.tz.tzlocal())
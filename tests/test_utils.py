@@ -4,10 +4,20 @@
 """Tests for StaticHelper functionality"""
 
 from __future__ import absolute_import, division, print_function, unicode_literals
+import io
+import json
+import os
 import unittest
 import utils
 
 
+def html_to_kodi_in_order(text):
+    """Convert VRT HTML content by applying every HTML mapping in order"""
+    for key, val in utils.HTML_MAPPING + utils.HTML_WHITESPACE_MAPPING:
+        text = key.sub(val, text)
+    return utils.unescape(text).strip()
+
+
 class TestUtils(unittest.TestCase):
     """TestCase class"""
 
@@ -23,7 +33,11 @@ class TestUtils(unittest.TestCase):
         self.assertEqual('foo bar', utils.strip_newlines(' \n\n  foo bar \n \n '))
         self.assertEqual('foo bar  baz', utils.strip_newlines(' \n\n  foo bar\n  baz \n \n '))
 
-    # FIXME: Add more examples related to <p>, <br> and &nbsp; later
+    def test_strip_kodi_markup(self):
+        """Test strip_kodi_markup"""
+        self.assertEqual('foo bar baz', utils.strip_kodi_markup(utils.html_to_kodi('foo <em>bar</em> <b>baz</b>')))
+        self.assertEqual('foo [bar]', utils.strip_kodi_markup('[I]foo[/I] [bar]'))
+
     def test_html_to_kodi(self):
         """Test html_to_kodi"""
         self.assertEqual('foo [I]bar[/I] baz', utils.html_to_kodi('foo <i>bar</i> baz'))
@@ -31,6 +45,17 @@ class TestUtils(unittest.TestCase):
         self.assertEqual('foo [B][COLOR={highlighted}]bar[/COLOR][/B] baz', utils.html_to_kodi('foo <em>bar</em> baz'))
         self.assertEqual('blah\n- foo\n- bar\n\nbaz', utils.html_to_kodi('blah<ul><li>foo</li><li>bar</li></ul>baz'))
 
+    def test_html_to_kodi_golden(self):
+        """Test html_to_kodi against a corpus of VRT HTML content, including <p>, <br> and &nbsp; formatting"""
+        with io.open(os.path.join('tests', 'fixtures', 'html_to_kodi.json'), encoding='utf-8') as fdesc:
+            corpus = json.load(fdesc)
+        for example in corpus:
+            utils.HTML_CACHE.clear()
+            self.assertEqual(utils.html_to_kodi(example.get('html')), example.get('kodi'))
+            self.assertEqual(html_to_kodi_in_order(example.get('html')), example.get('kodi'))
+            # Memoized
+            self.assertEqual(utils.html_to_kodi(example.get('html')), example.get('kodi'))
+
     def test_reformat_url(self):
         """Test reformatting URLs (terzake)"""
         short_url = '/vrtnu/a-z/terzake/2019/terzake-d20191017/'
@@ -163,6 +188,22 @@ class TestUtils(unittest.TestCase):
         self.assertEqual('plugin://plugin.video.youtube/foo/bar/', utils.youtube_to_plugin_url('https://www.youtube.com/foo/bar'))
         self.assertEqual('plugin://plugin.video.youtube/foo/bar/baz/', utils.youtube_to_plugin_url('https://www.youtube.com/foo/bar/baz/'))
 
+    def test_chunk_values(self):
+        """chunk_values"""
+        self.assertEqual(utils.chunk_values([], 10), [])
+        self.assertEqual(utils.chunk_values(['aaa', 'bbb', 'ccc', 'dddddddddddd', 'e'], 7), [['aaa', 'bbb'], ['ccc'], ['dddddddddddd'], ['e']])
+        self.assertEqual(utils.chunk_values(['aaa', 'bbb', 'ccc'], 11), [['aaa', 'bbb', 'ccc']])
+
+    def test_parse_iso8601(self):
+        """parse_iso8601"""
+        import dateutil.parser
+        for timestamp in ('2020-07-20T06:00:00.000+02:00', '2020-03-29T01:59:59+0100', '2020-07-20T04:00:00Z',
+                          '2019-07-06T19:35:00', '2019-07-06T19:35', '2020-07-20', 'Mon, 20 Jul 2020 10:00:00 GMT'):
+            parsed = utils.parse_iso8601(timestamp, memo=False)
+            self.assertEqual(parsed, dateutil.parser.parse(timestamp))
+            self.assertEqual(parsed.utcoffset(), dateutil.parser.parse(timestamp).utcoffset())
+        self.assertIs(utils.parse_iso8601('2020-07-20T06:00:00.000+02:00'), utils.parse_iso8601('2020-07-20T06:00:00.000+02:00'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,8 +5,15 @@
 # pylint: disable=invalid-name
 
 from __future__ import absolute_import, division, print_function, unicode_literals
+from io import BytesIO
+import json
+import os
+from time import time
 import unittest
-from webscraper import get_video_attributes
+from kodiutils import WEBSCRAPER_CACHE_DIR, delete_cache, get_cache, update_cache
+import webscraper
+from webscraper import (cache_video_attributes, extract_video_attributes, get_asset_ids, get_cache_file, get_video_attributes,
+                        get_video_attributes_multi)
 
 
 class TestWebScraper(unittest.TestCase):
@@ -37,6 +44,79 @@ class TestWebScraper(unittest.TestCase):
             video_attrs = get_video_attributes(bad_url)
             self.assertEqual(None, video_attrs)
 
+    def test_get_video_attributes_multi(self):
+        """Test getting video attributes of multiple urls from cache, skipping urls that failed recently"""
+        cached_url = 'https://www.vrt.be/vrtnu/a-z/thuis/26/thuis-s26a1/'
+        failed_url = 'https://www.vrt.be/vrtnu/a-z/thuis/26/thuis-s26a2/'
+        try:
+            cache_video_attributes(cached_url, dict(assetpath='/content/dam/vrt/2020/07/20/thuis-s26a1-depot_WP001'))
+            webscraper._FAILED[failed_url] = time()  # pylint: disable=protected-access
+            video_attrs_multi = get_video_attributes_multi([cached_url, failed_url, cached_url])
+            self.assertEqual(list(video_attrs_multi), [cached_url])
+            self.assertEqual(get_asset_ids([cached_url, failed_url]), {cached_url: 'contentdamvrt20200720thuiss26a1depotwp001'})
+        finally:
+            webscraper._FAILED.pop(failed_url, None)  # pylint: disable=protected-access
+            delete_cache(get_cache_file(cached_url), cache_dir=WEBSCRAPER_CACHE_DIR)
+
+    def test_migrate_cache(self):
+        """Test moving the video attributes of the former single cache file into separate cache entries"""
+        vrtnu_url = 'https://www.vrt.be/vrtnu/a-z/thuis/26/thuis-s26a3/'
+        video_attrs = dict(assetpath='/content/dam/vrt/2020/07/20/thuis-s26a3-depot_WP003')
+        try:
+            update_cache('web_video_attrs_multi.json', json.dumps({vrtnu_url: video_attrs}))
+            webscraper._MIGRATED['done'] = False  # pylint: disable=protected-access
+            self.assertEqual(get_video_attributes(vrtnu_url), video_attrs)
+            self.assertIsNone(get_cache('web_video_attrs_multi.json'))
+            self.assertEqual(get_cache(get_cache_file(vrtnu_url), cache_dir=WEBSCRAPER_CACHE_DIR), video_attrs)
+        finally:
+            delete_cache('web_video_attrs_multi.json')
+            delete_cache(get_cache_file(vrtnu_url), cache_dir=WEBSCRAPER_CACHE_DIR)
+
+    def test_extract_video_attributes(self):
+        """Test extracting video attributes from saved VRT NU web pages, in chunks of any size"""
+        with open(os.path.join('tests', 'fixtures', 'vrtnu_episode.html'), 'rb') as fdesc:
+            episode_page = fdesc.read()
+        with open(os.path.join('tests', 'fixtures', 'vrtnu_livestream.html'), 'rb') as fdesc:
+            livestream_page = fdesc.read()
+        for chunk_size in (7, 100, 16384):
+            video_attrs = extract_video_attributes(BytesIO(episode_page), chunk_size=chunk_size)
+            self.assertEqual(video_attrs.get('videoid'), 'vid-4b0df0d4-6a49-4d3d-ab43-a9a4e8271a35')
+            self.assertEqual(video_attrs.get('assetpath'), '/content/dam/vrt/2020/07/20/thuis-s26a4512-depot_WP00171683')
+            self.assertEqual(video_attrs.get('data-title'), 'Thuis & co')
+            self.assertEqual(video_attrs.get('autoplay'), '')
+            self.assertEqual(extract_video_attributes(BytesIO(livestream_page), epg_channel='1H', chunk_size=chunk_size).get('livestream'),
+                             'vualto_canvas_geo')
+            # A livestream without a player, or a page listing multiple livestreams without an EPG channel
+            self.assertIsNone(extract_video_attributes(BytesIO(livestream_page), epg_channel='12', chunk_size=chunk_size))
+            self.assertIsNone(extract_video_attributes(BytesIO(livestream_page), chunk_size=chunk_size))
+
+        # Stop reading once the video player is found
+        response = BytesIO(episode_page)
+        extract_video_attributes(response, chunk_size=100)
+        self.assertLess(response.tell(), len(episode_page))
+        response = BytesIO(livestream_page)
+        extract_video_attributes(response, epg_channel='O8', chunk_size=100)
+        self.assertLess(response.tell(), len(livestream_page))
+
+    def test_extract_compressed_video_attributes(self):
+        """Test extracting video attributes from compressed VRT NU web pages while decompressing them"""
+        import gzip
+        import zlib
+        with open(os.path.join('tests', 'fixtures', 'vrtnu_episode.html'), 'rb') as fdesc:
+            episode_page = fdesc.read()
+        gzip_page = BytesIO()
+        with gzip.GzipFile(fileobj=gzip_page, mode='wb') as fdesc:
+            fdesc.write(episode_page)
+        deflater = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        raw_deflate_page = deflater.compress(episode_page) + deflater.flush()
+        for encoding, page in (('gzip', gzip_page.getvalue()), ('deflate', zlib.compress(episode_page)), ('deflate', raw_deflate_page)):
+            response = BytesIO(page)
+            video_attrs = extract_video_attributes(response, chunk_size=100, encoding=encoding)
+            self.assertEqual(video_attrs.get('videoid'), 'vid-4b0df0d4-6a49-4d3d-ab43-a9a4e8271a35')
+            # Stop reading once the video player is found
+            self.assertLess(response.tell(), len(page))
+        self.assertRaises(zlib.error, extract_video_attributes, BytesIO(b'not compressed'), encoding='gzip')
+
 
 if __name__ == '__main__':
     unittest.main()
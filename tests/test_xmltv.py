@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Unit tests for XMLTV functionality"""
+
+# pylint: disable=invalid-name
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+from datetime import datetime
+import json
+import os
+import unittest
+from xml.etree import ElementTree
+import dateutil.tz
+from kodiutils import delete_cache, update_cache
+from tvguide import TVGuide
+from xmltv import XMLTV
+
+xbmc = __import__('xbmc')
+xbmcaddon = __import__('xbmcaddon')
+xbmcgui = __import__('xbmcgui')
+xbmcplugin = __import__('xbmcplugin')
+xbmcvfs = __import__('xbmcvfs')
+
+addon = xbmcaddon.Addon()
+
+
+class TestXMLTV(unittest.TestCase):
+    """TestCase class"""
+
+    def test_write(self):
+        """Test writing an XMLTV file from a cached schedule"""
+        today = TVGuide.parse('today', datetime.now(dateutil.tz.tzlocal()))
+        cache_file = 'schedule.{date}.json'.format(date=today.strftime('%Y-%m-%d'))
+        schedule = {
+            'O8': [dict(title='Journaal & weer', subtitle='<p>Met <b>Goedele</b></p>', image='//images.vrt.be/journaal.jpg',
+                        startTime='2020-07-20T19:00:00.000+02:00', endTime='2020-07-20T19:45:00.000+02:00')],
+        }
+        path = os.path.join('tests', 'userdata', 'test_xmltv.xml')
+        try:
+            update_cache(cache_file, json.dumps(schedule))
+            self.assertTrue(XMLTV().write(days=0, path=path))
+            self.assertFalse(os.path.exists(path + '.tmp'))
+            tv = ElementTree.parse(path).getroot()
+            self.assertEqual([channel.get('id') for channel in tv.findall('channel')][:2], ['een.be', 'canvas.be'])
+            programme = tv.find('programme')
+            self.assertEqual(programme.get('start'), '20200720190000 +0200')
+            self.assertEqual(programme.get('channel'), 'een.be')
+            self.assertEqual(programme.find('title').text, 'Journaal & weer')
+            self.assertEqual(programme.find('sub-title').text, 'Met Goedele')
+            self.assertEqual(programme.find('icon').get('src'), 'https://images.vrt.be/journaal.jpg')
+        finally:
+            delete_cache(cache_file)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_timestamp(self):
+        """Test converting ISO 8601 timestamps"""
+        self.assertEqual(XMLTV.timestamp('2020-03-29T01:30:00.000Z'), '20200329013000 +0000')
+        self.assertEqual(XMLTV.timestamp('2020-07-20T07:00:00.000+02:00'), '20200720070000 +0200')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -70,6 +70,35 @@ def read_addon_xml(path):
     return {info['name']: info}
 
 
+class Settings(dict):
+    """A settings dictionary that invalidates the add-on's settings snapshot when changed, like a new plugin invocation does"""
+
+    @staticmethod
+    def _invalidate():
+        """Invalidate the kodiutils settings snapshot, if loaded"""
+        import sys
+        kodiutils = sys.modules.get('kodiutils')
+        if kodiutils is not None:
+            kodiutils.invalidate_settings()
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._invalidate()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._invalidate()
+
+    def pop(self, *args):
+        value = dict.pop(self, *args)
+        self._invalidate()
+        return value
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._invalidate()
+
+
 def global_settings():
     """Use the global_settings file"""
     import json
@@ -97,7 +126,7 @@ def global_settings():
         if 'PROXY_PASSWORD' in os.environ:
             print('Using proxy server from environment variable PROXY_PASSWORD')
             settings['network.httpproxypassword'] = os.environ.get('PROXY_PASSWORD')
-    return settings
+    return Settings(settings)
 
 
 def addon_settings(addon_id=None):
@@ -124,7 +153,7 @@ def addon_settings(addon_id=None):
         print("Error: Cannot use 'tests/userdata/credentials.json'")
 
     if addon_id:
-        return settings[addon_id]
+        return Settings(settings[addon_id])
 
     return settings
 
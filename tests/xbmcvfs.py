@@ -33,10 +33,18 @@ def Stat(path):
             assert isinstance(path, basestring)
             self._stat = os.stat(path)
 
+        def st_atime(self):
+            """The xbmcvfs stat class st_atime method"""
+            return self._stat.st_atime
+
         def st_mtime(self):
             """The xbmcvfs stat class st_mtime method"""
             return self._stat.st_mtime
 
+        def st_size(self):
+            """The xbmcvfs stat class st_size method"""
+            return self._stat.st_size
+
     return stat(path)
 
 